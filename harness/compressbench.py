@@ -0,0 +1,219 @@
+"""Measure, and retune, the text compression used between MeshLink nodes (compress_text).
+
+    python -m harness.compressbench
+    python -m harness.compressbench --archive archive.jsonl --history history.db
+    python -m harness.compressbench --train > codebook.txt
+
+Without captures the corpus is generated from MeshLink's own reply formats (weather, aqi,
+hf, info pages, mail, routes, quotes) plus bridged chat. That is a synthetic result, the
+mix and the chat are made up and real traffic usually has more free text, so only figures
+from --archive (the text of a routing_archive_file) or --history (the messages of a
+history_file) say what a node actually saves. Savings are counted on the payload bytes that
+go on air, compressed payloads include the marker byte.
+"""
+import argparse
+import collections
+import json
+import os
+import random
+import sqlite3
+import time
+
+os.environ.setdefault("MESHLINK_WORKER", "1")
+
+import plugins.libcompress as LibCompress
+from plugins.funplugin import quotes
+
+COMMANDS = [
+    "ping - pong!", "time - Sends the current time", "savepos - Saves your position", "weather - Gets the weather",
+    "aqi - Gets the AQI", "hf - Get HF radio conditions", "elevation - Gets your elevation", "quote - A random quote",
+    "coinflip - Flip a coin", "8ball - Magic eight ball", "search - search <terms> [page]", "info - info <page>",
+    "mail - mail <node> <text>", "telemetry - telemetry <node> [metric]", "route - route <node>",
+]
+BANDS = ["80m-40m", "30m-20m", "17m-15m", "12m-10m"]
+CONDITIONS = ["Good", "Fair", "Poor"]
+CHAT = [
+    "Hello from {place}, anyone copy?", "Good morning mesh!", "testing 1 2 3", "copy that, thanks",
+    "Is anyone on the repeater near {place}?", "just set up a new node at {place}", "signal is good here",
+    "heading out to {place} for the weekend", "anyone got a route to {place}?", "thanks for the relay",
+    "what antenna are you running?", "I can hear you fine, SNR is good", "battery is getting low, signing off",
+    "net check in tonight at 8pm", "weather looks bad this afternoon", "the node on the hill is back up",
+    "Did anyone see the message from {name}?", "I'll be on the trail near {place} tomorrow",
+    "Power is out in {place}, running on solar", "checking in from {place}", "roger, see you there",
+]
+
+# names are random so the codebook learns the formats around them, not this file's names
+def name(rng):
+    return "".join(rng.choice("abcdefghijklmnopqrstuvwxyz0123456789") for _ in range(rng.randrange(4, 9)))
+
+def short(rng):
+    return "".join(rng.choice("ABCDEFGHIJKLMNOPQRSTUVWXYZ0123456789") for _ in range(4))
+
+def place(rng):
+    return name(rng).capitalize()
+
+def chat(rng):
+    return rng.choice(CHAT).format(place=place(rng), name=name(rng))
+
+def weather(rng):
+    hour = rng.randrange(24)
+    temp = rng.randrange(20, 95)
+    lines = []
+    for i in range(8):
+        temp += rng.randrange(-3, 4)
+        lines.append(f"{(hour + i) % 24} {temp}F {rng.choice([0, 0, 0, 5, 10, 15, 20, 35, 50, 80])}%\n")
+    return "".join(lines) + rng.choice(["(Your position)", "(Config position)"])
+
+def aqi(rng):
+    names = ["AQI", "PM2.5", "PM10", "NO2", "CO", "O3", "SO2"]
+    return "".join(f"{n}: {rng.randrange(0, 90)}\n" for n in names) + rng.choice(["(Your position)", "(Config position)"])
+
+def hf(rng):
+    return "\n".join(f"{t}{band} {rng.choice(CONDITIONS)}" for t in "dn" for band in BANDS)
+
+def info_pages(max_len=200):
+    pages, page = [], ""
+    for line in COMMANDS:
+        if len(page) + len(line) + 1 > max_len:
+            pages.append(page.rstrip("\n"))
+            page = ""
+        page += line + "\n"
+    pages.append(page.rstrip("\n"))
+    return pages
+
+def generate(seed, count, chat_weight=14):
+    """(kind, text) pairs in roughly the mix a busy MeshLink sends"""
+    rng = random.Random(seed)
+    pages = info_pages()
+    # without chat, mail carries no body, quoting the quotes there would repeat them verbatim
+    body = chat if chat_weight else (lambda rng: "")
+    makers = [
+        ("weather", 8, lambda: weather(rng)),
+        ("aqi", 4, lambda: aqi(rng)),
+        ("hf", 3, lambda: hf(rng)),
+        ("info", 3, lambda: rng.choice(pages)),
+        ("info", 1, lambda: f"<- info ->\nWelcome to MeshLink!\nUse '$info <page>' to view different pages.\nThis is page 0/{len(pages)}"),
+        ("time", 2, lambda: time.strftime("%H:%M:%S", time.gmtime(rng.randrange(86400)))),
+        ("time", 1, lambda: "pong"),
+        ("quote", 3, lambda: rng.choice(quotes)),
+        ("elevation", 2, lambda: f"{short(rng)} elevation is {rng.randrange(0, 2000)}.0m asl"),
+        ("mail", 2, lambda: f"Mail from {name(rng)} ({rng.randrange(300)}m ago): {body(rng)}"),
+        ("mail", 1, lambda: f"Mail for {short(rng)} saved ({rng.randrange(1, 5)} waiting)"),
+        ("route", 2, lambda: f"{short(rng)} via {short(rng)} > {short(rng)} ({rng.randrange(2, 5)} links, heard {rng.randrange(1, 4)} hops away)"),
+        ("chat", chat_weight, lambda: f"{name(rng)}> {chat(rng)}"),
+    ]
+    makers = [m for m in makers if m[1]]
+    weights = [w for _, w, _ in makers]
+    picks = rng.choices(makers, weights, k=count)
+    return [(kind, make()) for kind, _, make in picks]
+
+def load_archive(path):
+    texts = []
+    with open(path, encoding="utf-8") as f:
+        for line in f:
+            try:
+                record = json.loads(line)
+            except ValueError:
+                continue
+            if record.get("text"):
+                texts.append(record["text"])
+    return texts
+
+def load_history(path):
+    conn = sqlite3.connect(path)
+    return [row[0] for row in conn.execute("SELECT text FROM messages")]
+
+def _overlaps(a, b):
+    if a in b or b in a:
+        return True
+    return any(a[-k:] == b[:k] or b[-k:] == a[:k] for k in range(2, min(len(a), len(b))))
+
+def _split(fragments, entry):
+    out = []
+    for fragment in fragments:
+        out += [part for part in fragment.split(entry) if len(part) > 1]
+    return out
+
+def train(corpus, size=LibCompress._LITERAL, max_len=16, min_count=4, per_round=12):
+    """Greedy codebook: every common byte gets a code so literals stay rare, the remaining codes
+    go to the substrings that save the most bytes. Each round takes a few of the best ones that
+    do not overlap anything already in the book, cuts them out of the corpus and counts again, so
+    shifted copies and prefixes of the same phrase do not fill the book. Every distinct message
+    counts once, otherwise a help page or quote that is sent often ends up in the book verbatim"""
+    fragments = [t.encode() for t in dict.fromkeys(corpus)]
+    singles = collections.Counter(b for d in fragments for b in d)
+    book = [bytes([b]) for b, n in singles.most_common() if n >= min_count and b < 0x80]
+    while len(book) < size:
+        grams = collections.Counter()
+        for d in fragments:
+            for n in range(2, min(max_len, len(d)) + 1):
+                for i in range(len(d) - n + 1):
+                    grams[d[i:i + n]] += 1
+        ranked = sorted((g for g, n in grams.items() if n >= min_count), key=lambda g: grams[g] * (len(g) - 1), reverse=True)
+        if not ranked:
+            break
+        chosen = []
+        for g in ranked:
+            if len(chosen) == per_round or len(book) + len(chosen) == size:
+                break
+            if not any(_overlaps(g, c) for c in chosen) and not any(len(b) > 1 and _overlaps(g, b) for b in book):
+                chosen.append(g)
+        if not chosen:
+            break
+        for entry in chosen:
+            book.append(entry)
+            fragments = _split(fragments, entry)
+    return [b.decode("utf-8", "replace") for b in book]
+
+def report(pairs):
+    totals = collections.defaultdict(lambda: [0, 0, 0])
+    for kind, text in pairs:
+        raw = len(text.encode())
+        encoded = LibCompress.encode(text)
+        assert LibCompress.decode(encoded) == text
+        # send_text falls back to plain text when compression does not help, the header bytes count
+        for key in (kind, "total"):
+            totals[key][0] += 1
+            totals[key][1] += raw
+            totals[key][2] += min(raw, LibCompress.HEADER + len(encoded))
+    for kind, (count, plain, packed) in sorted(totals.items(), key=lambda item: item[0] == "total"):
+        print(f"{kind:<10} {count:>6} messages {plain:>9} bytes -> {packed:>9} bytes, "
+              f"avg {plain / count:.0f} -> {packed / count:.0f}, {100 * (1 - packed / plain):.1f}% less airtime")
+
+def main():
+    parser = argparse.ArgumentParser(description="Measure or retune MeshLink text compression")
+    parser.add_argument("--archive", help="routing_archive_file to use as a captured corpus")
+    parser.add_argument("--history", help="history_file to use as a captured corpus")
+    parser.add_argument("--count", type=int, default=20000, help="generated messages")
+    parser.add_argument("--train", action="store_true", help="print a codebook tuned on the corpus")
+    args = parser.parse_args()
+
+    captured = []
+    if args.archive:
+        captured += load_archive(args.archive)
+    if args.history:
+        captured += load_history(args.history)
+
+    if args.train:
+        # the chat lines here are made up, leave them out so the book learns the reply formats and
+        # plain english from the quotes instead of this file's sentences
+        corpus = captured or [text for _, text in generate(1, min(args.count, 5000), chat_weight=0)]
+        line = "   "
+        for entry in train(corpus):
+            token = " " + json.dumps(entry, ensure_ascii=False) + ","
+            if len(line) + len(token) > 110:
+                print(line)
+                line = "   "
+            line += token
+        print(line)
+        return
+
+    if captured:
+        report([("captured", text) for text in captured])
+    else:
+        # the codebook was tuned on seed 1, measure on messages it has not seen
+        print("synthetic corpus, generated reply formats and made up chat, not captured traffic")
+        report(generate(2, args.count))
+
+if __name__ == "__main__":
+    main()
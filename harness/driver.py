@@ -0,0 +1,357 @@
+"""Run main.py against a fake radio and a local Discord stand-in and report latency,
+throughput, drops and memory growth.
+
+    python -m harness.driver --duration 3600 --rate 5 --discord-rate 1
+    python -m harness.driver --ramp --rate 1 --ramp-step 60
+    python -m harness.driver --replay routing-archive.jsonl --set info_digest_window=30
+"""
+import argparse
+import json
+import os
+import re
+import resource
+import runpy
+import signal
+import sys
+import tempfile
+import threading
+import time
+import yaml
+
+REPO = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, REPO)
+
+from harness.fakeradio import FakeInterface, PacketSource
+from harness.fakediscord import FakeDiscord
+
+MESSAGE_CHANNEL = 900000000000000101
+INFO_CHANNEL = 900000000000000102
+UP_TOKEN = re.compile(r"#h(\d+)#")
+DOWN_TOKEN = re.compile(r"#d(\d+)#")
+
+def rss_mb():
+    try:
+        with open("/proc/self/statm") as f:
+            return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE") / 1048576
+    except OSError:
+        # max rss, in kilobytes on linux and bytes on macos
+        scale = 1048576 if sys.platform == "darwin" else 1024
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / scale
+
+def percentile(values, q):
+    if not values:
+        return None
+    values = sorted(values)
+    return values[min(len(values) - 1, int(q * len(values)))]
+
+def fmt_ms(value):
+    return "-" if value is None else f"{value * 1000:.1f}ms"
+
+class Direction():
+    """Messages carrying a #<tag><seq># token, matched when they come out the other side"""
+
+    def __init__(self, name, pattern):
+        self.name = name
+        self.pattern = pattern
+        self.pending = {}
+        self.latencies = []
+        self.arrivals = []
+        self.offered = 0
+        self.duplicates = 0
+        self._seq = 0
+        self._lock = threading.Lock()
+
+    def token(self, tag):
+        with self._lock:
+            self._seq += 1
+            return self._seq, f"#{tag}{self._seq}#"
+
+    def sent(self, seq):
+        with self._lock:
+            self.pending[seq] = time.monotonic()
+            self.offered += 1
+
+    def observed(self, text, when):
+        for match in self.pattern.findall(text):
+            with self._lock:
+                start = self.pending.pop(int(match), None)
+                if start is None:
+                    self.duplicates += 1
+                    continue
+                self.latencies.append(when - start)
+                self.arrivals.append(when)
+
+    def delivered_between(self, start, end):
+        with self._lock:
+            return sum(1 for t in self.arrivals if start <= t < end)
+
+    def summary(self, since=0):
+        with self._lock:
+            latencies = self.latencies[since:]
+            return {
+                "offered": self.offered,
+                "delivered": len(self.latencies),
+                "pending": len(self.pending),
+                "duplicates": self.duplicates,
+                "p50": percentile(latencies, 0.50),
+                "p95": percentile(latencies, 0.95),
+                "p99": percentile(latencies, 0.99),
+                "max": max(latencies) if latencies else None,
+            }
+
+class Harness():
+
+    def __init__(self, args):
+        self.args = args
+        self.up = Direction("radio>discord", UP_TOKEN)
+        self.down = Direction("discord>radio", DOWN_TOKEN)
+        self.interface = None
+        self.rate = args.rate
+        self.started = time.monotonic()
+        self.rss = []
+        self.steps = []
+        self.stopping = threading.Event()
+        self.discord = FakeDiscord([MESSAGE_CHANNEL, INFO_CHANNEL], latency=args.discord_latency / 1000,
+                                   on_message=lambda r: self.up.observed(r["content"], r["time"]))
+
+    def make_interface(self, *args, **kwargs):
+        self.interface = FakeInterface(nodes=self.args.nodes, ack_ratio=self.args.ack_ratio,
+                                       on_send=lambda r: self.down.observed(r.get("text") or "", r["time"]))
+        self.source = PacketSource(self.interface, self.args.replay, self.args.text_ratio)
+        return self.interface
+
+    def write_config(self, workdir):
+        with open(self.args.config, "r") as f:
+            config = yaml.safe_load(f)
+        config.update({
+            "use_discord": True,
+            "token": "harness",
+            "message_channel_ids": [MESSAGE_CHANNEL],
+            "info_channel_ids": [INFO_CHANNEL],
+            "secondary_channel_message_ids": [],
+            "check_for_updates": False,
+            "ignore_update_prompt": True,
+            "use_serial": False,
+            "radio_ip": "127.0.0.1",
+            "permit_broadcast_of_discord_messages": True,
+            "ping_on_messages": False,
+        })
+        for item in self.args.set:
+            key, _, value = item.partition("=")
+            config[key] = yaml.safe_load(value)
+        self.use_mqtt = bool(config.get("use_mqtt"))
+        if config.get("use_webhooks"):
+            config["webhook_urls"] = {MESSAGE_CHANNEL: self.discord.webhook_url(MESSAGE_CHANNEL)}
+        os.makedirs(os.path.join(workdir, "plugins"), exist_ok=True)
+        with open(os.path.join(workdir, "config.yml"), "w") as f:
+            yaml.safe_dump(config, f)
+        enabled = self.args.plugins or os.path.join(REPO, "plugins", "plugins-enabled")
+        with open(enabled, "r") as src, open(os.path.join(workdir, "plugins", "plugins-enabled"), "w") as dst:
+            dst.write(src.read())
+
+    def elapsed(self):
+        return time.monotonic() - self.started
+
+    def radio_connected(self):
+        # in mqtt mode MeshLink talks to a broker fed by harness.mqttpublish, not the fake radio
+        return self.interface is not None or self.use_mqtt
+
+    def wait_until_connected(self):
+        while not self.stopping.is_set() and (not self.radio_connected() or not self.discord.connected()):
+            time.sleep(0.1)
+        # let the bot finish processing READY and GUILD_CREATE
+        time.sleep(2)
+
+    def paced(self, rate_of, send):
+        next_at = time.monotonic()
+        while not self.stopping.is_set():
+            rate = rate_of()
+            if rate <= 0:
+                time.sleep(0.5)
+                next_at = time.monotonic()
+                continue
+            send()
+            next_at += 1 / rate
+            delay = next_at - time.monotonic()
+            if delay > 0:
+                time.sleep(delay)
+            elif delay < -1:
+                # fell behind, do not burst to catch up
+                next_at = time.monotonic()
+
+    def radio_load(self):
+        self.wait_until_connected()
+        if self.interface is None:
+            return
+
+        def send():
+            seq, token = self.up.token("h")
+            packet = self.source.next("load " + token)
+            traced = token in packet.get("decoded", {}).get("text", "")
+            if traced:
+                self.up.sent(seq)
+            self.interface.inject(packet)
+        self.paced(lambda: self.rate, send)
+
+    def discord_load(self):
+        self.wait_until_connected()
+        prefix = self.config_value("discord_prefix") + "send "
+
+        def send():
+            seq, token = self.down.token("d")
+            self.down.sent(seq)
+            self.discord.inject(MESSAGE_CHANNEL, prefix + token)
+        self.paced(lambda: self.args.discord_rate, send)
+
+    def config_value(self, key):
+        import cfg
+        while key not in cfg.config:
+            time.sleep(0.1)
+        return cfg.config[key]
+
+    def ramp(self):
+        saturated = 0
+        self.wait_until_connected()
+        offered_before = self.up.offered
+        while not self.stopping.wait(self.args.ramp_step):
+            end = time.monotonic()
+            # what the load thread managed to inject, it falls behind the target at high rates
+            offered = (self.up.offered - offered_before) / self.args.ramp_step
+            offered_before = self.up.offered
+            delivered = self.up.delivered_between(end - self.args.ramp_step, end) / self.args.ramp_step
+            self.steps.append({"rate": self.rate, "offered_per_s": offered, "delivered_per_s": delivered})
+            print(f"[HARNESS] ramp step {self.rate:.1f}/s offered {offered:.1f}/s delivered {delivered:.1f}/s", flush=True)
+            if delivered < offered * 0.9:
+                saturated += 1
+                if saturated >= 2:
+                    return
+            else:
+                saturated = 0
+                self.rate *= self.args.ramp_factor
+
+    def event_bus_drops(self):
+        bus = sys.modules.get("plugins.libeventbus")
+        if bus is None:
+            return {}
+        return {s["name"]: s["dropped"] for s in bus.stats() if s["dropped"]}
+
+    def report_line(self, up_since, down_since):
+        up = self.up.summary(up_since)
+        down = self.down.summary(down_since)
+        rss = rss_mb()
+        self.rss.append((self.elapsed(), rss))
+        print(f"[HARNESS] {self.elapsed():7.0f}s "
+              f"{self.up.name} {up['delivered']}/{up['offered']} p50 {fmt_ms(up['p50'])} p95 {fmt_ms(up['p95'])} p99 {fmt_ms(up['p99'])} | "
+              f"{self.down.name} {down['delivered']}/{down['offered']} p50 {fmt_ms(down['p50'])} p99 {fmt_ms(down['p99'])} | "
+              f"rate {self.rate:.1f}/s rss {rss:.1f}MB", flush=True)
+
+    def monitor(self):
+        self.wait_until_connected()
+        self.started = time.monotonic()
+        self.rss.append((0, rss_mb()))
+        up_since = down_since = 0
+        deadline = self.started + self.args.duration
+        while time.monotonic() < deadline:
+            time.sleep(min(self.args.report_interval, max(0, deadline - time.monotonic())))
+            self.report_line(up_since, down_since)
+            up_since, down_since = len(self.up.latencies), len(self.down.latencies)
+        self.stopping.set()
+        time.sleep(self.args.grace)
+        self.finish()
+
+    def rss_growth_per_hour(self):
+        if len(self.rss) < 2:
+            return 0.0
+        n = len(self.rss)
+        mean_t = sum(t for t, _ in self.rss) / n
+        mean_m = sum(m for _, m in self.rss) / n
+        var = sum((t - mean_t) ** 2 for t, _ in self.rss)
+        if var == 0:
+            return 0.0
+        slope = sum((t - mean_t) * (m - mean_m) for t, m in self.rss) / var
+        return slope * 3600
+
+    def finish(self):
+        elapsed = self.elapsed()
+        report = {
+            "duration_s": elapsed,
+            "radio_to_discord": self.up.summary(),
+            "discord_to_radio": self.down.summary(),
+            "throughput_per_s": len(self.up.latencies) / self.args.duration,
+            "ceiling_per_s": max((s["delivered_per_s"] for s in self.steps), default=None),
+            "ramp": self.steps,
+            "event_bus_dropped": self.event_bus_drops(),
+            "rss_mb": self.rss,
+            "rss_growth_mb_per_hour": self.rss_growth_per_hour(),
+            "discord_requests": self.discord.requests,
+        }
+        print("[HARNESS] ---- report ----")
+        for key in ("radio_to_discord", "discord_to_radio"):
+            s = report[key]
+            print(f"[HARNESS] {key}: {s['delivered']}/{s['offered']} delivered, {s['pending']} dropped, "
+                  f"{s['duplicates']} duplicates, p50 {fmt_ms(s['p50'])} p95 {fmt_ms(s['p95'])} "
+                  f"p99 {fmt_ms(s['p99'])} max {fmt_ms(s['max'])}")
+        print(f"[HARNESS] throughput {report['throughput_per_s']:.2f}/s"
+              + (f", ceiling {report['ceiling_per_s']:.1f}/s" if report["ceiling_per_s"] is not None else ""))
+        print(f"[HARNESS] event bus dropped {report['event_bus_dropped'] or 'nothing'}")
+        print(f"[HARNESS] rss {self.rss[0][1]:.1f}MB -> {self.rss[-1][1]:.1f}MB, "
+              f"{report['rss_growth_mb_per_hour']:+.2f}MB/hour", flush=True)
+        if self.args.json:
+            with open(self.args.json, "w") as f:
+                json.dump(report, f, indent=2)
+        self.shutdown()
+
+    def shutdown(self):
+        # stop MeshLink the way ctrl-c does, give up if it hangs
+        threading.Timer(15, lambda: os._exit(1)).start()
+        os.kill(os.getpid(), signal.SIGINT)
+
+    def run(self):
+        workdir = self.args.workdir or tempfile.mkdtemp(prefix="meshlink-harness-")
+        self.discord.start()
+        self.discord.patch_client_library()
+        self.write_config(workdir)
+        os.chdir(workdir)
+        print(f"[HARNESS] working directory {workdir}, fake discord on {self.discord.api_base}", flush=True)
+
+        import meshtastic.tcp_interface
+        import meshtastic.serial_interface
+        meshtastic.tcp_interface.TCPInterface = self.make_interface
+        meshtastic.serial_interface.SerialInterface = self.make_interface
+
+        threading.Thread(target=self.radio_load, name="harness-radio", daemon=True).start()
+        if self.args.discord_rate > 0:
+            threading.Thread(target=self.discord_load, name="harness-discord", daemon=True).start()
+        if self.args.ramp:
+            threading.Thread(target=self.ramp, name="harness-ramp", daemon=True).start()
+        threading.Thread(target=self.monitor, name="harness-monitor", daemon=True).start()
+        try:
+            runpy.run_path(os.path.join(REPO, "main.py"), run_name="__main__")
+        except SystemExit:
+            pass
+        os._exit(0)
+
+def main():
+    parser = argparse.ArgumentParser(description="Soak test MeshLink against a fake radio and Discord")
+    parser.add_argument("--duration", type=float, default=3600, help="seconds of load")
+    parser.add_argument("--rate", type=float, default=2, help="packets per second from the radio")
+    parser.add_argument("--discord-rate", type=float, default=0.5, help="$send messages per second from Discord")
+    parser.add_argument("--text-ratio", type=float, default=1.0, help="share of radio packets that are text, the rest are positions")
+    parser.add_argument("--nodes", type=int, default=20, help="nodes in the fake node db")
+    parser.add_argument("--replay", help="routing archive jsonl to replay instead of synthetic packets")
+    parser.add_argument("--ack-ratio", type=float, default=0.9, help="share of acked sends the fake radio acks, the rest are nak'd")
+    parser.add_argument("--ramp", action="store_true", help="raise the radio rate until delivery falls behind")
+    parser.add_argument("--ramp-step", type=float, default=60, help="seconds per ramp step")
+    parser.add_argument("--ramp-factor", type=float, default=2, help="rate multiplier per ramp step")
+    parser.add_argument("--discord-latency", type=float, default=0, help="ms added to every Discord REST call")
+    parser.add_argument("--report-interval", type=float, default=60, help="seconds between report lines")
+    parser.add_argument("--grace", type=float, default=10, help="seconds to wait for stragglers before counting drops")
+    parser.add_argument("--config", default=os.path.join(REPO, "config-example copy.yml"), help="base config")
+    parser.add_argument("--plugins", help="plugins-enabled file to use")
+    parser.add_argument("--set", action="append", default=[], metavar="KEY=VALUE", help="override a config value (yaml)")
+    parser.add_argument("--workdir", help="directory for config.yml and data files, temporary by default")
+    parser.add_argument("--json", help="write the final report here")
+    Harness(parser.parse_args()).run()
+
+if __name__ == "__main__":
+    main()
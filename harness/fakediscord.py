@@ -0,0 +1,258 @@
+import asyncio
+import itertools
+import json
+import threading
+import time
+from datetime import datetime, timezone
+from aiohttp import web, WSMsgType
+
+DISCORD_EPOCH = 1420070400000
+BOT_ID = 900000000000000001
+USER_ID = 900000000000000002
+
+def _json(data, status=200):
+    # discord.py only parses bodies whose content type is exactly application/json
+    return web.Response(body=json.dumps(data).encode(), status=status, headers={"Content-Type": "application/json"})
+
+class FakeDiscord():
+    """Local stand-in for the Discord REST API and gateway, enough for discord.py to log in,
+    receive MESSAGE_CREATE events and post messages"""
+
+    def __init__(self, channel_ids, host="127.0.0.1", port=0, latency=0.0, on_message=None):
+        self.channel_ids = list(channel_ids)
+        self.guild_id = self._snowflake()
+        self.host = host
+        self.port = port
+        self.latency = latency
+        self.on_message = on_message
+        self.posted = []
+        self.requests = 0
+        self._sockets = set()
+        self._seq = itertools.count(1)
+        self._webhooks = {}
+        self.loop = asyncio.new_event_loop()
+        self._ready = threading.Event()
+
+    _counter = itertools.count()
+
+    @classmethod
+    def _snowflake(cls):
+        ms = int(time.time() * 1000) - DISCORD_EPOCH
+        return (ms << 22) | (next(cls._counter) & 0x3fffff)
+
+    def start(self):
+        threading.Thread(target=self._run, name="fake-discord", daemon=True).start()
+        self._ready.wait(10)
+        return self
+
+    @property
+    def api_base(self):
+        return f"http://{self.host}:{self.port}/api/v10"
+
+    @property
+    def gateway_url(self):
+        return f"ws://{self.host}:{self.port}/gateway/"
+
+    def patch_client_library(self):
+        import discord.http
+        import discord.gateway
+        import yarl
+        discord.http.Route.BASE = self.api_base
+        discord.gateway.DiscordWebSocket.DEFAULT_GATEWAY = yarl.URL(self.gateway_url)
+
+    def _run(self):
+        asyncio.set_event_loop(self.loop)
+        app = web.Application(client_max_size=32 * 1024 * 1024)
+        app.router.add_get("/gateway/", self._gateway)
+        app.router.add_get("/api/v10/users/@me", self._me)
+        app.router.add_get("/api/v10/oauth2/applications/@me", self._application)
+        app.router.add_get("/api/v10/gateway", self._gateway_info)
+        app.router.add_get("/api/v10/gateway/bot", self._gateway_info)
+        app.router.add_post("/api/v10/channels/{channel}/messages", self._create_message)
+        app.router.add_patch("/api/v10/channels/{channel}/messages/{message}", self._edit_message)
+        app.router.add_post("/api/v10/channels/{channel}/typing", self._no_content)
+        app.router.add_route("*", "/api/v10/channels/{channel}/messages/{message}/reactions/{rest:.*}", self._no_content)
+        app.router.add_get("/api/v10/channels/{channel}/webhooks", self._list_webhooks)
+        app.router.add_post("/api/v10/channels/{channel}/webhooks", self._create_webhook)
+        app.router.add_post("/api/v10/webhooks/{webhook}/{token}", self._execute_webhook)
+        app.router.add_route("*", "/{rest:.*}", self._unknown)
+        runner = web.AppRunner(app, access_log=None)
+        self.loop.run_until_complete(runner.setup())
+        site = web.TCPSite(runner, self.host, self.port)
+        self.loop.run_until_complete(site.start())
+        self.port = site._server.sockets[0].getsockname()[1]
+        self._ready.set()
+        self.loop.run_forever()
+
+    # payloads
+
+    def _user(self, user_id, name, bot=False):
+        return {"id": str(user_id), "username": name, "discriminator": "0", "global_name": name,
+                "avatar": None, "bot": bot}
+
+    def _channel(self, channel_id, position):
+        return {"id": str(channel_id), "type": 0, "guild_id": str(self.guild_id), "name": f"harness-{position}",
+                "position": position, "permission_overwrites": [], "nsfw": False, "parent_id": None,
+                "topic": None, "last_message_id": None, "rate_limit_per_user": 0}
+
+    def _guild(self):
+        return {
+            "id": str(self.guild_id), "name": "MeshLink harness", "icon": None, "owner_id": str(USER_ID),
+            "unavailable": False, "large": False, "member_count": 2, "features": [], "emojis": [], "stickers": [],
+            "verification_level": 0, "default_message_notifications": 0, "explicit_content_filter": 0,
+            "mfa_level": 0, "premium_tier": 0, "preferred_locale": "en-US", "nsfw_level": 0,
+            "roles": [{"id": str(self.guild_id), "name": "@everyone", "permissions": "8", "position": 0,
+                       "color": 0, "hoist": False, "managed": False, "mentionable": False}],
+            "channels": [self._channel(cid, i) for i, cid in enumerate(self.channel_ids)],
+            "members": [], "voice_states": [], "presences": [], "threads": [], "stage_instances": [],
+            "guild_scheduled_events": [], "joined_at": datetime.now(timezone.utc).isoformat(),
+        }
+
+    def _message(self, channel_id, author, content, reference=None, webhook_id=None):
+        message = {
+            "id": str(self._snowflake()), "channel_id": str(channel_id), "guild_id": str(self.guild_id),
+            "author": author, "content": content, "timestamp": datetime.now(timezone.utc).isoformat(),
+            "edited_timestamp": None, "tts": False, "mention_everyone": False, "mentions": [],
+            "mention_roles": [], "attachments": [], "embeds": [], "pinned": False, "flags": 0,
+            "type": 19 if reference else 0,
+        }
+        if reference:
+            message["message_reference"] = reference
+            message["referenced_message"] = None
+        if webhook_id:
+            message["webhook_id"] = str(webhook_id)
+        return message
+
+    # gateway
+
+    async def _gateway(self, request):
+        ws = web.WebSocketResponse(max_msg_size=0)
+        await ws.prepare(request)
+        await ws.send_str(json.dumps({"op": 10, "d": {"heartbeat_interval": 41250}}))
+        async for msg in ws:
+            if msg.type != WSMsgType.TEXT:
+                continue
+            payload = json.loads(msg.data)
+            if payload["op"] == 1:
+                await ws.send_str(json.dumps({"op": 11}))
+            elif payload["op"] == 2:
+                await self._dispatch(ws, "READY", {
+                    "v": 10, "user": self._user(BOT_ID, "MeshLink", bot=True), "guilds": [{"id": str(self.guild_id), "unavailable": True}],
+                    "session_id": "harness", "resume_gateway_url": self.gateway_url, "shard": [0, 1],
+                    "application": {"id": str(BOT_ID), "flags": 1 << 19},
+                })
+                await self._dispatch(ws, "GUILD_CREATE", self._guild())
+                self._sockets.add(ws)
+            elif payload["op"] == 6:
+                await self._dispatch(ws, "RESUMED", {})
+                self._sockets.add(ws)
+        self._sockets.discard(ws)
+        return ws
+
+    async def _dispatch(self, ws, event, data):
+        await ws.send_str(json.dumps({"op": 0, "t": event, "s": next(self._seq), "d": data}))
+
+    async def _broadcast(self, event, data):
+        for ws in list(self._sockets):
+            try:
+                await self._dispatch(ws, event, data)
+            except ConnectionResetError:
+                self._sockets.discard(ws)
+
+    def connected(self):
+        return bool(self._sockets)
+
+    def inject(self, channel_id, content, author="harness"):
+        """Send a user message to the bot, safe to call from any thread"""
+        message = self._message(channel_id, self._user(USER_ID, author), content)
+        asyncio.run_coroutine_threadsafe(self._broadcast("MESSAGE_CREATE", message), self.loop)
+
+    # rest
+
+    async def _record(self, request, channel_id, content, webhook_id=None):
+        self.requests += 1
+        if self.latency:
+            await asyncio.sleep(self.latency)
+        record = {"time": time.monotonic(), "channel": int(channel_id), "content": content or ""}
+        self.posted.append(record)
+        if self.on_message:
+            self.on_message(record)
+
+    async def _body(self, request):
+        if request.content_type.startswith("multipart/"):
+            form = await request.post()
+            return json.loads(form.get("payload_json", "{}"))
+        if request.can_read_body:
+            return await request.json()
+        return {}
+
+    async def _me(self, request):
+        return _json(self._user(BOT_ID, "MeshLink", bot=True))
+
+    async def _application(self, request):
+        return _json({"id": str(BOT_ID), "name": "MeshLink", "icon": None, "description": "", "bot_public": True,
+                      "bot_require_code_grant": False, "verify_key": "", "flags": 1 << 19,
+                      "owner": self._user(USER_ID, "harness"), "team": None})
+
+    async def _gateway_info(self, request):
+        return _json({"url": self.gateway_url, "shards": 1, "session_start_limit": {
+            "total": 1000, "remaining": 1000, "reset_after": 0, "max_concurrency": 1}})
+
+    async def _create_message(self, request):
+        channel_id = request.match_info["channel"]
+        body = await self._body(request)
+        await self._record(request, channel_id, body.get("content"))
+        message = self._message(channel_id, self._user(BOT_ID, "MeshLink", bot=True), body.get("content", ""),
+                                body.get("message_reference"))
+        # discord echoes our own messages back over the gateway
+        await self._broadcast("MESSAGE_CREATE", message)
+        return _json(message)
+
+    async def _edit_message(self, request):
+        channel_id = request.match_info["channel"]
+        body = await self._body(request)
+        await self._record(request, channel_id, body.get("content"))
+        message = self._message(channel_id, self._user(BOT_ID, "MeshLink", bot=True), body.get("content", ""))
+        message["id"] = request.match_info["message"]
+        return _json(message)
+
+    async def _list_webhooks(self, request):
+        channel_id = request.match_info["channel"]
+        return _json([w for w in self._webhooks.values() if w["channel_id"] == channel_id])
+
+    def _add_webhook(self, channel_id, name):
+        webhook_id = str(self._snowflake())
+        webhook = {"id": webhook_id, "type": 1, "token": "harness" + webhook_id, "name": name,
+                   "channel_id": str(channel_id), "guild_id": str(self.guild_id),
+                   "avatar": None, "application_id": str(BOT_ID), "user": self._user(BOT_ID, "MeshLink", bot=True)}
+        self._webhooks[webhook_id] = webhook
+        return webhook
+
+    def webhook_url(self, channel_id):
+        """Webhook on this server, discord.py always builds discord.com urls for the ones it creates"""
+        webhook = self._add_webhook(channel_id, "MeshLink")
+        return f"{self.api_base}/webhooks/{webhook['id']}/{webhook['token']}"
+
+    async def _create_webhook(self, request):
+        body = await self._body(request)
+        return _json(self._add_webhook(request.match_info["channel"], body.get("name")))
+
+    async def _execute_webhook(self, request):
+        webhook = self._webhooks.get(request.match_info["webhook"])
+        if webhook is None:
+            return _json({"message": "Unknown Webhook", "code": 10015}, status=404)
+        body = await self._body(request)
+        await self._record(request, webhook["channel_id"], body.get("content"), webhook["id"])
+        author = self._user(webhook["id"], body.get("username") or webhook["name"], bot=True)
+        message = self._message(webhook["channel_id"], author, body.get("content", ""), webhook_id=webhook["id"])
+        await self._broadcast("MESSAGE_CREATE", message)
+        if request.query.get("wait") == "true":
+            return _json(message)
+        return web.Response(status=204)
+
+    async def _no_content(self, request):
+        self.requests += 1
+        return web.Response(status=204)
+
+    async def _unknown(self, request):
+        return _json({"message": "Unknown route " + request.path, "code": 0}, status=404)
@@ -0,0 +1,161 @@
+import itertools
+import json
+import random
+import threading
+import time
+from pubsub import pub
+
+BROADCAST_NUM = 0xffffffff
+LOCAL_NUM = 0x4d4c0001
+
+def node_id(num):
+    return "!" + format(num, "08x")
+
+class FakeNode():
+    def __init__(self, num):
+        self.nodeNum = num
+
+class FakeInterface():
+    """Stands in for TCPInterface/SerialInterface, records everything sent to the radio"""
+
+    def __init__(self, nodes=20, on_send=None, ack_ratio=None, **kwargs):
+        self.localNode = FakeNode(LOCAL_NUM)
+        self.myInfo = {"myNodeNum": LOCAL_NUM}
+        self.nodes = {}
+        self.nodesByNum = {}
+        self.sent = []
+        self.on_send = on_send
+        self.ack_ratio = ack_ratio
+        self._ids = itertools.count(random.randint(1, 1 << 30))
+        self._add_node(LOCAL_NUM, "MeshLink harness", "MLH")
+        for i in range(nodes):
+            self._add_node(0x10000000 + i, f"Harness node {i}", f"H{i:03d}"[:4],
+                           45.0 + random.random(), -122.0 - random.random())
+        # the real interfaces announce the connection from their reader thread
+        threading.Thread(target=self._connected, daemon=True).start()
+
+    def _add_node(self, num, long_name, short_name, lat=None, lon=None):
+        node = {
+            "num": num,
+            "user": {"id": node_id(num), "longName": long_name, "shortName": short_name, "hwModel": "UNSET"},
+            "lastHeard": int(time.time()),
+            "snr": 5.0,
+            "deviceMetrics": {"batteryLevel": 90, "voltage": 4.0, "channelUtilization": 10.0, "airUtilTx": 1.0},
+        }
+        if lat is not None:
+            node["position"] = {"latitude": lat, "longitude": lon, "altitude": 50}
+        self.nodes[node_id(num)] = node
+        self.nodesByNum[num] = node
+
+    def _connected(self):
+        time.sleep(0.5)
+        pub.sendMessage("meshtastic.connection.established", interface=self)
+
+    def remote_nodes(self):
+        return [num for num in self.nodesByNum if num != LOCAL_NUM]
+
+    def getMyNodeInfo(self):
+        return self.nodesByNum[LOCAL_NUM]
+
+    def getMyUser(self):
+        return self.nodesByNum[LOCAL_NUM]["user"]
+
+    def getLongName(self):
+        return self.getMyUser()["longName"]
+
+    def getShortName(self):
+        return self.getMyUser()["shortName"]
+
+    def sendText(self, text, destinationId=BROADCAST_NUM, wantAck=False, wantResponse=False,
+                 onResponse=None, channelIndex=0, **kwargs):
+        return self._send({"text": text, "to": destinationId, "channel": channelIndex, "wantAck": wantAck})
+
+    def sendData(self, data, destinationId=BROADCAST_NUM, portNum=None, wantAck=False, wantResponse=False,
+                 onResponse=None, channelIndex=0, **kwargs):
+        return self._send({"data": data, "portnum": portNum, "to": destinationId, "channel": channelIndex, "wantAck": wantAck})
+
+    def _send(self, record):
+        record["id"] = next(self._ids) & 0xffffffff
+        record["time"] = time.monotonic()
+        self.sent.append(record)
+        if self.on_send:
+            self.on_send(record)
+        if record["wantAck"] and self.ack_ratio is not None:
+            threading.Timer(random.uniform(0.5, 3), self._ack, [record]).start()
+        return {"id": record["id"], "to": record["to"], "channel": record["channel"]}
+
+    def _ack(self, record):
+        # broadcasts get the implicit ack of a neighbour repeating them, direct messages an ack from the node
+        to = record["to"]
+        broadcast = to in (BROADCAST_NUM, "^all")
+        sender = LOCAL_NUM if broadcast else (int(to[1:], 16) if isinstance(to, str) else to)
+        error = "NONE" if random.random() < self.ack_ratio else "MAX_RETRANSMIT"
+        self.inject({
+            "from": sender, "to": LOCAL_NUM, "fromId": node_id(sender), "toId": node_id(LOCAL_NUM),
+            "id": next(self._ids) & 0xffffffff, "channel": record["channel"], "rxTime": int(time.time()),
+            "decoded": {"portnum": "ROUTING_APP", "requestId": record["id"], "routing": {"errorReason": error}},
+        })
+
+    def inject(self, packet):
+        pub.sendMessage("meshtastic.receive", packet=packet, interface=self)
+
+    def close(self):
+        pass
+
+class PacketSource():
+    """Synthetic packets from the interface's nodes, or records replayed from a routing archive"""
+
+    def __init__(self, interface, replay=None, text_ratio=1.0):
+        self.interface = interface
+        self.text_ratio = text_ratio
+        self.records = []
+        self._ids = itertools.count(random.randint(1, 1 << 30))
+        if replay:
+            with open(replay, "r", encoding="utf-8") as f:
+                self.records = [json.loads(line) for line in f if line.strip()]
+        self._replay = itertools.cycle(self.records) if self.records else None
+
+    def next(self, text):
+        """Next packet; text is used for text messages so they can be traced"""
+        if self._replay is not None:
+            return self._from_record(next(self._replay), text)
+        sender = random.choice(self.interface.remote_nodes())
+        if text is None or random.random() > self.text_ratio:
+            return self._packet(sender, BROADCAST_NUM, 0, "POSITION_APP", position={
+                "latitude": 45.0 + random.random(), "longitude": -122.0 - random.random(), "altitude": 50})
+        return self._packet(sender, BROADCAST_NUM, 0, "TEXT_MESSAGE_APP", text=text)
+
+    def _from_record(self, record, text):
+        sender = int(record["from"][1:], 16) if record.get("from") else random.choice(self.interface.remote_nodes())
+        if sender not in self.interface.nodesByNum:
+            self.interface._add_node(sender, "Replayed " + node_id(sender), node_id(sender)[-4:])
+        to = BROADCAST_NUM if record.get("to") in (None, "^all") else int(record["to"][1:], 16)
+        portnum = record.get("portnum", "TEXT_MESSAGE_APP")
+        hops = record.get("hops") or 0
+        if portnum == "TEXT_MESSAGE_APP":
+            body = (record.get("text", "") + " " + text).strip() if text else record.get("text", "")
+            return self._packet(sender, to, record.get("channel", 0), portnum, hops, record.get("snr"), text=body)
+        return self._packet(sender, to, record.get("channel", 0), portnum, hops, record.get("snr"))
+
+    def _packet(self, sender, to, channel, portnum, hops=0, snr=None, text=None, **decoded):
+        packet = {
+            "from": sender,
+            "to": to,
+            "fromId": node_id(sender),
+            "toId": "^all" if to == BROADCAST_NUM else node_id(to),
+            "id": next(self._ids) & 0xffffffff,
+            "channel": channel,
+            "rxTime": int(time.time()),
+            "rxSnr": random.uniform(-10, 10) if snr is None else snr,
+            "rxRssi": random.randint(-120, -60),
+            "hopStart": 3,
+            "hopLimit": 3 - hops,
+            "decoded": dict(portnum=portnum, **decoded),
+        }
+        if text is not None:
+            packet["decoded"]["text"] = text
+            packet["decoded"]["payload"] = text.encode("utf-8")
+        if portnum == "ENCRYPTED":
+            del packet["decoded"]
+            packet["encrypted"] = b""
+        return packet
@@ -0,0 +1,155 @@
+"""Benchmark the websocket packet feed (/api/feed) with many subscribers.
+
+    python -m harness.feedbench --clients 100 --rate 200 --duration 20
+
+The feed runs in this process like it does in MeshLink, packets are published from a
+separate thread the way the api plugin does. Subscribers run in child processes (--procs)
+so they do not share the GIL with the publisher, on a single core they still compete for
+the cpu and the client side decoding is usually what limits the rate. --slow adds clients that never read, which
+should be disconnected once their buffer fills instead of holding up the others.
+"""
+import argparse
+import asyncio
+import json
+import multiprocessing
+import os
+import socket
+import statistics
+import threading
+import time
+
+os.environ.setdefault("MESHLINK_WORKER", "1")
+
+import plugins.libapi as LibApi
+import plugins.libasync as LibAsync
+import plugins.libfeed as LibFeed
+
+def packet(seq, nodes):
+    sender = 0x10000000 + seq % nodes
+    return {"from": sender, "to": 0xffffffff, "fromId": f"!{sender:08x}", "toId": "^all", "id": seq,
+            "channel": 0, "rxSnr": 5.25, "rxRssi": -80, "hopLimit": 3, "hopStart": 3, "rxTime": int(time.time()),
+            "benchTime": time.time(),
+            "decoded": {"portnum": "TEXT_MESSAGE_APP", "payload": f"bench #{seq}#".encode(), "text": f"bench #{seq}#"}}
+
+def slow_client(port):
+    # finish the handshake and never read again
+    sock = socket.socket()
+    sock.setsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF, 4096)
+    sock.connect(("127.0.0.1", port))
+    sock.sendall((f"GET /api/feed HTTP/1.1\r\nHost: 127.0.0.1:{port}\r\nUpgrade: websocket\r\nConnection: Upgrade\r\n"
+                  "Sec-WebSocket-Key: dGhlIHNhbXBsZSBub25jZQ==\r\nSec-WebSocket-Version: 13\r\n\r\n").encode())
+    return sock
+
+def run_clients(port, clients, ready, results):
+    import aiohttp
+
+    async def client(session, stats):
+        async with session.ws_connect(f"http://127.0.0.1:{port}/api/feed") as ws:
+            ready.put(1)
+            async for msg in ws:
+                if msg.type != aiohttp.WSMsgType.TEXT:
+                    break
+                data = json.loads(msg.data)
+                if data.get("end"):
+                    break
+                stats["received"] += 1
+                stats["latency"].append(time.time() - data["benchTime"])
+
+    async def main():
+        stats = [{"received": 0, "latency": []} for _ in range(clients)]
+        async with aiohttp.ClientSession() as session:
+            await asyncio.gather(*(client(session, s) for s in stats))
+        latency = sorted(l for s in stats for l in s["latency"])
+        results.put({"received": [s["received"] for s in stats], "latency": latency[::max(len(latency) // 20000, 1)]})
+
+    asyncio.run(main())
+
+def percentile(values, p):
+    if not values:
+        return 0
+    return values[min(int(len(values) * p / 100), len(values) - 1)]
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the websocket packet feed")
+    parser.add_argument("--clients", type=int, default=100)
+    parser.add_argument("--slow", type=int, default=1, help="clients that never read")
+    parser.add_argument("--rate", type=float, default=200, help="packets per second, 0 for as fast as possible")
+    parser.add_argument("--duration", type=float, default=20)
+    parser.add_argument("--nodes", type=int, default=200)
+    parser.add_argument("--buffer", type=int, default=256, help="api_feed_buffer")
+    parser.add_argument("--procs", type=int, default=max(min(os.cpu_count() or 1, 8) - 1, 1), help="client processes")
+    parser.add_argument("--port", type=int, default=18091)
+    args = parser.parse_args()
+
+    LibFeed.configure(args.buffer, LibFeed.DISCONNECT)
+    LibApi.route("/api/feed", LibFeed.handle)
+    LibAsync.submit(LibApi.serve("127.0.0.1", args.port)).result()
+
+    ctx = multiprocessing.get_context("spawn")
+    ready, results = ctx.Queue(), ctx.Queue()
+    children = []
+    for i in range(args.procs):
+        count = args.clients // args.procs + (i < args.clients % args.procs)
+        child = ctx.Process(target=run_clients, args=(args.port, count, ready, results), daemon=True)
+        child.start()
+        children.append(child)
+    for _ in range(args.clients):
+        ready.get(timeout=60)
+    slow = [slow_client(args.port) for _ in range(args.slow)]
+    while LibFeed.subscribers() < args.clients + args.slow:
+        time.sleep(0.05)
+    print(f"{LibFeed.subscribers()} subscribers connected")
+
+    encode_time = [0.0]
+    encode = LibFeed.encode
+
+    def timed_encode(p):
+        start = time.perf_counter()
+        try:
+            return encode(p)
+        finally:
+            encode_time[0] += time.perf_counter() - start
+    LibFeed.encode = timed_encode
+
+    def publisher():
+        start = time.monotonic()
+        seq = 0
+        while time.monotonic() - start < args.duration:
+            LibFeed.publish(packet(seq, args.nodes))
+            seq += 1
+            if args.rate:
+                delay = start + seq / args.rate - time.monotonic()
+                if delay > 0:
+                    time.sleep(delay)
+        return seq
+
+    started = time.monotonic()
+    thread_result = []
+    t = threading.Thread(target=lambda: thread_result.append(publisher()))
+    t.start()
+    t.join()
+    published = thread_result[0]
+    LibFeed.publish({"end": True})
+    received, latency = [], []
+    for _ in children:
+        result = results.get(timeout=120)
+        received += result["received"]
+        latency += result["latency"]
+    latency.sort()
+    elapsed = time.monotonic() - started
+    for child in children:
+        child.join(10)
+    for sock in slow:
+        sock.close()
+
+    counters = LibFeed.counters
+    print(f"published {published} packets in {elapsed:.1f}s, {published / args.duration:.0f}/s, "
+          f"encoded {counters['published']} times, {encode_time[0] / max(published, 1) * 1e6:.0f}us each")
+    print(f"sent {counters['sent']} frames, {counters['sent'] / elapsed:.0f}/s, "
+          f"received per client min {min(received)} max {max(received)}")
+    print(f"latency p50 {percentile(latency, 50) * 1000:.1f}ms p99 {percentile(latency, 99) * 1000:.1f}ms "
+          f"max {latency[-1] * 1000 if latency else 0:.1f}ms mean {statistics.mean(latency) * 1000 if latency else 0:.1f}ms")
+    print(f"clients disconnected {counters['disconnected']} ({args.slow} never read), dropped {counters['dropped']}")
+
+if __name__ == "__main__":
+    main()
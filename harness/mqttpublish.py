@@ -0,0 +1,81 @@
+"""Publish synthetic Meshtastic ServiceEnvelopes to a local broker, to load MeshLink's
+mqtt mode (use_mqtt) without a radio or the public broker.
+
+    mosquitto -p 1883 &
+    python -m harness.mqttpublish --rate 100 --gateways 3 --duration 600
+
+Point config.yml at the broker with mqtt_host: 127.0.0.1, mqtt_topics: ["msh/#"].
+Each packet is published once per gateway like the real network uplinks it, so
+deduplication gets exercised too.
+"""
+import argparse
+import base64
+import random
+import time
+import paho.mqtt.client as mqtt
+from meshtastic.protobuf import mesh_pb2, mqtt_pb2, portnums_pb2
+
+DEFAULT_KEY = bytes.fromhex("d4f1bb3a20290759f0bcffabcf4e6901")
+
+def channel_key(key):
+    raw = base64.b64decode(key)
+    if len(raw) == 1:
+        return DEFAULT_KEY[:-1] + bytes([(DEFAULT_KEY[-1] + raw[0] - 1) & 0xff])
+    return raw
+
+def encrypt(key, packet_id, from_num, data):
+    from cryptography.hazmat.primitives.ciphers import Cipher, algorithms, modes
+    nonce = packet_id.to_bytes(8, "little") + from_num.to_bytes(4, "little") + bytes(4)
+    cipher = Cipher(algorithms.AES(key), modes.CTR(nonce)).encryptor()
+    return cipher.update(data) + cipher.finalize()
+
+def envelope(args, key, seq, sender, gateway):
+    data = mesh_pb2.Data(portnum=portnums_pb2.TEXT_MESSAGE_APP, payload=f"mqtt #m{seq}#".encode())
+    packet = mesh_pb2.MeshPacket(id=seq & 0xffffffff, to=0xffffffff, hop_limit=2, hop_start=3)
+    setattr(packet, "from", sender)
+    if key is None:
+        packet.decoded.CopyFrom(data)
+    else:
+        packet.encrypted = encrypt(key, packet.id, sender, data.SerializeToString())
+    return mqtt_pb2.ServiceEnvelope(packet=packet, channel_id=args.channel, gateway_id=gateway).SerializeToString()
+
+def main():
+    parser = argparse.ArgumentParser(description="Publish synthetic meshtastic mqtt traffic")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=1883)
+    parser.add_argument("--root", default="msh/US", help="topic root")
+    parser.add_argument("--channel", default="LongFast")
+    parser.add_argument("--key", default="AQ==", help="base64 channel psk")
+    parser.add_argument("--plain", action="store_true", help="send decoded packets instead of encrypting them")
+    parser.add_argument("--rate", type=float, default=20, help="distinct packets per second")
+    parser.add_argument("--gateways", type=int, default=3, help="copies of each packet, one per gateway")
+    parser.add_argument("--nodes", type=int, default=200)
+    parser.add_argument("--duration", type=float, default=60)
+    args = parser.parse_args()
+
+    client = mqtt.Client(mqtt.CallbackAPIVersion.VERSION2)
+    client.connect(args.host, args.port)
+    client.loop_start()
+    key = None if args.plain else channel_key(args.key)
+    gateways = [f"!{0x4d470000 + g:08x}" for g in range(args.gateways)]
+    senders = [0x20000000 + n for n in range(args.nodes)]
+
+    seq = random.randint(1, 1 << 30)
+    start = time.monotonic()
+    sent = 0
+    while time.monotonic() - start < args.duration:
+        seq += 1
+        sender = random.choice(senders)
+        for gateway in gateways:
+            client.publish(f"{args.root}/2/e/{args.channel}/{gateway}", envelope(args, key, seq, sender, gateway))
+        sent += 1
+        delay = start + sent / args.rate - time.monotonic()
+        if delay > 0:
+            time.sleep(delay)
+    elapsed = time.monotonic() - start
+    print(f"published {sent} packets x {args.gateways} gateways in {elapsed:.1f}s ({sent / elapsed:.1f}/s)")
+    client.loop_stop()
+    client.disconnect()
+
+if __name__ == "__main__":
+    main()
@@ -6,6 +6,7 @@ update_url = "https://github.com/Murturtle/MeshLinkBeta"
 import yaml
 import xml.dom.minidom
 import os
+import sys
 from pubsub import pub
 import discord
 from meshtastic.tcp_interface import TCPInterface
@@ -21,17 +22,47 @@ from datetime import datetime
 import math
 import plugins.libcommand as LibCommand
 import plugins.libmesh as LibMesh
+import plugins.libeventbus as LibEventBus
+import plugins.libnodes as LibNodes
+import plugins.libprofiler as LibProfiler
+import plugins.libspool as LibSpool
+import plugins.libmqtt as LibMqtt
+import plugins.libcompress as LibCompress
+import threading
 
 
+stopping = False
+
 def handler(signum, frame):
+    global stopping
+    if(stopping or not LibSpool.running()):
+        exit(1)
+    stopping = True
     logger.infogreen("MeshLink is now stopping!")
     if(cfg.config["send_start_stop"]):
         channel_index = LibMesh.resolve_send_channel_index(0)
-        interface.sendText("MeshLink is now stopping!", channelIndex=channel_index)
-    exit(1)
+        LibSpool.put("mesh", {"text": "MeshLink is now stopping!", "channel": channel_index})
+    # drain from another thread, this one runs the discord loop that has to deliver
+    threading.Thread(target=drain_and_exit, daemon=True).start()
+
+def drain_and_exit():
+    left = LibSpool.drain(cfg.config["spool_drain_seconds"])
+    if(left):
+        logger.warn(str(left) + " messages left in the spool, they are sent on the next start")
+    sys.stdout.flush()
+    os._exit(1)
 
 signal.signal(signal.SIGINT, handler)
 
+def profile_handler(signum, frame):
+    def done(summary, paths):
+        if paths:
+            logger.infogreen("Profile written to " + paths[0])
+        if cfg.config["use_discord"] and cfg.config["admin_channel_id"]:
+            DiscordUtil.send_files("Profile from SIGUSR1\n```\n" + summary[:1800] + "\n```", paths, client, cfg.config, cfg.config["admin_channel_id"])
+    if LibProfiler.start(cfg.config["profile_seconds"], done, directory=cfg.config["profile_dir"]):
+        logger.info("Profiling for " + str(cfg.config["profile_seconds"]) + "s")
+
 with open("./config.yml",'r') as file:
     cfg.config = yaml.safe_load(file)
 
@@ -61,7 +92,65 @@ config_options = [
     "include_username_prefix",
     "weather_lat",
     "weather_long",
-    "max_weather_hours"
+    "max_weather_hours",
+    "bulletins",
+    "bulletin_max_channel_utilization",
+    "coalesce_window",
+    "coalesce_pointer",
+    "info_digest_window",
+    "routing_rules",
+    "routing_archive_file",
+    "event_bus_queue_size",
+    "event_bus_overflow",
+    "command_workers",
+    "mailbox_file",
+    "mailbox_expiry_hours",
+    "mailbox_max_per_node",
+    "mailbox_pace",
+    "history_file",
+    "node_table_max_nodes",
+    "node_table_max_age_hours",
+    "use_webhooks",
+    "webhook_urls",
+    "telemetry_file",
+    "telemetry_snapshot_minutes",
+    "topology_edge_ttl_minutes",
+    "admin_user_ids",
+    "admin_channel_id",
+    "profile_seconds",
+    "profile_dir",
+    "spool_file",
+    "spool_fsync_ms",
+    "spool_drain_seconds",
+    "ack_timeout_seconds",
+    "ack_max_retries",
+    "ack_retry_base_seconds",
+    "ack_stats_file",
+    "use_mqtt",
+    "mqtt_host",
+    "mqtt_port",
+    "mqtt_username",
+    "mqtt_password",
+    "mqtt_topics",
+    "mqtt_channels",
+    "mqtt_node_id",
+    "weather_batch_ms",
+    "weather_cache_minutes",
+    "weather_prefetch_cron",
+    "geofences",
+    "geofence_hysteresis_m",
+    "geofence_debounce",
+    "geofence_channel_ids",
+    "proximity_alerts",
+    "proximity_max_age_minutes",
+    "api_host",
+    "api_port",
+    "api_recent_messages",
+    "api_feed_buffer",
+    "api_feed_overflow",
+    "compress_text",
+    "compress_broadcasts",
+    "compress_peers"
 ]
 
 for i in config_options:
@@ -73,6 +162,14 @@ for i in cfg.config:
     if i not in config_options:
         logger.infoimportant("Config option "+i+" might not needed anymore")
 
+# the handler reads profile_* from the config, a signal before it is loaded would fail
+if hasattr(signal, "SIGUSR1"):
+    signal.signal(signal.SIGUSR1, profile_handler)
+
+LibSpool.start(cfg.config["spool_file"], cfg.config["spool_fsync_ms"])
+LibCommand.start(cfg.config["command_workers"])
+LibCompress.configure(cfg.config)
+
 for plugin in Base.plugins:
     inst = plugin()
     inst.start()
@@ -107,18 +204,33 @@ else:
     client = None
 
 def onConnection(interface, topic=pub.AUTO_TOPIC):
+    LibNodes.seed(interface)
+    # let other MeshLinks know they can send us compressed text
+    LibCompress.announce(interface, channel=cfg.config["send_channel_index"])
     for p in Base.plugins:
         inst = p()
         if hasattr(inst, "onConnect") and callable(inst.onConnect):
             inst.onConnect(interface,client)
 
 def onReceive(packet, interface):
-    for p in Base.plugins:
-        inst = p()
-        if hasattr(inst, "onReceive") and callable(inst.onReceive):
-            inst.onReceive(packet,interface,client)
-    for cmd in LibCommand.commands:
-        cmd.onReceive(packet,interface,client)
+    LibCompress.on_receive(packet, interface)
+    LibNodes.update(packet, interface)
+    LibEventBus.publish(packet, interface, client)
+
+def onCommand(packet, interface, client):
+    LibCommand.dispatch(packet, interface, client)
+
+# every plugin gets its own queue so a slow hook only delays itself
+for p in Base.plugins:
+    inst = p()
+    if hasattr(inst, "onReceive") and callable(inst.onReceive):
+        LibEventBus.subscribe(
+            p.__module__ + ":" + p.__name__,
+            inst.onReceive,
+            getattr(p, "queue_size", cfg.config["event_bus_queue_size"]),
+            getattr(p, "overflow", cfg.config["event_bus_overflow"])
+        )
+LibEventBus.subscribe("commands", onCommand, cfg.config["event_bus_queue_size"], cfg.config["event_bus_overflow"])
 
 def onDisconnect(interface):
     for p in Base.plugins:
@@ -134,7 +246,10 @@ pub.subscribe(onReceive, "meshtastic.receive")
 def init_radio():
     global interface
     logger.info("Connecting to node...")
-    if (cfg.config["use_serial"]):
+    if (cfg.config["use_mqtt"]):
+        interface = LibMqtt.MQTTInterface(cfg.config)
+
+    elif (cfg.config["use_serial"]):
         interface = SerialInterface()
 
     else:
@@ -160,6 +275,19 @@ def init_radio():
 
 init_radio()
 
+def send_to_radio(payload, done):
+    on_state = None
+    if "react" in payload and cfg.config["use_discord"]:
+        # show the mesh delivery state on the discord message it came from
+        channel_id, message_id = payload["react"]
+        on_state = lambda state: DiscordUtil.show_delivery_state(client, channel_id, message_id, state)
+    LibMesh.sendSpooled(interface, payload, on_state)
+    done(True)
+
+LibSpool.register("mesh", send_to_radio)
+if cfg.config["use_discord"]:
+    LibSpool.register("discord", lambda payload, done: DiscordUtil.deliver(payload, client, cfg.config, done))
+
 if cfg.config["use_discord"]:
     @client.event
     async def on_ready():
@@ -168,12 +296,20 @@ if cfg.config["use_discord"]:
 
     @client.event
     async def on_message(message):
+        if message.author == client.user:
+            return
+        # mesh messages posted through our webhooks come back here, never treat them as commands
+        if message.webhook_id is not None:
+            return
+
+        for cmd in LibCommand.discord_commands:
+            if await cmd.onMessage(message, client):
+                return
+
         if not cfg.config["permit_broadcast_of_discord_messages"]:
             return
 
         global interface
-        if message.author == client.user:
-            return
         if message.content.startswith(cfg.config["discord_prefix"]+'send'):
             if (message.channel.id in cfg.config["message_channel_ids"] or
                 message.channel.id in cfg.config.get("secondary_channel_message_ids", [])):
@@ -193,12 +329,12 @@ if cfg.config["use_discord"]:
 
                 if len(final_message) < cfg.config["max_message_length"] - 1:
                     await message.reply(final_message)
-                    interface.sendText(final_message, channelIndex=channel_index)
+                    LibSpool.put("mesh", {"text": final_message, "channel": channel_index, "react": [message.channel.id, message.id]}, "mesh:" + str(message.id))
                     logger.infodiscord(final_message)
                 else:
                     short_msg = final_message[:cfg.config["max_message_length"]]
                     await message.reply("(shortend) " + short_msg)
-                    interface.sendText(short_msg, channelIndex=channel_index)
+                    LibSpool.put("mesh", {"text": short_msg, "channel": channel_index, "react": [message.channel.id, message.id]}, "mesh:" + str(message.id))
                     logger.infodiscord(short_msg)
                 #await message.delete()
 
@@ -27,39 +27,62 @@ def load_module(path):
     return module
 
 
-path = os.path.abspath(__file__)
-dirpath = os.path.dirname(path)
-
-enabled_file = os.path.join(os.getcwd(), 'plugins', 'plugins-enabled')
-enabled = set()
-
-if os.path.exists(enabled_file):
-    try:
-        with open(enabled_file, 'r', encoding='utf-8') as f:
-            for line in f:
-                line = line.strip()
-                if not line or line.startswith('#'):
-                    continue
-                enabled.add(line)
-    except Exception:
-        traceback.print_exc()
-else:
-    logger.warn("No plugins-enabled file found")
-    exit(1)
-
-for fname in os.listdir(dirpath):
-    if fname.startswith('.') or fname.startswith('__') or not fname.endswith('.py'):
-        continue
-    if fname.startswith('lib'):
-        continue
-
-    base = fname[:-3]
-    if base not in enabled:
-        logger.infoimportant(f"Plugin {base} not enabled")
-        continue
-
-    try:
-        load_module(os.path.join(dirpath, fname))
-        logger.info("Loaded file "+fname)
-    except Exception:
-        traceback.print_exc()
\ No newline at end of file
+def _parse_options(words):
+    options = {}
+    for word in words:
+        key, _, value = word.partition("=")
+        options[key] = value or True
+    return options
+
+
+def load_enabled_plugins():
+    path = os.path.abspath(__file__)
+    dirpath = os.path.dirname(path)
+
+    enabled_file = os.path.join(os.getcwd(), 'plugins', 'plugins-enabled')
+    enabled = set()
+    # per plugin options after the name, e.g. "chatgpt process pool=2"
+    options = {}
+
+    if os.path.exists(enabled_file):
+        try:
+            with open(enabled_file, 'r', encoding='utf-8') as f:
+                for line in f:
+                    line = line.strip()
+                    if not line or line.startswith('#'):
+                        continue
+                    words = line.split()
+                    enabled.add(words[0])
+                    options[words[0]] = _parse_options(words[1:])
+        except Exception:
+            traceback.print_exc()
+    else:
+        logger.warn("No plugins-enabled file found")
+        exit(1)
+
+    for fname in os.listdir(dirpath):
+        if fname.startswith('.') or fname.startswith('__') or not fname.endswith('.py'):
+            continue
+        if fname.startswith('lib'):
+            continue
+
+        base = fname[:-3]
+        if base not in enabled:
+            logger.infoimportant(f"Plugin {base} not enabled")
+            continue
+
+        try:
+            if options[base].get("process"):
+                import plugins.libworker as LibWorker
+                LibWorker.register(base, os.path.join(dirpath, fname), options[base])
+                logger.info("Loaded file "+fname+" in a worker process")
+                continue
+            load_module(os.path.join(dirpath, fname))
+            logger.info("Loaded file "+fname)
+        except Exception:
+            traceback.print_exc()
+
+
+# worker processes load their single plugin themselves
+if not os.environ.get("MESHLINK_WORKER"):
+    load_enabled_plugins()
@@ -0,0 +1,29 @@
+import plugins
+import plugins.liblogger as logger
+import plugins.libcommand as LibCommand
+import plugins.liback as LibAck
+import cfg
+
+class acks(plugins.Base):
+
+    def __init__(self):
+        pass
+
+    def start(self):
+        logger.info("Loading acks")
+        LibAck.start(cfg.config)
+
+        async def discord_acks(message, args, client):
+            stats = LibAck.stats()
+            if not stats:
+                return "No acked sends yet"
+            lines = [f"{'dest':<10} {'sent':>5} {'ack':>5} {'relay':>5} {'fail':>5} {'retry':>5} {'rate':>5} {'avg':>6}"]
+            for dest, s in sorted(stats.items(), key=lambda d: -d[1]["sent"])[:25]:
+                rate = "-" if s["success_rate"] is None else f"{s['success_rate'] * 100:.0f}%"
+                avg = "-" if s["avg_ack_seconds"] is None else f"{s['avg_ack_seconds']}s"
+                lines.append(f"{dest:<10} {s['sent']:>5} {s['acked']:>5} {s['relayed']:>5} {s['failed']:>5} {s['retries']:>5} {rate:>5} {avg:>6}")
+            return f"{LibAck.outstanding()} waiting for an ack\n```\n" + "\n".join(lines) + "\n```"
+        LibCommand.discordCommand().registerCommand("acks", "acks", discord_acks)
+
+    def onReceive(self, packet, interface, client):
+        LibAck.on_receive(packet, interface)
@@ -0,0 +1,115 @@
+import collections
+import threading
+import time
+import plugins
+import plugins.liblogger as logger
+import plugins.libapi as LibApi
+import plugins.libasync as LibAsync
+import plugins.liback as LibAck
+import plugins.libeventbus as LibEventBus
+import plugins.libfeed as LibFeed
+import plugins.libhistory as LibHistory
+import plugins.libmesh as LibMesh
+import plugins.libnodes as LibNodes
+import plugins.libspool as LibSpool
+import cfg
+
+# the api only keeps what it can not read from other modules: recent messages and per channel counts
+_lock = threading.Lock()
+_messages = collections.deque()
+_channels = {}
+_versions = {"messages": 0, "channels": 0}
+_state = {"local_num": None}
+# last heard, snr and hops change with every packet without bumping the node versions, the
+# nodes and positions snapshots pick them up at most this many seconds late
+_HEARD_SECONDS = 60
+
+def _node_dict(node):
+    return {name: getattr(node, name) for name in node.__slots__ if name not in ("url", "public_key")}
+
+def heard_version(name):
+    return (LibNodes.versions[name], int(time.time() // _HEARD_SECONDS))
+
+def build_nodes():
+    # most recently heard first
+    return [_node_dict(node) for node in reversed(LibNodes.all_nodes())]
+
+def build_positions():
+    return [{"num": node.num, "id": node.id, "short_name": node.short_name, "latitude": node.latitude,
+             "longitude": node.longitude, "altitude": node.altitude, "last_heard": node.last_heard}
+            for node in reversed(LibNodes.all_nodes()) if node.latitude is not None]
+
+def build_messages():
+    with _lock:
+        return list(reversed(_messages))
+
+def build_channels():
+    local = LibNodes.get(_state["local_num"])
+    with _lock:
+        channels = [{"index": index, "packets": c["packets"], "messages": c["messages"],
+                     "senders": len(c["senders"]), "last_heard": c["last_heard"]}
+                    for index, c in sorted(_channels.items())]
+    return {"channel_utilization": local.channel_utilization if local else None,
+            "air_util_tx": local.air_util_tx if local else None,
+            "channels": channels}
+
+def queue_depths():
+    return {"plugins": LibEventBus.stats(),
+            "spool": LibSpool.pending(),
+            "acks": LibAck.outstanding(),
+            "history": LibHistory.queued(),
+            "feed_clients": LibFeed.subscribers(),
+            "feed": dict(LibFeed.counters)}
+
+def queues_version():
+    # the depths are cheap to read and are their own version
+    return repr(queue_depths())
+
+class api(plugins.Base):
+
+    def __init__(self):
+        pass
+
+    def start(self):
+        global _messages
+        if not cfg.config["api_port"]:
+            return
+        logger.info("Loading HTTP API")
+        _messages = collections.deque(maxlen=cfg.config["api_recent_messages"])
+        LibApi.register("nodes", lambda: heard_version("nodes"), build_nodes)
+        LibApi.register("positions", lambda: heard_version("positions"), build_positions)
+        LibApi.register("messages", lambda: _versions["messages"], build_messages)
+        LibApi.register("channels", lambda: (_versions["channels"], LibNodes.versions["nodes"]), build_channels)
+        LibApi.register("queues", queues_version, queue_depths)
+        LibFeed.configure(cfg.config["api_feed_buffer"], cfg.config["api_feed_overflow"])
+        LibApi.route("/api/feed", LibFeed.handle)
+        LibAsync.submit(LibApi.serve(cfg.config["api_host"], cfg.config["api_port"]))
+
+    def onConnect(self, interface, client):
+        _state["local_num"] = int(interface.localNode.nodeNum)
+
+    def onReceive(self, packet, interface, client):
+        if not cfg.config["api_port"]:
+            return
+        LibFeed.publish(packet)
+        now = int(packet.get("rxTime") or time.time())
+        index = int(packet.get("channel", 0))
+        decoded = packet.get("decoded") or {}
+        is_text = decoded.get("portnum") == "TEXT_MESSAGE_APP" and "text" in decoded
+        with _lock:
+            stats = _channels.get(index)
+            if stats is None:
+                stats = _channels[index] = {"packets": 0, "messages": 0, "senders": set(), "last_heard": None}
+            stats["packets"] += 1
+            stats["last_heard"] = now
+            if "from" in packet:
+                stats["senders"].add(packet["from"])
+            _versions["channels"] += 1
+            if is_text:
+                stats["messages"] += 1
+                node = LibNodes.get(packet.get("from"))
+                _messages.append({"time": now, "from": packet.get("from"),
+                                  "id": LibMesh.decimal_to_hex(packet["from"]) if "from" in packet else None,
+                                  "name": node.short_name if node else None, "channel": index,
+                                  "packet_id": packet.get("id"), "to": packet.get("to"), "text": decoded["text"]})
+                _versions["messages"] += 1
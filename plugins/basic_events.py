@@ -4,6 +4,8 @@ import cfg
 import plugins.liblogger as logger
 from meshtastic import mesh_interface
 import plugins.libmesh as LibMesh
+import plugins.librouting as LibRouting
+import plugins.libhistory as LibHistory
 
 class basicEvents(plugins.Base):
 
@@ -12,6 +14,7 @@ class basicEvents(plugins.Base):
 
     def start(self):
         logger.info("Loading basic events")
+        LibRouting.compile_rules(cfg.config["routing_rules"])
     
     def onReceive(self, packet, interface, client):
         if cfg.config["verbose_packets"]:
@@ -19,14 +22,13 @@ class basicEvents(plugins.Base):
             logger.info(packet)
             logger.info("--------------------------------------------")
 
-        final_message = ""
+        route = LibRouting.decide(packet, interface)
+
         send_channel = 0
         if "decoded" not in packet:
-            final_message = DiscordUtil.format_encrypted_message(interface, packet)
-            DiscordUtil.send_info(final_message, client, cfg.config)
-
             if cfg.config["verbose_packets"]:
                 logger.infoimportant("Failed or encrypted")
+            self.forward(route, packet, None, interface, client)
             return
 
         if cfg.config["verbose_packets"]:
@@ -43,6 +45,8 @@ class basicEvents(plugins.Base):
             except KeyError:
                 return
             
+            LibHistory.record(packet, LibMesh.getUserShort(interface, packet))
+
             reply_id = packet["decoded"].get("replyId") or packet["decoded"].get("reply_id")
 
             if packet.get("from") is not None:
@@ -53,35 +57,43 @@ class basicEvents(plugins.Base):
             if text.lower() == "meshlink":
                 LibMesh.sendReply("MeshLink is running on this node - rev " + str(cfg.config["rev"]) + "\n\nuse " + cfg.config["prefix"] + "info for a list of commands", interface, packet)
 
-            final_message = DiscordUtil.format_text_message(interface, packet, cfg.config)
-
-            DiscordUtil.send_msg(final_message, client, cfg.config, send_channel, packet.get("id"), reply_id)
+            if route.action == LibRouting.MESSAGES:
+                DiscordUtil.send_text_message(interface, packet, client, cfg.config, send_channel, reply_id)
+            else:
+                self.forward(route, packet, portnum, interface, client)
             return
 
-        if cfg.config["send_packets"]:
-            try:
-                is_self = packet["fromId"] == interface.getMyNodeInfo()["user"]["id"]
-                if is_self and cfg.config["ignore_self"]:
-                    if cfg.config["verbose_packets"]:
-                        logger.info("Ignoring self")
-                    return
-                else:
-                    final_message = DiscordUtil.format_packet_info(interface, packet, portnum)
-            except TypeError as e:
-                logger.infoimportant(f"TypeError: {e}. We don't have our own nodenum yet.")
-
-            DiscordUtil.send_info(final_message, client, cfg.config)
+        self.forward(route, packet, portnum, interface, client)
+
+    def forward(self, route, packet, portnum, interface, client):
+        if route.action == LibRouting.DROP:
+            if cfg.config["verbose_packets"]:
+                logger.info("Dropped by routing")
+        elif route.action == LibRouting.ARCHIVE:
+            LibRouting.archive(packet)
+        elif route.action == LibRouting.DISCORD:
+            if portnum == "TEXT_MESSAGE_APP":
+                final_message = DiscordUtil.format_text_message(interface, packet, cfg.config)
+            elif portnum is None:
+                final_message = DiscordUtil.format_encrypted_message(interface, packet)
+            else:
+                final_message = DiscordUtil.format_packet_info(interface, packet, portnum)
+            DiscordUtil.send_to_channels(final_message, client, cfg.config, route.channel_ids)
+        else:
+            DiscordUtil.send_packet_info(interface, packet, portnum, client, cfg.config)
                 
             
     def onConnect(self,interface,client):
         logger.infogreen("Node connected")
+        LibRouting.set_local_node(interface)
 
         message = DiscordUtil.format_system_message("MeshLink is now running - rev " + str(cfg.config["rev"]))
         DiscordUtil.send_msg(message, client, cfg.config)
         if(cfg.config["send_start_stop"]):
-            interface.sendText("MeshLink is now running - rev "+str(cfg.config["rev"])+"\n\nuse "+cfg.config["prefix"]+"info for a list of commands",channelIndex = cfg.config["send_channel_index"])
+            LibMesh.spoolText(interface, "MeshLink is now running - rev "+str(cfg.config["rev"])+"\n\nuse "+cfg.config["prefix"]+"info for a list of commands", channel=cfg.config["send_channel_index"])
 
     def onDisconnect(self,interface,client):
         logger.warn("Connection to node has been lost - attemping to reconnect")
+        LibRouting.clear_local_node()
         message = DiscordUtil.format_system_message("Connection to node has been lost", is_header=True)
         DiscordUtil.send_msg(message, client, cfg.config)
@@ -0,0 +1,63 @@
+import plugins
+import plugins.libdiscordutil as DiscordUtil
+import plugins.liblogger as logger
+import plugins.libcommand as LibCommand
+import plugins.libmesh as LibMesh
+import plugins.libspool as LibSpool
+import plugins.libschedule as LibSchedule
+import cfg
+
+# the newest connected interface and discord client, bulletins fire from the scheduler thread
+_state = {"interface": None, "client": None}
+_scheduler = LibSchedule.Scheduler()
+
+def run_bulletin(bulletin):
+    interface = _state["interface"]
+    client = _state["client"]
+    name = bulletin["command"]
+    if interface is None:
+        logger.warn(f"Skipping bulletin {name}, node not connected")
+        return
+
+    max_chutil = bulletin.get("max_channel_utilization", cfg.config["bulletin_max_channel_utilization"])
+    chutil = LibMesh.getChannelUtilization(interface)
+    if chutil is not None and chutil > max_chutil:
+        logger.infoimportant(f"Skipping bulletin {name}, channel utilization {round(chutil, 1)}% > {max_chutil}%")
+        return
+
+    cmd = LibCommand.getCommand(name)
+    if cmd is None:
+        logger.warn(f"Bulletin command {name} is not registered")
+        return
+
+    channel_index = LibMesh.resolve_send_channel_index(bulletin.get("channel_index", 0))
+    packet = LibMesh.localPacket(interface, channel_index)
+    reply = cmd.executeCommand(packet, interface, client, str(bulletin.get("args", "")))
+    if not reply:
+        return
+
+    LibSpool.put("mesh", {"text": reply, "channel": channel_index})
+    logger.infogreen(f"Sent bulletin {name} on channel {channel_index}")
+
+    if cfg.config["send_mesh_commands_to_discord"]:
+        DiscordUtil.send_msg(DiscordUtil.format_command_response(reply), client, cfg.config, channel_index)
+
+class bulletins(plugins.Base):
+
+    def __init__(self):
+        pass
+
+    def start(self):
+        logger.info("Loading bulletins")
+        for bulletin in cfg.config["bulletins"] or []:
+            try:
+                _scheduler.add(bulletin["cron"], lambda b=bulletin: run_bulletin(b), bulletin["command"])
+            except (KeyError, ValueError) as e:
+                logger.warn(f"Invalid bulletin {bulletin}: {e}")
+
+    def onConnect(self, interface, client):
+        _state["interface"] = interface
+        _state["client"] = client
+
+    def onDisconnect(self, interface, client):
+        _state["interface"] = None
@@ -8,6 +8,11 @@ import time
 import xml.dom.minidom
 from datetime import datetime
 import plugins.libcommand as LibCommand
+import plugins.libnodes as LibNodes
+import plugins.libschedule as LibSchedule
+import plugins.libweather as LibWeather
+
+_scheduler = LibSchedule.Scheduler()
 
 
 class basicCommands(plugins.Base):
@@ -28,20 +33,14 @@ class basicCommands(plugins.Base):
         # weather command
         def cmd_weather(packet, interface, client, args):
             lat, long, hasPos = getLatLong(packet, interface)
-            weather_data_res = requests.get(
-                f"https://api.open-meteo.com/v1/forecast?latitude={lat}&longitude={long}"
-                "&hourly=temperature_2m,precipitation_probability&temperature_unit=fahrenheit&wind_speed_unit=mph&precipitation_unit=inch&timeformat=unixtime&timezone=auto"
-            )
-            weather_data = weather_data_res.json()
-            final = ""
-            if weather_data_res.ok:
-                for j in range(cfg.config["max_weather_hours"]):
-                    i = j + int(time.strftime('%H'))
-                    final += f"{i % 24} {round(weather_data['hourly']['temperature_2m'][i])}F {weather_data['hourly']['precipitation_probability'][i]}%\n"
-                #final = final[:-1] # to remove newline at end
-                final += "(Your position)" if hasPos else "(Config position)" 
-            else:
+            try:
+                weather_data = LibWeather.forecast.get(lat, long)
+            except Exception:
                 final = "Error fetching"
+            else:
+                hours = LibWeather.hourly_slice(weather_data, ("temperature_2m", "precipitation_probability"), cfg.config["max_weather_hours"])
+                final = "".join(f"{hour} {round(temp)}F {prob}%\n" for hour, temp, prob in hours)
+                final += "(Your position)" if hasPos else "(Config position)" 
             logger.info(final)
             return final
         LibCommand.simpleCommand().registerCommand("weather", "Gets the weather", cmd_weather)
@@ -50,22 +49,19 @@ class basicCommands(plugins.Base):
         def cmd_aqi(packet, interface, client, args):
             lat, long, hasPos = getLatLong(packet, interface)
             final = ""
-            aqi_data_res = requests.get(
-                f"https://air-quality-api.open-meteo.com/v1/air-quality?latitude={lat}&longitude={long}&current=us_aqi,us_aqi_pm2_5,us_aqi_pm10,us_aqi_nitrogen_dioxide,us_aqi_carbon_monoxide,us_aqi_ozone,us_aqi_sulphur_dioxide&timezone=auto&forecast_hours=1&past_hours=1&timeformat=unixtime"
-            )
-            aqi_data = aqi_data_res.json()
-            
-            if aqi_data_res.ok:
-                final += f"AQI: {aqi_data['current']['us_aqi']}\n"
-                final += f"PM2.5: {aqi_data['current']['us_aqi_pm2_5']}\n"
-                final += f"PM10: {aqi_data['current']['us_aqi_pm10']}\n"
-                final += f"NO2: {aqi_data['current']['us_aqi_nitrogen_dioxide']}\n"
-                final += f"CO: {aqi_data['current']['us_aqi_carbon_monoxide']}\n"
-                final += f"O3: {aqi_data['current']['us_aqi_ozone']}\n"
-                final += f"SO2: {aqi_data['current']['us_aqi_sulphur_dioxide']}\n"
-                final += "(Your position)" if hasPos else "(Config position)" 
-            else:
+            try:
+                current = LibWeather.air_quality.get(lat, long)["current"]
+            except Exception:
                 final = "Error fetching"
+            else:
+                final += f"AQI: {current['us_aqi']}\n"
+                final += f"PM2.5: {current['us_aqi_pm2_5']}\n"
+                final += f"PM10: {current['us_aqi_pm10']}\n"
+                final += f"NO2: {current['us_aqi_nitrogen_dioxide']}\n"
+                final += f"CO: {current['us_aqi_carbon_monoxide']}\n"
+                final += f"O3: {current['us_aqi_ozone']}\n"
+                final += f"SO2: {current['us_aqi_sulphur_dioxide']}\n"
+                final += "(Your position)" if hasPos else "(Config position)" 
             logger.info(final)
             return final
         LibCommand.simpleCommand().registerCommand("aqi", "Gets the AQI", cmd_aqi)
@@ -83,7 +79,7 @@ class basicCommands(plugins.Base):
                 final = "Error fetching"
             logger.info(final)
             return final
-        LibCommand.simpleCommand().registerCommand("hf", "Get HF radio conditions", cmd_hf)
+        LibCommand.simpleCommand().registerCommand("hf", "Get HF radio conditions", cmd_hf, idempotent=True)
 
 
         # elevation command
@@ -91,11 +87,20 @@ class basicCommands(plugins.Base):
             lat, long, hasPos = LibMesh.getPosition(interface, packet)
             name = LibMesh.getUserLong(interface, packet)
             if hasPos:
-                ele = requests.get(f"https://api.open-meteo.com/v1/elevation?latitude={lat}&longitude={long}")
-                if ele.ok:
-                    return f"{name} elevation is {ele.json()['elevation'][0]}m asl"
-                else:
+                try:
+                    return f"{name} elevation is {LibWeather.elevation.get(lat, long)['elevation'][0]}m asl"
+                except Exception:
                     return "Error fetching"
             else:
                 return "No position found!"
-        LibCommand.simpleCommand().registerCommand("elevation", "Gets your elevation", cmd_elevation)
\ No newline at end of file
+        LibCommand.simpleCommand().registerCommand("elevation", "Gets your elevation", cmd_elevation)
+
+        LibWeather.configure(cfg.config)
+        if cfg.config["weather_prefetch_cron"]:
+            _scheduler.add(cfg.config["weather_prefetch_cron"], prefetch_weather, "weather prefetch")
+
+def prefetch_weather():
+    # every node with a position, so $weather after an alert is answered from the cache
+    coords = [(cfg.config["weather_lat"], cfg.config["weather_long"])]
+    coords += [(n.latitude, n.longitude) for n in LibNodes.all_nodes() if n.latitude is not None and n.longitude is not None]
+    LibWeather.forecast.prefetch(coords)
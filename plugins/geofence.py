@@ -0,0 +1,66 @@
+import plugins
+import plugins.liblogger as logger
+import plugins.libcommand as LibCommand
+import plugins.libdiscordutil as DiscordUtil
+import plugins.libgeofence as LibGeofence
+import plugins.libmesh as LibMesh
+import plugins.libnodes as LibNodes
+import cfg
+
+def name_of(num):
+    node = LibNodes.get(num)
+    if node and node.short_name:
+        return str(node.short_name)
+    return LibMesh.decimal_to_hex(num)
+
+def _coordinates(position):
+    if "latitude" in position and "longitude" in position:
+        return position["latitude"], position["longitude"]
+    if "latitudeI" in position and "longitudeI" in position:
+        return position["latitudeI"] * 1e-7, position["longitudeI"] * 1e-7
+    return None
+
+def format_event(event, num, other, distance):
+    if event == LibGeofence.ENTERED:
+        return f"📍 {name_of(num)} entered {other}"
+    if event == LibGeofence.LEFT:
+        return f"📍 {name_of(num)} left {other}"
+    if event == LibGeofence.NEAR:
+        return f"📍 {name_of(num)} is within {int(distance)}m of {name_of(other)}"
+    return f"📍 {name_of(num)} and {name_of(other)} are {int(distance)}m apart"
+
+class geofence(plugins.Base):
+
+    def __init__(self):
+        pass
+
+    def start(self):
+        logger.info("Loading geofences")
+        fences, cells = LibGeofence.configure(cfg.config["geofences"], cfg.config["proximity_alerts"],
+                                              cfg.config["geofence_hysteresis_m"], cfg.config["geofence_debounce"],
+                                              cfg.config["proximity_max_age_minutes"])
+        logger.info(f"{fences} geofences over {cells} grid cells")
+
+        async def discord_fences(message, args, client):
+            lines = []
+            for fence in LibGeofence.fences():
+                inside = ", ".join(name_of(num) for num in LibGeofence.inside(fence.name))
+                lines.append(f"{fence.name}: {inside or 'empty'}")
+            return "```\n" + ("\n".join(lines) or "no geofences configured") + "\n```"
+        LibCommand.discordCommand().registerCommand("fences", "fences", discord_fences)
+
+    def onReceive(self, packet, interface, client):
+        decoded = packet.get("decoded")
+        if decoded is None or decoded.get("portnum") != "POSITION_APP" or "from" not in packet:
+            return
+        num = packet["from"]
+        if not LibGeofence.tracked(num):
+            return
+        coordinates = _coordinates(decoded.get("position", {}))
+        if coordinates is None:
+            return
+        channels = cfg.config["geofence_channel_ids"] or cfg.config["info_channel_ids"]
+        for event in LibGeofence.update(num, *coordinates):
+            text = format_event(*event)
+            logger.infogreen(text)
+            DiscordUtil.send_to_channels(text, client, cfg.config, channels)
@@ -0,0 +1,81 @@
+import time
+import plugins
+import plugins.liblogger as logger
+import plugins.libcommand as LibCommand
+import plugins.libhistory as LibHistory
+import plugins.libmesh as LibMesh
+import cfg
+
+_MESH_RESULTS_PER_PAGE = 3
+_DISCORD_RESULTS_PER_PAGE = 10
+_UNITS = {"m": 60, "h": 3600, "d": 86400}
+
+# used to resolve node names in discord filters
+_state = {"interface": None}
+
+def _format_result(result):
+    when, node, name, channel, text = result
+    return f"{time.strftime('%m/%d %H:%M', time.localtime(when))} {name or node}: {text}"
+
+def _parse_duration(value):
+    if value[:-1].isdigit() and value[-1] in _UNITS:
+        return int(value[:-1]) * _UNITS[value[-1]]
+    return None
+
+class history(plugins.Base):
+
+    def __init__(self):
+        pass
+
+    def start(self):
+        logger.info("Loading history")
+        LibHistory.start(cfg.config["history_file"])
+
+        def cmd_search(packet, interface, client, args):
+            words = args.split()
+            page = 1
+            if len(words) > 1 and words[-1].isdigit():
+                page = max(int(words.pop()), 1)
+            if not words:
+                return f"Usage: {cfg.config['prefix']}search <terms> [page]"
+
+            results = LibHistory.search(" ".join(words), limit=_MESH_RESULTS_PER_PAGE, offset=(page - 1) * _MESH_RESULTS_PER_PAGE)
+            if not results:
+                return "No results" if page == 1 else f"No page {page}"
+
+            header = f"p{page}\n"
+            line_len = (cfg.config["max_message_length"] - len(header)) // _MESH_RESULTS_PER_PAGE - 1
+            return header + "\n".join(_format_result(r)[:line_len] for r in results)
+        LibCommand.simpleCommand().registerCommand("search", "search <terms> [page]", cmd_search)
+
+        async def discord_search(message, args, client):
+            terms = []
+            filters = {"node": None, "channel": None, "since": None}
+            page = 1
+            for word in args.split():
+                key, _, value = word.partition(":")
+                if key == "from" and value:
+                    if _state["interface"] is None and not value.startswith("!"):
+                        return "Node not connected, use a !id"
+                    filters["node"] = LibMesh.findNode(_state["interface"], value)
+                    if filters["node"] is None:
+                        return f"Unknown node {value}"
+                elif key == "channel" and value.isdigit():
+                    filters["channel"] = int(value)
+                elif key == "since" and _parse_duration(value):
+                    filters["since"] = time.time() - _parse_duration(value)
+                elif key == "page" and value.isdigit():
+                    page = max(int(value), 1)
+                else:
+                    terms.append(word)
+            if not terms:
+                return f"Usage: {cfg.config['discord_prefix']}search <terms> [from:<node>] [channel:<n>] [since:<2h|3d>] [page:<n>]"
+
+            results = LibHistory.search(" ".join(terms), limit=_DISCORD_RESULTS_PER_PAGE, offset=(page - 1) * _DISCORD_RESULTS_PER_PAGE, **filters)
+            if not results:
+                return "No results"
+            return f"Page {page}\n```\n" + "\n".join(_format_result(r) for r in results)[:1900] + "\n```"
+        LibCommand.discordCommand().registerCommand("search", "search <terms>", discord_search)
+
+    def onConnect(self, interface, client):
+        _state["interface"] = interface
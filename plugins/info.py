@@ -60,4 +60,4 @@ This is page 0/{num_pages}"""
             
             return final_info
 
-        LibCommand.simpleCommand().registerCommand("info", "info <page>", cmd_info)
\ No newline at end of file
+        LibCommand.simpleCommand().registerCommand("info", "info <page>", cmd_info, idempotent=True)
\ No newline at end of file
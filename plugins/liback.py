@@ -0,0 +1,203 @@
+import collections
+import heapq
+import json
+import random
+import threading
+import time
+import plugins.liblogger as logger
+import plugins.libmesh as LibMesh
+import plugins.libcompress as LibCompress
+from meshtastic import BROADCAST_NUM, BROADCAST_ADDR
+
+PENDING = "pending"
+ACKED = "acked"
+# a neighbour was heard repeating the message, for a direct message the destination never acked it,
+# broadcasts have no destination to ack so this is the best they get
+RELAYED = "relayed"
+FAILED = "failed"
+
+class Pending():
+    __slots__ = ("interface", "text", "destination", "channel", "on_state", "attempts", "first_sent", "relayed")
+
+    def __init__(self, interface, text, destination, channel, on_state):
+        self.interface = interface
+        self.text = text
+        self.destination = destination
+        self.channel = channel
+        self.on_state = on_state
+        self.attempts = 0
+        self.first_sent = time.monotonic()
+        self.relayed = False
+
+class DestinationStats():
+    __slots__ = ("sent", "acked", "relayed", "failed", "retries", "ack_seconds")
+
+    def __init__(self):
+        self.sent = 0
+        self.acked = 0
+        self.relayed = 0
+        self.failed = 0
+        self.retries = 0
+        self.ack_seconds = 0.0
+
+    def as_dict(self):
+        return {
+            "sent": self.sent, "acked": self.acked, "relayed": self.relayed, "failed": self.failed,
+            "retries": self.retries,
+            "success_rate": round(self.acked / self.sent, 3) if self.sent else None,
+            "avg_ack_seconds": round(self.ack_seconds / self.acked, 1) if self.acked else None,
+        }
+
+_config = None
+_lock = threading.Condition()
+# packet id -> Pending for every send still waiting for a routing ack
+_outstanding = {}
+_deadlines = []
+_stats = collections.defaultdict(DestinationStats)
+_stats_changed = False
+
+def running():
+    return _config is not None
+
+def start(config):
+    global _config
+    _config = config
+    threading.Thread(target=_timeouts, name="ack-timeouts", daemon=True).start()
+
+def _is_broadcast(destination):
+    return destination in (BROADCAST_NUM, BROADCAST_ADDR, "^all")
+
+def _dest_key(destination):
+    if _is_broadcast(destination):
+        return "broadcast"
+    return LibMesh.decimal_to_hex(destination) if isinstance(destination, int) else str(destination)
+
+def send(interface, text, destination=BROADCAST_ADDR, channel=0, on_state=None):
+    """Send text asking for an ack, on_state(state) is called with PENDING and then the final state"""
+    if not running():
+        LibCompress.send_text(interface, text, destinationId=destination, channelIndex=channel)
+        return
+    entry = Pending(interface, text, destination, channel, on_state)
+    with _lock:
+        _stats[_dest_key(destination)].sent += 1
+    _notify(entry, PENDING)
+    _transmit(entry)
+
+def _transmit(entry):
+    global _stats_changed
+    sent = LibCompress.send_text(entry.interface, entry.text, destinationId=entry.destination, channelIndex=entry.channel, wantAck=True)
+    packet_id = sent.id if hasattr(sent, "id") else (sent or {}).get("id")
+    if packet_id is None:
+        # nothing to match an ack against
+        _finish(entry, FAILED)
+        return
+    with _lock:
+        entry.attempts += 1
+        _outstanding[packet_id] = entry
+        heapq.heappush(_deadlines, (time.monotonic() + _config["ack_timeout_seconds"], packet_id))
+        _stats_changed = True
+        _lock.notify()
+
+def _notify(entry, state):
+    if entry.on_state is not None:
+        try:
+            entry.on_state(state)
+        except Exception as e:
+            logger.warn(f"Ack state callback failed: {e}")
+
+def on_receive(packet, interface):
+    decoded = packet.get("decoded", {})
+    if decoded.get("portnum") != "ROUTING_APP" or "requestId" not in decoded:
+        return
+    error = decoded.get("routing", {}).get("errorReason", "NONE")
+    with _lock:
+        entry = _outstanding.get(decoded["requestId"])
+        if entry is None:
+            return
+        if error == "NONE" and packet.get("from") == interface.localNode.nodeNum and not _is_broadcast(entry.destination):
+            # implicit ack, our radio heard a neighbour repeat it, keep waiting for the destination
+            entry.relayed = True
+            return
+        del _outstanding[decoded["requestId"]]
+    if error == "NONE":
+        _finish(entry, RELAYED if _is_broadcast(entry.destination) else ACKED)
+    else:
+        logger.info(f"Send to {_dest_key(entry.destination)} was refused: {error}")
+        _retry_or_fail(entry)
+
+def _finish(entry, state):
+    global _stats_changed
+    with _lock:
+        stats = _stats[_dest_key(entry.destination)]
+        if state == ACKED:
+            stats.acked += 1
+            stats.ack_seconds += time.monotonic() - entry.first_sent
+        elif state == RELAYED:
+            stats.relayed += 1
+        else:
+            stats.failed += 1
+        _stats_changed = True
+    _notify(entry, state)
+
+def retry_delay(attempt, channel_utilization):
+    """Exponential backoff stretched by how busy the channel is, with jitter so retries from
+    several nodes do not line up"""
+    delay = _config["ack_retry_base_seconds"] * 2 ** (attempt - 1)
+    delay *= 1 + (channel_utilization or 0) / 20
+    return delay * random.uniform(0.8, 1.2)
+
+def _retry_or_fail(entry):
+    # a broadcast is never resent, every node that already heard it would get it again
+    if _is_broadcast(entry.destination) or entry.attempts > _config["ack_max_retries"]:
+        _finish(entry, RELAYED if entry.relayed else FAILED)
+        return
+    with _lock:
+        _stats[_dest_key(entry.destination)].retries += 1
+    delay = retry_delay(entry.attempts, LibMesh.getChannelUtilization(entry.interface))
+    timer = threading.Timer(delay, _resend, [entry])
+    timer.daemon = True
+    timer.start()
+
+def _resend(entry):
+    try:
+        _transmit(entry)
+    except Exception as e:
+        logger.warn(f"Resend to {_dest_key(entry.destination)} failed: {e}")
+        _finish(entry, FAILED)
+
+def _timeouts():
+    last_export = time.monotonic()
+    while True:
+        expired = []
+        with _lock:
+            now = time.monotonic()
+            while _deadlines and _deadlines[0][0] <= now:
+                packet_id = heapq.heappop(_deadlines)[1]
+                entry = _outstanding.pop(packet_id, None)
+                if entry is not None:
+                    expired.append(entry)
+            wait = min(_deadlines[0][0] - now if _deadlines else 60, 60)
+        for entry in expired:
+            _retry_or_fail(entry)
+        if time.monotonic() - last_export >= 60:
+            _export()
+            last_export = time.monotonic()
+        if not expired:
+            with _lock:
+                _lock.wait(max(wait, 0.05))
+
+def outstanding():
+    with _lock:
+        return len(_outstanding)
+
+def stats():
+    with _lock:
+        return {dest: s.as_dict() for dest, s in _stats.items()}
+
+def _export():
+    global _stats_changed
+    if not _config["ack_stats_file"] or not _stats_changed:
+        return
+    _stats_changed = False
+    with open(_config["ack_stats_file"], "w", encoding="utf-8") as f:
+        json.dump(stats(), f, indent=1)
@@ -0,0 +1,96 @@
+import json
+import os
+import zlib
+import plugins.liblogger as logger
+
+_DEFAULT_LIMIT = 100
+_MAX_LIMIT = 1000
+# encoded pages kept per snapshot, the usual pollers only ask for a few
+_MAX_PAGES = 64
+
+# differs between runs so etags from before a restart never match
+_boot = os.urandom(4).hex()
+
+class Snapshot():
+    """JSON for one endpoint, rebuilt only when version() changes. build() returns a list,
+    which is paginated, or a dict, which is served whole"""
+
+    def __init__(self, name, version, build):
+        self.name = name
+        self.version = version
+        self.build = build
+        self._built_version = None
+        self._items = None
+        self._pages = {}
+
+    def etag(self, version, offset, limit):
+        return f'"{_boot}-{zlib.crc32(repr((self.name, version, offset, limit)).encode()):08x}"'
+
+    def page(self, version, offset, limit):
+        if version != self._built_version or self._items is None:
+            self._items = self.build()
+            self._built_version = version
+            self._pages = {}
+        key = (offset, limit)
+        body = self._pages.get(key)
+        if body is None:
+            if isinstance(self._items, list):
+                data = {"total": len(self._items), "offset": offset, "limit": limit,
+                        "items": self._items[offset:offset + limit]}
+            else:
+                data = self._items
+            body = json.dumps(data, separators=(",", ":")).encode()
+            if len(self._pages) >= _MAX_PAGES:
+                self._pages.clear()
+            self._pages[key] = body
+        return body
+
+_snapshots = {}
+# path -> handler for endpoints that are not snapshots
+_routes = {}
+
+def register(name, version, build):
+    _snapshots[name] = Snapshot(name, version, build)
+
+def route(path, handler):
+    _routes[path] = handler
+
+def _paging(query):
+    offset = int(query.get("offset", 0))
+    limit = int(query.get("limit", _DEFAULT_LIMIT))
+    if offset < 0 or limit < 1:
+        raise ValueError
+    return offset, min(limit, _MAX_LIMIT)
+
+async def serve(host, port):
+    from aiohttp import web
+
+    async def handle(request):
+        snapshot = _snapshots.get(request.match_info["name"])
+        if snapshot is None:
+            return web.json_response({"error": "not found", "endpoints": sorted(_snapshots)}, status=404)
+        try:
+            offset, limit = _paging(request.query)
+        except ValueError:
+            return web.json_response({"error": "offset and limit must be positive integers"}, status=400)
+        version = snapshot.version()
+        etag = snapshot.etag(version, offset, limit)
+        headers = {"ETag": etag, "Cache-Control": "no-cache"}
+        # pollers that already have this version are answered without touching the snapshot
+        if etag in request.headers.get("If-None-Match", ""):
+            return web.Response(status=304, headers=headers)
+        body = snapshot.page(version, offset, limit)
+        return web.Response(body=body, headers=headers, content_type="application/json")
+
+    async def index(request):
+        return web.json_response({"endpoints": sorted(_snapshots), "other": sorted(_routes)})
+
+    app = web.Application()
+    app.router.add_get("/api", index)
+    for path, handler in _routes.items():
+        app.router.add_get(path, handler)
+    app.router.add_get("/api/{name}", handle)
+    runner = web.AppRunner(app, access_log=None)
+    await runner.setup()
+    await web.TCPSite(runner, host, port).start()
+    logger.info(f"HTTP API listening on http://{host}:{port}/api")
@@ -0,0 +1,17 @@
+import asyncio
+import threading
+
+# Shared background event loop for plugins that are not tied to the discord client loop
+_loop = None
+_lock = threading.Lock()
+
+def get_loop():
+    global _loop
+    with _lock:
+        if _loop is None:
+            _loop = asyncio.new_event_loop()
+            threading.Thread(target=_loop.run_forever, name="meshlink-async", daemon=True).start()
+    return _loop
+
+def submit(coro):
+    return asyncio.run_coroutine_threadsafe(coro, get_loop())
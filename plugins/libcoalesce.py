@@ -0,0 +1,44 @@
+import threading
+import time
+import cfg
+
+CLAIMED = 0
+ATTACHED = 1
+RECENT = 2
+
+_MAX_TRACKED_REPLIES = 256
+
+# (channel, command, args) -> time the broadcast reply went out, None while a command worker
+# is still computing it, requests arriving then on the other workers attach to that reply
+_replies = {}
+_lock = threading.Lock()
+
+def _prune(now, window):
+    for key, sent_at in list(_replies.items()):
+        if sent_at is not None and now - sent_at > window:
+            del _replies[key]
+
+def claim(key):
+    """Returns CLAIMED when the caller should compute and broadcast the reply,
+    ATTACHED when another command worker is still computing an identical reply and RECENT when one went out
+    within coalesce_window seconds"""
+    window = cfg.config["coalesce_window"]
+    now = time.monotonic()
+    with _lock:
+        if key in _replies:
+            sent_at = _replies[key]
+            if sent_at is None:
+                return ATTACHED
+            if now - sent_at <= window:
+                return RECENT
+        _replies[key] = None
+        if len(_replies) > _MAX_TRACKED_REPLIES:
+            _prune(now, window)
+    return CLAIMED
+
+def release(key, sent):
+    with _lock:
+        if sent:
+            _replies[key] = time.monotonic()
+        else:
+            _replies.pop(key, None)
@@ -1,24 +1,72 @@
+import concurrent.futures
+import threading
+import traceback
 import plugins.liblogger as logger
 import plugins.libdiscordutil as DiscordUtil
 import plugins.libinfo as LibInfo
 import plugins.libmesh as LibMesh
+import plugins.libcoalesce as LibCoalesce
 import cfg
+from meshtastic import BROADCAST_ADDR
 
 commands = []
+discord_commands = []
+_executor = None
+_slots = None
+
+def start(workers):
+    """Mesh commands run on a pool of worker threads, so a command waiting for the network
+    (weather waits for its batch) does not hold up the ones behind it"""
+    global _executor, _slots
+    _executor = concurrent.futures.ThreadPoolExecutor(workers, thread_name_prefix="command")
+    # dispatch blocks once every worker is busy, the event bus queue then fills up as before
+    _slots = threading.BoundedSemaphore(workers)
+
+def dispatch(packet, interface, client):
+    decoded = packet.get("decoded")
+    if decoded is None or decoded.get("portnum") != "TEXT_MESSAGE_APP" or not decoded.get("text", "").startswith(cfg.config["prefix"]):
+        return
+    if _executor is None:
+        _run(packet, interface, client)
+        return
+    _slots.acquire()
+    _executor.submit(_run, packet, interface, client, True)
+
+def _run(packet, interface, client, release=False):
+    try:
+        for cmd in commands:
+            try:
+                cmd.onReceive(packet, interface, client)
+            except Exception:
+                logger.warn(f"Command {cmd.name} failed")
+                traceback.print_exc()
+    finally:
+        if release:
+            _slots.release()
+
+def getCommand(name):
+    for cmd in commands:
+        if cmd.name == name:
+            return cmd
+    return None
 
 class simpleCommand():
     """Basic command class, use this to create simple commands.
     registerCommand("Hello", "This command tells you hello!", callback function)
+    Pass idempotent=True when the reply only depends on the command text, identical
+    broadcast requests on a channel are then answered once per coalesce_window.
     """
     name = ""
     info = ""
     callback = None
+    idempotent = False
 
 
-    def registerCommand(self, name, info, callback):
+    def registerCommand(self, name, info, callback, idempotent=False):
         self.name = name
         self.info = info
         self.callback = callback
+        self.idempotent = idempotent
         commands.append(self)
 
         LibInfo.info.append(f"{name} - {info}")
@@ -36,6 +84,10 @@ class simpleCommand():
                     args = parts[1] if len(parts) > 1 else ""
 
                     if command_name == self.name:
+                        if self.idempotent and LibMesh.getReplyDestination(interface, packet) == BROADCAST_ADDR:
+                            self.coalescedReply(packet, interface, client, args)
+                            return
+
                         reply = self.executeCommand(packet, interface, client, args)
                         LibMesh.sendReply(reply, interface, packet)
 
@@ -44,8 +96,76 @@ class simpleCommand():
                             incoming_ch = packet.get("channel", 0)
                             discord_ch = LibMesh.resolve_send_channel_index(incoming_ch)
                             DiscordUtil.send_msg(formatted_reply, client, cfg.config, discord_ch)
-                    
-    
+
+    def coalescedReply(self, packet, interface, client, args):
+        channel = LibMesh.resolve_send_channel_index(packet.get("channel", 0))
+        key = (channel, self.name, args)
+        status = LibCoalesce.claim(key)
+        if status == LibCoalesce.ATTACHED:
+            logger.info(f"Attached {self.name} request to pending reply on channel {channel}")
+            return
+        if status == LibCoalesce.RECENT:
+            logger.info(f"Suppressed repeated {self.name} reply on channel {channel}")
+            if cfg.config["coalesce_pointer"]:
+                LibMesh.sendReply(cfg.config["coalesce_pointer"], interface, packet)
+            return
+
+        sent = False
+        try:
+            reply = self.executeCommand(packet, interface, client, args)
+            LibMesh.sendReply(reply, interface, packet)
+            sent = True
+        finally:
+            LibCoalesce.release(key, sent)
+
+        if(cfg.config["send_mesh_commands_to_discord"]):
+            DiscordUtil.send_msg(DiscordUtil.format_command_response(reply), client, cfg.config, channel)
+
     def executeCommand(self, packet, interface, client, args):
         return self.callback(packet, interface, client, args)
         
+
+
+def may_transmit(channel_id):
+    if not cfg.config["permit_broadcast_of_discord_messages"]:
+        return False
+    return (channel_id in cfg.config["message_channel_ids"] or
+            channel_id in cfg.config.get("secondary_channel_message_ids", []))
+
+class discordCommand():
+    """Discord command class, the callback is a coroutine that gets the discord message
+    and the text after the command and returns the reply text (or None).
+    registerCommand("mail", "mail <node> <text>", async callback function, transmits=True)
+    Pass transmits=True when the command sends to the mesh, it is then only accepted in the
+    message channels and when permit_broadcast_of_discord_messages is on, like send.
+    """
+    name = ""
+    info = ""
+    callback = None
+    transmits = False
+
+
+    def registerCommand(self, name, info, callback, transmits=False):
+        self.name = name
+        self.info = info
+        self.callback = callback
+        self.transmits = transmits
+        discord_commands.append(self)
+
+    async def onMessage(self, message, client):
+        prefix = cfg.config["discord_prefix"]
+        if not message.content.startswith(prefix):
+            return False
+
+        parts = message.content[len(prefix):].split(maxsplit=1)
+        if not parts or parts[0] != self.name:
+            return False
+        args = parts[1] if len(parts) > 1 else ""
+
+        if self.transmits and not may_transmit(message.channel.id):
+            return True
+
+        reply = await self.callback(message, args, client)
+        if reply:
+            await message.reply(reply[:2000], mention_author=False)
+        return True
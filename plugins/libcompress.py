@@ -0,0 +1,190 @@
+import threading
+import zlib
+import plugins.liblogger as logger
+from meshtastic import BROADCAST_NUM, BROADCAST_ADDR
+from meshtastic.protobuf import portnums_pb2
+
+# first payload byte of a compressed PRIVATE_APP packet, the low bits are the codebook version.
+# The second is a check byte over the first and the body, so PRIVATE_APP payloads of other
+# applications that happen to start with 0xC? are left alone. A payload of only these two bytes
+# announces that the sender can read compressed text
+MAGIC = 0xC3
+_MARKER = MAGIC & 0xF0
+VERSION = MAGIC & 0x0F
+HEADER = 2
+# codes below _LITERAL index CODEBOOK, one literal byte follows _LITERAL,
+# a length byte and that many literal bytes follow _LITERAL_RUN
+_LITERAL = 254
+_LITERAL_RUN = 255
+
+# SMAZ style codebook tuned on MeshLink command replies and english text, regenerate with
+# python -m harness.compressbench --train and bump MAGIC when it changes
+CODEBOOK = (
+    " ", "\n", "0", "1", "o", "2", "F", "5", "%", "m", "i", "3", "8", "n", "4", "7", ":", "a", "r", "6", "d",
+    "-", "s", "9", "t", "(", ")", "O", "P", "p", "e", "M", "l", "C", "g", "f", "G", "u", "Y", ".", "h", "v",
+    "A", "S", "I", "Q", "N", "w", "y", "k", ",", ">", "V", "c", "W", "B", "L", "T", "Z", "K", "D", "J", "R",
+    "E", "U", "H", "b", "X", "q", "j", "x", "z", "'", "<", ";", "!", " position)", "0%\n", "F ", "\n(Config ",
+    "m Good\n", "m Fair\n", "m Poor\n", "5%\n", "\n(Your ", "80m-40m", "30m-20m", "17m-15m", "12m-10", ": ",
+    " elevation is ", " links, heard ", "\nPM2.5:", " hops away)", "\nPM10:", "Mail from", "O2:", " 4",
+    ".0m asl", " 3", "m ago)", " 5", " 8", " waiting)", " 7", " 2", "Mail for ", "AQI", "\nNO", "\nCO",
+    "\nO3", "\nSO", " 6", " saved (", " via ", " 9", "19", "18", " > ", "11", "13", "22", "23", "14", "16",
+    "21", "d3", "d1", "n8", "n3", "n1", "d8", " you", ". - ", "e ", "(2", "0\n", "5\n", "9\n", "8\n", " th",
+    "2\n", "t ", "3\n", "6\n", "4\n", "7\n", "1\n", "(3", "(4", "an", ":5", " 10", ":0", ":4", "ing ", ":3",
+    "er", "o ", ":2", "ha", "en", "es", "y ", "0 ", "56", "re", " b", " c", ":1", "(1", "58", "54", "86",
+    "59", "41", "47", "75", "88", "73", "78", "45", "85", "82", "74", " m", "49", "71", "66", "28", "29",
+    "63", "77", "36", "69", "34", " d", "24", "48", "84", "44", "79", "52", "no", " o", "7 ", "76", "50",
+    "65", "64", "will", "5 ", "70", "89", "83", "26", "33", "lif", "hi", "51", "60", "in ", "55", "61", "42",
+    "67", "2 ", "32", "31", "68", "6 ", "1 ", "53", "al", "ne", "3 ", "87", "38", "39", "us", "f ", "25",
+    "43", "62", "46", "72", "02", "35", "57", "some", "com", "C ", "04", "06",
+)
+
+_table = {entry.encode(): code for code, entry in enumerate(CODEBOOK)}
+_longest = max((len(entry) for entry in _table), default=1)
+_decode_table = [entry.encode() for entry in CODEBOOK]
+
+def _flush(out, literal):
+    while literal:
+        chunk = literal[:255]
+        del literal[:255]
+        if len(chunk) == 1:
+            out.append(_LITERAL)
+        else:
+            out.append(_LITERAL_RUN)
+            out.append(len(chunk))
+        out += chunk
+
+def encode(text):
+    data = text.encode()
+    out = bytearray()
+    literal = bytearray()
+    i = 0
+    end = len(data)
+    while i < end:
+        # greedy longest match
+        for length in range(min(_longest, end - i), 0, -1):
+            code = _table.get(data[i:i + length])
+            if code is not None:
+                break
+        if code is None:
+            literal.append(data[i])
+            i += 1
+            continue
+        _flush(out, literal)
+        out.append(code)
+        i += length
+    _flush(out, literal)
+    return bytes(out)
+
+def decode(data):
+    out = bytearray()
+    i = 0
+    end = len(data)
+    while i < end:
+        code = data[i]
+        if code == _LITERAL:
+            out += data[i + 1:i + 2]
+            i += 2
+        elif code == _LITERAL_RUN:
+            length = data[i + 1]
+            out += data[i + 2:i + 2 + length]
+            i += 2 + length
+        else:
+            out += _decode_table[code]
+            i += 1
+    if i != end:
+        raise ValueError("truncated compressed text")
+    return out.decode()
+
+def _check(first, body):
+    return zlib.crc32(body, zlib.crc32(bytes([first]))) & 0xFF
+
+def frame(text):
+    """The PRIVATE_APP payload for text, an empty text gives the announcement"""
+    body = encode(text)
+    return bytes([MAGIC, _check(MAGIC, body)]) + body
+
+_lock = threading.Lock()
+_config = {"compress_text": False, "compress_broadcasts": False}
+# node num -> codebook version, from config (assumed to run ours) and from their announcements
+_peers = {}
+
+def _node_num(value):
+    if isinstance(value, str):
+        return int(value.lstrip("!"), 16)
+    return int(value)
+
+def configure(config):
+    _config["compress_text"] = config["compress_text"]
+    _config["compress_broadcasts"] = config["compress_broadcasts"]
+    with _lock:
+        _peers.update((_node_num(n), VERSION) for n in config["compress_peers"] or [])
+
+def _is_broadcast(destination):
+    return destination in (BROADCAST_NUM, BROADCAST_ADDR, "^all")
+
+def can_read(destination):
+    if _is_broadcast(destination):
+        return _config["compress_broadcasts"]
+    try:
+        num = _node_num(destination)
+    except ValueError:
+        return False
+    with _lock:
+        # a peer with another codebook would decode garbage, it gets plain text
+        return _peers.get(num) == VERSION
+
+def peers():
+    with _lock:
+        return sorted(num for num, version in _peers.items() if version == VERSION)
+
+def send_text(interface, text, destinationId=BROADCAST_ADDR, channelIndex=0, wantAck=False):
+    """sendText that compresses for MeshLink nodes, everyone else gets plain text"""
+    if _config["compress_text"] and can_read(destinationId):
+        payload = frame(text)
+        if len(payload) < len(text.encode()):
+            return interface.sendData(payload, destinationId=destinationId, portNum=portnums_pb2.PRIVATE_APP,
+                                      channelIndex=channelIndex, wantAck=wantAck)
+    return interface.sendText(text, destinationId=destinationId, channelIndex=channelIndex, wantAck=wantAck)
+
+def announce(interface, destination=BROADCAST_ADDR, channel=0):
+    if _config["compress_text"]:
+        interface.sendData(frame(""), destinationId=destination, portNum=portnums_pb2.PRIVATE_APP, channelIndex=channel)
+
+def on_receive(packet, interface):
+    """Turn a compressed packet back into a normal text message before anything else sees it"""
+    decoded = packet.get("decoded")
+    if decoded is None or decoded.get("portnum") != "PRIVATE_APP" or "from" not in packet:
+        return
+    payload = decoded.get("payload") or b""
+    if len(payload) < HEADER or payload[0] & 0xF0 != _MARKER or payload[1] != _check(payload[0], payload[HEADER:]):
+        return
+    num = packet["from"]
+    version = payload[0] & 0x0F
+    if version != VERSION and len(payload) > HEADER:
+        # another codebook, the text can not be read here, leave the packet as it is
+        logger.warn(f"Ignoring compressed text from !{num:08x}, codebook version {version} but ours is {VERSION}")
+        return
+    text = None
+    if len(payload) > HEADER:
+        try:
+            text = decode(payload[HEADER:])
+        except (ValueError, IndexError, UnicodeDecodeError):
+            logger.warn(f"Bad compressed text from !{num:08x}")
+            return
+    with _lock:
+        new = _peers.get(num) != version
+        _peers[num] = version
+    if new:
+        if version == VERSION:
+            logger.info(f"!{num:08x} reads compressed text")
+        else:
+            logger.warn(f"!{num:08x} uses codebook version {version}, ours is {VERSION}, it gets plain text")
+    if text is None:
+        # answer an announcement directly so the sender learns about us too
+        if new and _config["compress_text"] and num != getattr(interface.localNode, "nodeNum", None):
+            announce(interface, num, int(packet.get("channel", 0)))
+        return
+    decoded["portnum"] = "TEXT_MESSAGE_APP"
+    decoded["payload"] = text.encode()
+    decoded["text"] = text
+    packet["compressedSize"] = len(payload)
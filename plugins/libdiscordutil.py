@@ -1,11 +1,24 @@
 import asyncio
 import collections
+import threading
+import time
+import discord
 import plugins.libmesh as LibMesh
 import plugins.liblogger as logger
+import plugins.libspool as LibSpool
 
 _MAX_TRACKED_MESSAGES = 1000
 _packet_message_ids = collections.OrderedDict()
 
+_MAX_DISCORD_MESSAGE = 2000
+# (node, portnum) -> [count, hops, snr] collected since the last digest flush
+_digest_rows = {}
+_digest_lock = threading.Lock()
+# info channel id -> {"message_id", "rows", "since"} of the digest we may still edit
+_digest_channels = {}
+_digest_task = None
+_webhooks = None
+
 def _safe_int(value):
     try:
         return int(value)
@@ -77,44 +90,285 @@ def genUserName(interface, packet, details=True):
     
     return result
 
+def _message_channels(config, channel_id):
+    if config.get("secondary_channel_message_ids") and channel_id and channel_id > 0:
+        return [config["secondary_channel_message_ids"][channel_id-1]]
+    return list(config["message_channel_ids"])
+
 def send_msg(message,client,config,channel_id=0,packet_id=None,reply_id=None):
     if config["use_discord"]:
-        if (client.is_ready()):
-            if config.get("secondary_channel_message_ids") and channel_id and channel_id > 0:
-                channels = [config["secondary_channel_message_ids"][channel_id-1]]
-            else:
-                channels = list(config["message_channel_ids"])
-
-            for chan_id in channels:
-                channel = client.get_channel(chan_id)
-                if channel is None:
-                    continue
+        for chan_id in _message_channels(config, channel_id):
+            payload = {"message": message, "channel": chan_id, "packet_id": packet_id, "reply_id": reply_id}
+            _spool(payload, client, config, f"discord:{chan_id}:{packet_id}" if packet_id is not None else None)
 
-                async def _send_to_channel(ch, ch_id):
-                    target_id = _lookup_message_id(ch_id, reply_id)
-                    if target_id is not None:
-                        try:
-                            target = await ch.fetch_message(target_id)
-                            sent = await target.reply(message, mention_author=False)
-                        except Exception:
-                            sent = await ch.send(message)
-                    else:
-                        sent = await ch.send(message)
+def send_text_message(interface, packet, client, config, channel_id=0, reply_id=None):
+    if not config["use_webhooks"]:
+        send_msg(format_text_message(interface, packet, config), client, config, channel_id, packet.get("id"), reply_id)
+        return
+
+    if config["use_discord"]:
+        username = format_webhook_username(interface, packet)
+        message = format_webhook_text(packet, config)
+        for chan_id in _message_channels(config, channel_id):
+            payload = {"webhook": True, "username": username, "message": message, "channel": chan_id, "packet_id": packet.get("id")}
+            _spool(payload, client, config, f"discord:{chan_id}:{packet.get('id')}")
 
-                    _track_message_id(ch_id, packet_id, sent.id)
+def _spool(payload, client, config, msg_id):
+    # worker processes have no spool, they send straight away like before
+    if LibSpool.running():
+        LibSpool.put("discord", payload, msg_id)
+    else:
+        deliver(payload, client, config, lambda ok: None)
 
-                asyncio.run_coroutine_threadsafe(_send_to_channel(channel, chan_id), client.loop)
+def deliver(payload, client, config, done):
+    """Sender for spooled Discord messages, done(ok) is called once Discord answered"""
+    global _webhooks
+    if not client.is_ready():
+        logger.warn("Tried to send but Discord client not ready yet")
+        done(False)
+        return
+
+    chan_id = payload["channel"]
+    if payload.get("digest"):
+        _deliver_digest(payload, client, done)
+        return
+    if payload.get("webhook"):
+        if _webhooks is None:
+            _webhooks = WebhookTransport(client, config)
+        _webhooks.send(chan_id, payload["username"], payload["message"], payload["packet_id"], done)
+        return
+
+    channel = client.get_channel(chan_id)
+    if channel is None:
+        done(True)
+        return
+
+    async def _send_to_channel(ch, ch_id):
+        target_id = _lookup_message_id(ch_id, payload["reply_id"])
+        if target_id is not None:
+            try:
+                target = await ch.fetch_message(target_id)
+                sent = await target.reply(payload["message"], mention_author=False)
+            except Exception:
+                sent = await ch.send(payload["message"])
         else:
-            logger.warn("Tried to send but Discord client not ready yet")
+            sent = await ch.send(payload["message"])
+
+        _track_message_id(ch_id, payload["packet_id"], sent.id)
+
+    future = asyncio.run_coroutine_threadsafe(_send_to_channel(channel, chan_id), client.loop)
+    future.add_done_callback(lambda f: done(not f.cancelled() and f.exception() is None))
 
 def send_info(message,client,config):
+    send_to_channels(message, client, config, config["info_channel_ids"])
+
+class WebhookTransport():
+    """Posts bridged mesh messages through channel webhooks so they do not share the bot's
+    rate limits. Each channel has its own queue and sender, consecutive messages from the
+    same node are batched into one post and the webhook's rate limit headers are honoured.
+    """
+
+    def __init__(self, client, config):
+        self.client = client
+        self.urls = {int(k): v for k, v in (config["webhook_urls"] or {}).items()}
+        self.session = None
+        self.queues = {}
+
+    def send(self, chan_id, username, message, packet_id, done):
+        self.client.loop.call_soon_threadsafe(self._enqueue, chan_id, (username, message, packet_id, done))
+
+    def _enqueue(self, chan_id, item):
+        if chan_id not in self.queues:
+            self.queues[chan_id] = asyncio.Queue()
+            self.client.loop.create_task(self._sender(chan_id))
+        self.queues[chan_id].put_nowait(item)
+
+    async def _url_for(self, chan_id):
+        if chan_id not in self.urls:
+            channel = self.client.get_channel(chan_id)
+            if channel is None:
+                return None
+            hook = next((h for h in await channel.webhooks() if h.name == "MeshLink" and h.url), None)
+            if hook is None:
+                hook = await channel.create_webhook(name="MeshLink")
+            self.urls[chan_id] = hook.url
+        return self.urls[chan_id]
+
+    async def _sender(self, chan_id):
+        import aiohttp
+        if self.session is None:
+            self.session = aiohttp.ClientSession(connector=aiohttp.TCPConnector(limit=8))
+        queue = self.queues[chan_id]
+        pending = None
+        while True:
+            username, message, packet_id, done = pending or await queue.get()
+            pending = None
+            packet_ids = [packet_id]
+            dones = [done]
+            # merge whatever the same node queued meanwhile
+            while not queue.empty():
+                next_username, next_message, next_id, next_done = queue.get_nowait()
+                if next_username != username or len(message) + len(next_message) + 1 > _MAX_DISCORD_MESSAGE:
+                    pending = (next_username, next_message, next_id, next_done)
+                    break
+                message += "\n" + next_message
+                packet_ids.append(next_id)
+                dones.append(next_done)
+
+            sent = None
+            try:
+                url = await self._url_for(chan_id)
+                if url is not None:
+                    sent = await self._post(url, {"username": username, "content": message})
+            except Exception as e:
+                logger.warn(f"Webhook send to {chan_id} failed: {e}")
+            for done in dones:
+                done(sent is not None)
+            if sent is not None:
+                for i in packet_ids:
+                    _track_message_id(chan_id, i, sent["id"])
+
+    async def _post(self, url, payload):
+        while True:
+            async with self.session.post(url, params={"wait": "true"}, json=payload) as resp:
+                if resp.status == 429:
+                    retry_after = (await resp.json()).get("retry_after", 1)
+                    await asyncio.sleep(float(retry_after))
+                    continue
+                if resp.status >= 400:
+                    logger.warn(f"Webhook returned {resp.status}: {await resp.text()}")
+                    return None
+                sent = await resp.json()
+                # wait out the bucket instead of running into a 429
+                if resp.headers.get("X-RateLimit-Remaining") == "0":
+                    await asyncio.sleep(float(resp.headers.get("X-RateLimit-Reset-After", 1)))
+                return sent
+
+def send_to_channels(message, client, config, channel_ids):
+    if config["use_discord"]:
+        for chan_id in channel_ids:
+            _spool({"message": message, "channel": chan_id, "packet_id": None, "reply_id": None}, client, config, None)
+
+def send_files(message, paths, client, config, channel_id):
     if config["use_discord"]:
         if (client.is_ready()):
-            for i in config["info_channel_ids"]:
-                asyncio.run_coroutine_threadsafe(client.get_channel(i).send(message),client.loop)
+            channel = client.get_channel(channel_id)
+            if channel is None:
+                logger.warn(f"Tried to send files to unknown channel {channel_id}")
+                return
+            files = [discord.File(path) for path in paths]
+            asyncio.run_coroutine_threadsafe(channel.send(message[:_MAX_DISCORD_MESSAGE], files=files), client.loop)
+        else:
+            logger.warn("Tried to send but Discord client not ready yet")
+
+_DELIVERY_REACTIONS = {"pending": "⏳", "acked": "✅", "relayed": "☑️", "failed": "❌"}
+
+def show_delivery_state(client, channel_id, message_id, state):
+    """Mark a bridged Discord message with how its mesh delivery is going"""
+    channel = client.get_channel(channel_id)
+    if channel is None:
+        return
+    message = channel.get_partial_message(message_id)
 
+    async def _react():
+        if state != "pending":
+            await message.remove_reaction(_DELIVERY_REACTIONS["pending"], client.user)
+        await message.add_reaction(_DELIVERY_REACTIONS[state])
+
+    asyncio.run_coroutine_threadsafe(_react(), client.loop)
+
+def send_packet_info(interface, packet, portnum, client, config):
+    if config["info_digest_window"]:
+        add_to_digest(interface, packet, portnum, client, config)
+    elif portnum is None:
+        send_info(format_encrypted_message(interface, packet), client, config)
+    else:
+        send_info(format_packet_info(interface, packet, portnum), client, config)
+
+def add_to_digest(interface, packet, portnum, client, config):
+    global _digest_task
+    if not config["use_discord"]:
+        return
+
+    node = LibMesh.getUserShort(interface, packet) or packet.get("fromId") or "?"
+    port = "ENCRYPTED" if portnum is None else str(portnum).replace("_APP", "")
+    hops = None
+    if "hopStart" in packet and "hopLimit" in packet:
+        hops = f"{packet['hopStart'] - packet['hopLimit']}/{packet['hopStart']}"
+    snr = packet.get("rxSnr")
+
+    with _digest_lock:
+        row = _digest_rows.get((node, port))
+        if row is None:
+            _digest_rows[(node, port)] = [1, hops, snr]
         else:
-            logger.warn("Tried to send info but Discord client not ready yet")
+            row[0] += 1
+            if hops is not None:
+                row[1] = hops
+            if snr is not None:
+                row[2] = snr
+
+    if _digest_task is None and client.is_ready():
+        _digest_task = asyncio.run_coroutine_threadsafe(_digest_loop(client, config), client.loop)
+
+def _merge_digest_rows(old, new):
+    merged = {key: list(row) for key, row in old.items()}
+    for key, (count, hops, snr) in new.items():
+        if key in merged:
+            merged[key][0] += count
+            merged[key][1] = hops if hops is not None else merged[key][1]
+            merged[key][2] = snr if snr is not None else merged[key][2]
+        else:
+            merged[key] = [count, hops, snr]
+    return merged
+
+async def _digest_loop(client, config):
+    while True:
+        await asyncio.sleep(config["info_digest_window"])
+        with _digest_lock:
+            rows = dict(_digest_rows)
+            _digest_rows.clear()
+        if not rows:
+            continue
+
+        now = time.time()
+        window_start = now - config["info_digest_window"]
+        # spooled like any other message, the rows are replayed after a restart
+        rows = [[node, port, count, hops, snr] for (node, port), (count, hops, snr) in rows.items()]
+        for chan_id in config["info_channel_ids"]:
+            payload = {"digest": True, "channel": chan_id, "rows": rows, "since": window_start, "until": now}
+            _spool(payload, client, config, None)
+
+def _deliver_digest(payload, client, done):
+    chan_id = payload["channel"]
+    channel = client.get_channel(chan_id)
+    if channel is None:
+        done(True)
+        return
+    rows = {(node, port): [count, hops, snr] for node, port, count, hops, snr in payload["rows"]}
+    future = asyncio.run_coroutine_threadsafe(_flush_digest(channel, chan_id, rows, payload["since"], payload["until"]), client.loop)
+
+    def _finished(f):
+        ok = not f.cancelled() and f.exception() is None
+        if not ok and not f.cancelled():
+            logger.warn(f"Failed to send packet digest to {chan_id}: {f.exception()}")
+        done(ok)
+    future.add_done_callback(_finished)
+
+async def _flush_digest(channel, chan_id, rows, window_start, now):
+    state = _digest_channels.get(chan_id)
+    # edit the previous digest while it is still the newest message in the channel
+    if state and channel.last_message_id == state["message_id"]:
+        merged = _merge_digest_rows(state["rows"], rows)
+        message = format_packet_digest(merged, state["since"], now)
+        if len(message) <= _MAX_DISCORD_MESSAGE:
+            await channel.get_partial_message(state["message_id"]).edit(content=message)
+            state["rows"] = merged
+            return
+
+    message = format_packet_digest(rows, window_start, now)
+    sent = await channel.send(message)
+    _digest_channels[chan_id] = {"message_id": sent.id, "rows": rows, "since": window_start}
 
 # ============================================================================
 # Discord Message Formatting Functions
@@ -131,6 +385,27 @@ def format_text_message(interface, packet, config):
     
     return message
 
+def format_webhook_username(interface, packet):
+
+    name = LibMesh.getUserLong(interface, packet) or ""
+    # discord rejects webhook names containing "discord" and longer than 80 characters
+    name = name.replace("discord", "d1scord").replace("Discord", "D1scord").strip()
+    return (name or "Unknown")[:80]
+
+def format_webhook_text(packet, config):
+
+    message = packet["decoded"]["text"]
+    hops = ""
+    if "hopLimit" in packet and "hopStart" in packet:
+        hops = f"{packet['hopStart'] - packet['hopLimit']}/{packet['hopStart']}"
+    if "viaMqtt" in packet and str(packet["viaMqtt"]) == "True":
+        hops += "[MQTT]"
+    if hops:
+        message = f"`{hops}` {message}"
+    if config["ping_on_messages"]:
+        message += f" ||{config['message_role']}||"
+    return message
+
 def format_encrypted_message(interface, packet):
 
     username = genUserName(interface, packet)
@@ -149,4 +424,19 @@ def format_system_message(message, is_header=False):
 
 def format_command_response(response):
 
-    return f"`MeshLink` > {response}"
\ No newline at end of file
+    return f"`MeshLink` > {response}"
+
+def format_packet_digest(rows, since, until):
+
+    header = f"Packets {time.strftime('%H:%M', time.localtime(since))}-{time.strftime('%H:%M', time.localtime(until))}"
+    lines = [f"{'node':<9} {'port':<13} {'n':>5} {'hop':>5} {'snr':>5}"]
+    ordered = sorted(rows.items(), key=lambda item: -item[1][0])
+    for index, ((node, port), (count, hops, snr)) in enumerate(ordered):
+        line = f"{node[:9]:<9} {port[:13]:<13} {count:>5} {hops or '-':>5} {'-' if snr is None else round(snr, 1):>5}"
+        # keep room for the footer and closing code block
+        if sum(len(l) + 1 for l in lines) + len(line) + len(header) + 40 > _MAX_DISCORD_MESSAGE:
+            lines.append(f"... {len(ordered) - index} more")
+            break
+        lines.append(line)
+    total = sum(row[0] for row in rows.values())
+    return f"{header} ({total} total)\n```\n" + "\n".join(lines) + "\n```"
@@ -0,0 +1,129 @@
+import asyncio
+import collections
+import inspect
+import threading
+import traceback
+import plugins.libasync as LibAsync
+import plugins.liblogger as logger
+
+HIGH = 0
+LOW = 1
+DROP_OLDEST = "drop_oldest"
+DROP_NEWEST = "drop_newest"
+
+# text and control traffic is handled ahead of position/telemetry bursts
+_HIGH_PORTNUMS = frozenset(["TEXT_MESSAGE_APP", "ROUTING_APP", "ADMIN_APP", "TRACEROUTE_APP"])
+
+subscribers = []
+
+def lane_for(packet):
+    decoded = packet.get("decoded")
+    if decoded is not None and decoded.get("portnum") in _HIGH_PORTNUMS:
+        return HIGH
+    return LOW
+
+class Subscriber():
+    """One receive hook with its own bounded high and low priority queues and worker.
+    Plain hooks run on a dedicated thread, async def hooks run on the shared asyncio loop.
+    A queue_size of 0 calls the hook directly on the radio thread.
+    """
+
+    def __init__(self, name, callback, queue_size, overflow):
+        if overflow not in (DROP_OLDEST, DROP_NEWEST):
+            raise ValueError(f"unknown overflow policy '{overflow}'")
+        self.name = name
+        self.callback = callback
+        self.queue_size = queue_size
+        self.overflow = overflow
+        self.is_async = inspect.iscoroutinefunction(callback)
+        self.lanes = (collections.deque(), collections.deque())
+        self.dropped = 0
+        self.lock = threading.Lock()
+        self.ready = threading.Condition(self.lock)
+        self.wakeup = None
+
+        if queue_size > 0:
+            if self.is_async:
+                LibAsync.submit(self._run_async())
+            else:
+                threading.Thread(target=self._run, name=f"bus-{name}", daemon=True).start()
+
+    def put(self, event, lane):
+        if self.queue_size <= 0:
+            self._call(event)
+            return
+
+        with self.lock:
+            queue = self.lanes[lane]
+            if len(queue) >= self.queue_size:
+                self.dropped += 1
+                if self.overflow == DROP_NEWEST:
+                    return
+                queue.popleft()
+            queue.append(event)
+            self.ready.notify()
+        if self.wakeup is not None:
+            LibAsync.get_loop().call_soon_threadsafe(self.wakeup.set)
+
+    def depth(self):
+        return len(self.lanes[HIGH]), len(self.lanes[LOW])
+
+    def _take(self):
+        if self.lanes[HIGH]:
+            return self.lanes[HIGH].popleft()
+        if self.lanes[LOW]:
+            return self.lanes[LOW].popleft()
+        return None
+
+    def _call(self, event):
+        try:
+            if self.is_async:
+                LibAsync.submit(self.callback(*event)).result()
+            else:
+                self.callback(*event)
+        except Exception:
+            logger.warn(f"Receive hook {self.name} failed")
+            traceback.print_exc()
+
+    def _run(self):
+        while True:
+            with self.lock:
+                event = self._take()
+                while event is None:
+                    self.ready.wait()
+                    event = self._take()
+            self._call(event)
+
+    async def _run_async(self):
+        self.wakeup = asyncio.Event()
+        while True:
+            self.wakeup.clear()
+            while True:
+                with self.lock:
+                    event = self._take()
+                if event is None:
+                    break
+                try:
+                    await self.callback(*event)
+                except Exception:
+                    logger.warn(f"Receive hook {self.name} failed")
+                    traceback.print_exc()
+            await self.wakeup.wait()
+
+def subscribe(name, callback, queue_size, overflow=DROP_OLDEST):
+    sub = Subscriber(name, callback, queue_size, overflow)
+    subscribers.append(sub)
+    return sub
+
+def publish(packet, interface, client):
+    lane = lane_for(packet)
+    event = (packet, interface, client)
+    for sub in subscribers:
+        sub.put(event, lane)
+
+def stats():
+    result = []
+    for sub in subscribers:
+        high, low = sub.depth()
+        result.append({"name": sub.name, "high": high, "low": low, "dropped": sub.dropped})
+    return result
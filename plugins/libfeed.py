@@ -0,0 +1,135 @@
+import asyncio
+import collections
+import json
+import plugins.liblogger as logger
+import plugins.libasync as LibAsync
+import plugins.libjson as LibJson
+
+DISCONNECT = "disconnect"
+DROP_OLDEST = "drop_oldest"
+ENCRYPTED = "ENCRYPTED"
+
+_subscribers = set()
+_buffer_size = 256
+_overflow = DISCONNECT
+counters = {"published": 0, "sent": 0, "dropped": 0, "disconnected": 0}
+
+class Subscriber():
+    """One websocket client, packets wait in a bounded buffer until its sender task writes them"""
+    __slots__ = ("ws", "portnums", "nodes", "channels", "buffer", "wakeup", "task", "dropped", "closing")
+
+    def __init__(self, ws, portnums, nodes, channels):
+        self.ws = ws
+        self.portnums = portnums
+        self.nodes = nodes
+        self.channels = channels
+        self.buffer = collections.deque()
+        self.wakeup = asyncio.Event()
+        self.task = None
+        self.dropped = 0
+        self.closing = False
+
+    def wants(self, portnum, node, channel):
+        return ((self.portnums is None or portnum in self.portnums)
+                and (self.nodes is None or node in self.nodes)
+                and (self.channels is None or channel in self.channels))
+
+    def kick(self):
+        # the sender may be stuck in a write to a client that stopped reading, stop it and close
+        self.closing = True
+        _subscribers.discard(self)
+        counters["disconnected"] += 1
+        if self.task is not None:
+            self.task.cancel()
+        from aiohttp import WSCloseCode
+        asyncio.ensure_future(self.ws.close(code=WSCloseCode.TRY_AGAIN_LATER, message=b"too slow"))
+
+def configure(buffer_size, overflow=DISCONNECT):
+    global _buffer_size, _overflow
+    _buffer_size = buffer_size
+    _overflow = overflow
+
+def subscribers():
+    return len(_subscribers)
+
+def encode(packet):
+    # payloads are plain base64 strings for feed clients
+    return json.dumps(LibJson.jsonable(packet), separators=(",", ":"), default=str).encode()
+
+def publish(packet):
+    """Serialize the packet once and hand it to every interested subscriber, safe from any thread"""
+    if not _subscribers:
+        return
+    decoded = packet.get("decoded") or {}
+    data = encode(packet)
+    LibAsync.get_loop().call_soon_threadsafe(
+        _fan_out, data, decoded.get("portnum", ENCRYPTED), packet.get("from"), int(packet.get("channel", 0)))
+
+def _fan_out(data, portnum, node, channel):
+    counters["published"] += 1
+    for sub in list(_subscribers):
+        if not sub.wants(portnum, node, channel):
+            continue
+        if len(sub.buffer) >= _buffer_size:
+            if _overflow == DISCONNECT:
+                logger.warn(f"Disconnecting slow feed client, {len(sub.buffer)} packets behind")
+                sub.kick()
+                continue
+            sub.buffer.popleft()
+            sub.dropped += 1
+            counters["dropped"] += 1
+        sub.buffer.append(data)
+        sub.wakeup.set()
+
+async def _sender(sub):
+    from aiohttp import WSMsgType
+    # send_frame writes the shared bytes as they are, send_str would encode them again per client
+    send_frame = getattr(sub.ws, "send_frame", None)
+    try:
+        while not sub.closing:
+            await sub.wakeup.wait()
+            sub.wakeup.clear()
+            while sub.buffer:
+                data = sub.buffer.popleft()
+                if send_frame is not None:
+                    await send_frame(data, WSMsgType.TEXT)
+                else:
+                    await sub.ws.send_str(data.decode())
+                counters["sent"] += 1
+    except (ConnectionError, RuntimeError):
+        # the client went away, the handler cleans up
+        pass
+
+def _parse_list(value, convert):
+    if not value:
+        return None
+    return {convert(item) for item in value.split(",") if item}
+
+def _parse_node(value):
+    if value.startswith("!"):
+        return int(value[1:], 16)
+    return int(value)
+
+async def handle(request):
+    from aiohttp import web
+    try:
+        portnums = _parse_list(request.query.get("portnum"), str.upper)
+        nodes = _parse_list(request.query.get("node"), _parse_node)
+        channels = _parse_list(request.query.get("channel"), int)
+    except ValueError:
+        return web.json_response({"error": "node must be !hex or a number, channel a number"}, status=400)
+
+    ws = web.WebSocketResponse(heartbeat=30)
+    await ws.prepare(request)
+    sub = Subscriber(ws, portnums, nodes, channels)
+    sub.task = asyncio.ensure_future(_sender(sub))
+    _subscribers.add(sub)
+    try:
+        # clients do not send anything, reading only notices when they go away
+        async for _ in ws:
+            pass
+    finally:
+        _subscribers.discard(sub)
+        sub.closing = True
+        sub.task.cancel()
+    return ws
@@ -0,0 +1,212 @@
+import math
+import threading
+import time
+
+ENTERED = "entered"
+LEFT = "left"
+NEAR = "near"
+APART = "apart"
+
+# grid cell size, about 5km north-south
+_CELL_DEG = 0.05
+_M_PER_DEG_LAT = 110540
+_M_PER_DEG_LON = 111320
+
+def _node_num(value):
+    if isinstance(value, str):
+        return int(value.lstrip("!"), 16)
+    return int(value)
+
+def distance_m(lat1, lon1, lat2, lon2):
+    # equirectangular, plenty for fences a few km across
+    x = (lon2 - lon1) * math.cos(math.radians((lat1 + lat2) / 2)) * _M_PER_DEG_LON
+    y = (lat2 - lat1) * _M_PER_DEG_LAT
+    return math.hypot(x, y)
+
+class Fence():
+    __slots__ = ("name", "center", "radius", "polygon", "nodes", "bbox")
+
+    def __init__(self, config, hysteresis):
+        self.name = config["name"]
+        self.nodes = {_node_num(n) for n in config["nodes"]} if config.get("nodes") else None
+        self.center = self.radius = self.polygon = None
+        if "circle" in config:
+            circle = config["circle"]
+            self.center = (float(circle["lat"]), float(circle["lon"]))
+            self.radius = float(circle["radius_m"])
+            pad_lat = (self.radius + hysteresis) / _M_PER_DEG_LAT
+            pad_lon = pad_lat / max(math.cos(math.radians(self.center[0])), 0.01)
+            self.bbox = (self.center[0] - pad_lat, self.center[1] - pad_lon, self.center[0] + pad_lat, self.center[1] + pad_lon)
+        elif "polygon" in config:
+            self.polygon = [(float(lat), float(lon)) for lat, lon in config["polygon"]]
+            if len(self.polygon) < 3:
+                raise ValueError(f"fence {self.name} needs at least 3 points")
+            lats = [p[0] for p in self.polygon]
+            lons = [p[1] for p in self.polygon]
+            pad_lat = hysteresis / _M_PER_DEG_LAT
+            pad_lon = pad_lat / max(math.cos(math.radians(lats[0])), 0.01)
+            self.bbox = (min(lats) - pad_lat, min(lons) - pad_lon, max(lats) + pad_lat, max(lons) + pad_lon)
+        else:
+            raise ValueError(f"fence {self.name} needs a circle or a polygon")
+
+    def outside_by(self, lat, lon):
+        """Metres outside the fence, 0 or less when inside"""
+        if self.center is not None:
+            return distance_m(lat, lon, *self.center) - self.radius
+        if _in_polygon(lat, lon, self.polygon):
+            return 0
+        return _distance_to_edges(lat, lon, self.polygon)
+
+def _in_polygon(lat, lon, polygon):
+    inside = False
+    j = len(polygon) - 1
+    for i in range(len(polygon)):
+        lat_i, lon_i = polygon[i]
+        lat_j, lon_j = polygon[j]
+        if (lat_i > lat) != (lat_j > lat) and lon < (lon_j - lon_i) * (lat - lat_i) / (lat_j - lat_i) + lon_i:
+            inside = not inside
+        j = i
+    return inside
+
+def _distance_to_edges(lat, lon, polygon):
+    scale = math.cos(math.radians(lat)) * _M_PER_DEG_LON
+    best = float("inf")
+    for i in range(len(polygon)):
+        a = polygon[i - 1]
+        b = polygon[i]
+        # segment in metres around the point
+        ax, ay = (a[1] - lon) * scale, (a[0] - lat) * _M_PER_DEG_LAT
+        bx, by = (b[1] - lon) * scale, (b[0] - lat) * _M_PER_DEG_LAT
+        dx, dy = bx - ax, by - ay
+        length = dx * dx + dy * dy
+        t = 0 if length == 0 else max(0, min(1, -(ax * dx + ay * dy) / length))
+        best = min(best, math.hypot(ax + t * dx, ay + t * dy))
+    return best
+
+class _State():
+    """Debounced inside/near flag for one node and one fence or pair"""
+    __slots__ = ("active", "count")
+
+    def __init__(self, active):
+        self.active = active
+        self.count = 0
+
+    def observe(self, active, debounce):
+        if active == self.active:
+            self.count = 0
+            return False
+        self.count += 1
+        if self.count >= debounce:
+            self.active = active
+            self.count = 0
+            return True
+        return False
+
+_lock = threading.Lock()
+_fences = []
+# (cell lat, cell lon) -> fences whose padded bounding box touches the cell
+_grid = {}
+# node num -> [(other num, distance, name)]
+_pairs = {}
+_hysteresis = 25
+_debounce = 2
+_max_age = 1800
+# (node, fence name) -> _State, (a, b) -> _State for proximity pairs
+_fence_states = {}
+_pair_states = {}
+# node num -> (lat, lon, time) of tracked nodes
+_positions = {}
+# nodes with at least one position since start
+_seen = set()
+# node num -> {fence name: fence} the node is inside or about to enter
+_watching = {}
+
+def _cell(lat, lon):
+    return (math.floor(lat / _CELL_DEG), math.floor(lon / _CELL_DEG))
+
+def configure(fences, proximity, hysteresis_m=25, debounce=2, max_age_minutes=30):
+    global _fences, _grid, _pairs, _hysteresis, _debounce, _max_age
+    compiled = [Fence(f, hysteresis_m) for f in fences or []]
+    grid = {}
+    for fence in compiled:
+        south, west = _cell(fence.bbox[0], fence.bbox[1])
+        north, east = _cell(fence.bbox[2], fence.bbox[3])
+        for y in range(south, north + 1):
+            for x in range(west, east + 1):
+                grid.setdefault((y, x), []).append(fence)
+    pairs = {}
+    for rule in proximity or []:
+        nodes = [_node_num(n) for n in rule["nodes"]]
+        for a in nodes:
+            for b in nodes:
+                if a != b:
+                    pairs.setdefault(a, []).append((b, float(rule["distance_m"]), rule.get("name", "")))
+    with _lock:
+        _fences, _grid, _pairs = compiled, grid, pairs
+        _hysteresis, _debounce, _max_age = hysteresis_m, debounce, max_age_minutes * 60
+        _fence_states.clear()
+        _pair_states.clear()
+        _seen.clear()
+        _watching.clear()
+    return len(compiled), len(grid)
+
+def tracked(num):
+    return num in _pairs or any(f.nodes is None or num in f.nodes for f in _fences)
+
+def update(num, lat, lon, now=None):
+    """Feed a position, returns (event, node, fence name or other node, distance) for every
+    debounced change"""
+    now = time.time() if now is None else now
+    events = []
+    with _lock:
+        _positions[num] = (lat, lon, now)
+        first = num not in _seen
+        _seen.add(num)
+        candidates = {f.name: f for f in _grid.get(_cell(lat, lon), ()) if f.nodes is None or num in f.nodes}
+        # fences the node is in must be checked even when it moved out of their cells
+        watching = _watching.setdefault(num, {})
+        for name, fence in watching.items():
+            candidates.setdefault(name, fence)
+        for fence in candidates.values():
+            outside = fence.outside_by(lat, lon)
+            state = _fence_states.get((num, fence.name))
+            if state is None:
+                # a node's first fix sets its state quietly, no alerts for where nodes already are after a restart
+                state = _fence_states[(num, fence.name)] = _State(first and outside <= 0)
+                if first:
+                    if state.active:
+                        watching[fence.name] = fence
+                    continue
+            inside = outside <= 0 if not state.active else outside <= _hysteresis
+            if state.observe(inside, _debounce):
+                events.append((ENTERED if inside else LEFT, num, fence.name, max(outside, 0)))
+            if state.active or state.count:
+                watching[fence.name] = fence
+            else:
+                watching.pop(fence.name, None)
+
+        for other, limit, name in _pairs.get(num, ()):
+            seen = _positions.get(other)
+            if seen is None or now - seen[2] > _max_age:
+                continue
+            distance = distance_m(lat, lon, seen[0], seen[1])
+            key = (min(num, other), max(num, other))
+            state = _pair_states.get(key)
+            if state is None:
+                _pair_states[key] = _State(distance <= limit)
+                continue
+            near = distance <= limit if not state.active else distance <= limit + _hysteresis
+            if state.observe(near, _debounce):
+                events.append((NEAR if near else APART, num, other, distance))
+        # positions of untracked nodes are not needed
+        if num not in _pairs:
+            _positions.pop(num, None)
+    return events
+
+def inside(fence_name):
+    with _lock:
+        return [num for (num, name), state in _fence_states.items() if name == fence_name and state.active]
+
+def fences():
+    with _lock:
+        return list(_fences)
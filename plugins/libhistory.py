@@ -0,0 +1,122 @@
+import queue
+import sqlite3
+import threading
+import time
+import cfg
+import plugins.liblogger as logger
+
+_BATCH_SIZE = 500
+_BATCH_SECONDS = 1.0
+_MAX_QUEUED = 10000
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS messages (
+    id INTEGER PRIMARY KEY,
+    time INTEGER NOT NULL,
+    node INTEGER,
+    name TEXT,
+    channel INTEGER NOT NULL,
+    packet_id INTEGER,
+    text TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS messages_node_time ON messages(node, time);
+CREATE INDEX IF NOT EXISTS messages_channel_time ON messages(channel, time);
+CREATE VIRTUAL TABLE IF NOT EXISTS messages_fts USING fts5(text, content='messages', content_rowid='id');
+CREATE TRIGGER IF NOT EXISTS messages_ai AFTER INSERT ON messages BEGIN
+    INSERT INTO messages_fts(rowid, text) VALUES (new.id, new.text);
+END;
+"""
+
+_queue = queue.Queue(_MAX_QUEUED)
+_local = threading.local()
+_path = None
+
+def start(path):
+    global _path
+    _path = path
+    conn = _connect()
+    conn.executescript(_SCHEMA)
+    threading.Thread(target=_writer, args=(conn,), name="history-writer", daemon=True).start()
+
+def _connect():
+    conn = sqlite3.connect(_path, check_same_thread=False)
+    conn.execute("PRAGMA journal_mode=WAL")
+    conn.execute("PRAGMA synchronous=NORMAL")
+    return conn
+
+def record(packet, name):
+    if _path is None:
+        return
+    row = (int(packet.get("rxTime") or time.time()), packet.get("from"), name,
+           int(packet.get("channel", 0)), packet.get("id"), packet["decoded"]["text"])
+    try:
+        _queue.put_nowait(row)
+    except queue.Full:
+        logger.warn("History writer is behind, dropping message")
+
+def queued():
+    return _queue.qsize()
+
+def _writer(conn):
+    while True:
+        batch = [_queue.get()]
+        deadline = time.monotonic() + _BATCH_SECONDS
+        while len(batch) < _BATCH_SIZE:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                break
+            try:
+                batch.append(_queue.get(timeout=remaining))
+            except queue.Empty:
+                break
+        try:
+            with conn:
+                conn.executemany(
+                    "INSERT INTO messages(time, node, name, channel, packet_id, text) VALUES (?, ?, ?, ?, ?, ?)", batch
+                )
+        except sqlite3.Error as e:
+            logger.warn(f"Failed to write {len(batch)} messages to history: {e}")
+
+def _reader():
+    conn = getattr(_local, "conn", None)
+    if conn is None:
+        conn = _local.conn = _connect()
+    return conn
+
+def _match_expression(terms):
+    # quote every word so user input can not break the fts query syntax, word* stays a prefix search
+    words = []
+    for word in terms.split():
+        prefix = word.endswith("*") and len(word) > 1
+        word = word.rstrip("*").replace('"', '""')
+        if word:
+            words.append(f'"{word}"' + ("*" if prefix else ""))
+    return " ".join(words)
+
+def search(terms, node=None, channel=None, since=None, limit=10, offset=0):
+    """Newest first list of (time, node, name, channel, text) matching all words in terms"""
+    if _path is None:
+        return []
+    expression = _match_expression(terms)
+    if not expression:
+        return []
+
+    sql = ("SELECT m.time, m.node, m.name, m.channel, m.text FROM messages_fts f "
+           "JOIN messages m ON m.id = f.rowid WHERE messages_fts MATCH ?")
+    params = [expression]
+    if node is not None:
+        sql += " AND m.node = ?"
+        params.append(node)
+    if channel is not None:
+        sql += " AND m.channel = ?"
+        params.append(channel)
+    if since is not None:
+        sql += " AND m.time >= ?"
+        params.append(int(since))
+    sql += " ORDER BY f.rowid DESC LIMIT ? OFFSET ?"
+    params += [limit, offset]
+    try:
+        return _reader().execute(sql, params).fetchall()
+    except sqlite3.Error as e:
+        logger.warn(f"History search failed: {e}")
+        return []
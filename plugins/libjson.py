@@ -0,0 +1,15 @@
+import base64
+
+def b64(data):
+    return base64.b64encode(data).decode()
+
+def jsonable(value, convert_bytes=b64):
+    """Copy of a meshtastic packet or node dict that json can encode, the protobuf objects
+    meshtastic keeps under "raw" are dropped and bytes go through convert_bytes"""
+    if isinstance(value, dict):
+        return {k: jsonable(v, convert_bytes) for k, v in value.items() if k != "raw"}
+    if isinstance(value, (list, tuple)):
+        return [jsonable(v, convert_bytes) for v in value]
+    if isinstance(value, bytes):
+        return convert_bytes(value)
+    return value
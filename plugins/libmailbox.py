@@ -0,0 +1,135 @@
+import json
+import os
+import queue
+import threading
+import time
+import cfg
+import plugins.liblogger as logger
+import plugins.liback as LibAck
+import plugins.libcompress as LibCompress
+
+# destination node num -> list of {"from", "text", "time"}
+_mail = {}
+# nums with waiting mail, checked for every received packet
+_pending = set()
+# id() of messages handed to the delivery thread, they stay in _mail and on disk until acked
+_sending = set()
+_lock = threading.Lock()
+_deliveries = queue.Queue()
+_worker = None
+
+def load():
+    path = cfg.config["mailbox_file"]
+    if not os.path.exists(path):
+        return
+    try:
+        with open(path, 'r', encoding='utf-8') as f:
+            stored = json.load(f)
+    except (OSError, ValueError) as e:
+        logger.warn(f"Could not read mailbox {path}: {e}")
+        return
+    with _lock:
+        for num, messages in stored.items():
+            _mail[int(num)] = messages
+        _expire(time.time())
+    logger.info(f"Loaded {sum(len(m) for m in _mail.values())} waiting mail")
+
+def _save():
+    path = cfg.config["mailbox_file"]
+    tmp = path + ".tmp"
+    with open(tmp, 'w', encoding='utf-8') as f:
+        json.dump({str(num): messages for num, messages in _mail.items()}, f)
+    os.replace(tmp, path)
+
+def _expire(now):
+    max_age = cfg.config["mailbox_expiry_hours"] * 3600
+    for num in list(_mail):
+        _mail[num] = [m for m in _mail[num] if now - m["time"] <= max_age]
+        if not _mail[num]:
+            del _mail[num]
+    _pending.clear()
+    _pending.update(_mail)
+
+def has_mail(num):
+    return num in _pending
+
+def count(num):
+    with _lock:
+        return len(_mail.get(num, ()))
+
+def store(num, sender, text):
+    """Returns the number of waiting messages for num, or None when its quota is full"""
+    now = time.time()
+    with _lock:
+        _expire(now)
+        messages = _mail.setdefault(num, [])
+        if len(messages) >= cfg.config["mailbox_max_per_node"]:
+            if not messages:
+                del _mail[num]
+            return None
+        messages.append({"from": sender, "text": text, "time": int(now)})
+        _pending.add(num)
+        _save()
+        return len(messages)
+
+def deliver(num, interface):
+    with _lock:
+        # expiry otherwise only runs when mail is stored, old mail must not go out late
+        _expire(time.time())
+        _pending.discard(num)
+        messages = [m for m in _mail.get(num, ()) if id(m) not in _sending]
+        _sending.update(id(m) for m in messages)
+    if not messages:
+        return
+    _start_worker()
+    for message in messages:
+        _deliveries.put((num, message, interface))
+
+def _start_worker():
+    global _worker
+    with _lock:
+        if _worker is None:
+            _worker = threading.Thread(target=_deliver_loop, name="mailbox", daemon=True)
+            _worker.start()
+
+def _deliver_loop():
+    while True:
+        num, message, interface = _deliveries.get()
+        age = int((time.time() - message["time"]) // 60)
+        text = f"Mail from {message['from']} ({age}m ago): {message['text']}"
+        text = text[:cfg.config["max_message_length"]]
+        try:
+            if LibAck.running():
+                LibAck.send(interface, text, num, cfg.config["send_channel_index"],
+                            lambda state, num=num, message=message: _on_state(num, message, state))
+            else:
+                # without the acks plugin there is nothing to confirm delivery with
+                LibCompress.send_text(interface, text, destinationId=num, channelIndex=cfg.config["send_channel_index"])
+                _finish(num, message, True)
+        except Exception as e:
+            logger.warn(f"Mail delivery to !{num:08x} failed: {e}")
+            _finish(num, message, False)
+        # pace deliveries so a full mailbox does not flood the channel
+        time.sleep(cfg.config["mailbox_pace"])
+
+def _on_state(num, message, state):
+    if state != LibAck.PENDING:
+        _finish(num, message, state == LibAck.ACKED)
+
+def _finish(num, message, delivered):
+    with _lock:
+        _sending.discard(id(message))
+        if delivered:
+            messages = [m for m in _mail.get(num, ()) if m is not message]
+            if messages:
+                _mail[num] = messages
+            else:
+                _mail.pop(num, None)
+            _save()
+        elif num in _mail:
+            # tried again the next time the node is heard
+            _pending.add(num)
+    if delivered:
+        logger.infogreen(f"Delivered mail to !{num:08x}")
+    else:
+        logger.warn(f"Mail to !{num:08x} was not acked, it is kept for the next time the node is heard")
@@ -2,13 +2,17 @@ import base64
 import cfg
 import time
 from meshtastic.protobuf import mesh_pb2
-from meshtastic import BROADCAST_ADDR
+from meshtastic import BROADCAST_ADDR, BROADCAST_NUM
+import plugins.libnodes as LibNodes
+import plugins.liback as LibAck
+import plugins.libcompress as LibCompress
+import plugins.libspool as LibSpool
 
 def getUserLong(interface,packet):
     ret=None
-    node = getNode(interface,packet)
-    if(node and "user" in node):
-        ret = str(node["user"]["longName"])
+    node = LibNodes.lookup(interface, packet.get("from"))
+    if(node and node.long_name is not None):
+        ret = str(node.long_name)
         return ret
 
     ret = decimal_to_hex(packet["from"])
@@ -16,17 +20,31 @@ def getUserLong(interface,packet):
 
 def getUserShort(interface,packet):
     ret=None
-    node = getNode(interface,packet)
-    if(node and "user" in node):
-        ret = str(node["user"]["shortName"])
+    node = LibNodes.lookup(interface, packet.get("from"))
+    if(node and node.short_name is not None):
+        ret = str(node.short_name)
     return ret
 
 def getNode(interface,packet):
     ret = None
-    if(packet["fromId"] in interface.nodes):
-        ret = interface.nodes[packet["fromId"]]
+    if(interface.nodes):
+        ret = interface.nodes.get(packet["fromId"])
     return ret
 
+def findNode(interface, query):
+    # node num from a !hex id, short name or long name
+    query = query.strip()
+    if query.startswith("!"):
+        try:
+            return int(query[1:], 16)
+        except ValueError:
+            return None
+    lowered = query.lower()
+    for node in LibNodes.all_nodes():
+        if lowered in ((node.short_name or "").lower(), (node.long_name or "").lower()):
+            return node.num
+    return None
+
 def decimal_to_hex(decimal_number):
     return f"!{decimal_number:08x}"
 
@@ -81,85 +99,47 @@ def _coerce_macaddr(value):
     return None
 
 def getNodeInfoUrl(interface, packet):
-    node = getNode(interface, packet)
-    if not isinstance(node, dict):
-        return None
-
-    node_data = {}
-    if "num" in node and node["num"] is not None:
-        node_num = node["num"]
-        if isinstance(node_num, str):
-            try:
-                node_num = int(node_num, 0)
-            except ValueError:
-                node_num = None
-        if node_num is not None:
-            node_data["num"] = int(node_num)
-
-    user_data = {}
-    user = node.get("user")
-    if isinstance(user, dict):
-        if user.get("id"):
-            user_data["id"] = str(user["id"])
-        if user.get("longName"):
-            user_data["long_name"] = str(user["longName"])
-        if user.get("shortName"):
-            user_data["short_name"] = str(user["shortName"])
-        if user.get("hwModel") is not None:
-            user_data["hw_model"] = user["hwModel"]
-        if user.get("macaddr"):
-            user_data["macaddr"] = user["macaddr"]
-        if user.get("macAddr"):
-            user_data["macaddr"] = user["macAddr"]
-        if user.get("isLicensed") is not None:
-            user_data["is_licensed"] = user["isLicensed"]
-        if user.get("role") is not None:
-            user_data["role"] = user["role"]
-        if user.get("publicKey"):
-            user_data["public_key"] = user["publicKey"]
-        if user.get("isUnmessagable") is not None:
-            user_data["is_unmessagable"] = user["isUnmessagable"]
-    if user_data:
-        node_data["user"] = user_data
-
-    if not node_data:
+    node = LibNodes.lookup(interface, packet.get("from"))
+    if node is None:
         return None
+    if node.url is None:
+        node.url = _buildNodeInfoUrl(node) or ""
+    return node.url or None
 
+def _buildNodeInfoUrl(node):
     node_info = mesh_pb2.NodeInfo()
     has_data = False
 
-    if "num" in node_data:
-        _set_proto_field(node_info, "num", node_data["num"])
+    if node.num is not None:
+        _set_proto_field(node_info, "num", int(node.num))
         has_data = True
 
-    if "user" in node_data:
-        user = mesh_pb2.User()
-        user_fields = node_data["user"]
-        if "id" in user_fields:
-            _set_proto_field(user, "id", user_fields["id"])
-        if "long_name" in user_fields:
-            _set_proto_field(user, "long_name", user_fields["long_name"])
-        if "short_name" in user_fields:
-            _set_proto_field(user, "short_name", user_fields["short_name"])
-        if "hw_model" in user_fields:
-            _set_proto_enum(user, "hw_model", user_fields["hw_model"])
-        if "macaddr" in user_fields:
-            macaddr_value = _coerce_macaddr(user_fields["macaddr"])
-            if macaddr_value:
-                _set_proto_field(user, "macaddr", macaddr_value)
-        if "is_licensed" in user_fields:
-            _set_proto_field(user, "is_licensed", user_fields["is_licensed"])
-        if "role" in user_fields:
-            _set_proto_enum(user, "role", user_fields["role"])
-        if "public_key" in user_fields:
-            public_key_value = _coerce_bytes(user_fields["public_key"])
-            if public_key_value:
-                _set_proto_field(user, "public_key", public_key_value)
-        if "is_unmessagable" in user_fields:
-            _set_proto_field(user, "is_unmessagable", user_fields["is_unmessagable"])
-        if user.ListFields():
-            node_info.user.CopyFrom(user)
-            has_data = True
+    user = mesh_pb2.User()
+    if node.id:
+        _set_proto_field(user, "id", str(node.id))
+    if node.long_name:
+        _set_proto_field(user, "long_name", str(node.long_name))
+    if node.short_name:
+        _set_proto_field(user, "short_name", str(node.short_name))
+    if node.hw_model is not None:
+        _set_proto_enum(user, "hw_model", node.hw_model)
+    if node.macaddr:
+        macaddr_value = _coerce_macaddr(node.macaddr)
+        if macaddr_value:
+            _set_proto_field(user, "macaddr", macaddr_value)
+    if node.is_licensed is not None:
+        _set_proto_field(user, "is_licensed", node.is_licensed)
+    if node.role is not None:
+        _set_proto_enum(user, "role", node.role)
+    if node.public_key:
+        public_key_value = _coerce_bytes(node.public_key)
+        if public_key_value:
+            _set_proto_field(user, "public_key", public_key_value)
+    if node.is_unmessagable is not None:
+        _set_proto_field(user, "is_unmessagable", node.is_unmessagable)
+    if user.ListFields():
+        node_info.user.CopyFrom(user)
+        has_data = True
 
     if not has_data:
         return None
@@ -172,17 +152,33 @@ def getPosition(interface,packet):
     long = None
     hasPos = False
     
-    node = getNode(interface,packet)
-    if(packet["fromId"] in interface.nodes):
-        if("position" in node):
-                if("latitude" in node["position"] and "longitude" in node["position"]):
-                    lat = node["position"]["latitude"]
-                    long = node["position"]["longitude"]
-                    hasPos = True
+    node = LibNodes.lookup(interface, packet.get("from"))
+    if(node and node.latitude is not None and node.longitude is not None):
+        lat = node.latitude
+        long = node.longitude
+        hasPos = True
                      
     return lat, long, hasPos
 
 
+def getChannelUtilization(interface):
+    info = interface.getMyNodeInfo()
+    if info and "deviceMetrics" in info:
+        return info["deviceMetrics"].get("channelUtilization")
+    return None
+
+
+def localPacket(interface, channel_index=0, text=""):
+    # packet with no sender, used when running commands on a schedule
+    return {
+        "from": int(interface.localNode.nodeNum),
+        "fromId": None,
+        "to": BROADCAST_NUM,
+        "channel": channel_index,
+        "decoded": {"portnum": "TEXT_MESSAGE_APP", "text": text}
+    }
+
+
 def resolve_send_channel_index(incoming_ch):
     incoming_ch = int(incoming_ch or 0)
     cfg_ch = int(cfg.config.get("send_channel_index", 0))
@@ -191,21 +187,45 @@ def resolve_send_channel_index(incoming_ch):
     return incoming_ch
 
 
+def getReplyDestination(interface, packet):
+    # reply direct if addressed to us, otherwise broadcast
+    if int(packet.get("to", BROADCAST_NUM)) == int(interface.localNode.nodeNum):
+        return packet.get("from", BROADCAST_ADDR)
+    return BROADCAST_ADDR
+
+
 def sendReply(text, interface, packet):
     # Incoming channel (default to 0 if missing)
     incoming_ch = int(packet.get("channel", 0))
     out_ch = resolve_send_channel_index(incoming_ch)
 
-    # Destination: reply direct if addressed to us, otherwise broadcast
-    to = BROADCAST_ADDR
-    if int(packet.get("to", BROADCAST_ADDR)) == int(interface.localNode.nodeNum):
-        to = packet.get("from", BROADCAST_ADDR)
+    to = getReplyDestination(interface, packet)
 
-    time.sleep(0.5)
-    interface.sendText(
-        text=text,
-        destinationId=to,
-        channelIndex=out_ch
-    )
+    spoolText(interface, text, to, out_ch, reply=True)
 
     return packet
+
+
+def spoolText(interface, text, destination=BROADCAST_ADDR, channel=0, reply=False):
+    # journaled first so it still goes out after a crash or restart
+    payload = {"text": text, "to": destination, "channel": channel}
+    if reply:
+        payload["reply"] = True
+    if LibSpool.running():
+        LibSpool.put("mesh", payload)
+    else:
+        # worker processes and tools have no spool
+        sendSpooled(interface, payload)
+
+
+def sendSpooled(interface, payload, on_state=None):
+    # sender for spooled mesh messages
+    if payload.get("reply"):
+        # give the radio a moment after the command it answers
+        time.sleep(0.5)
+    to = payload.get("to", BROADCAST_ADDR)
+    if on_state is not None or to not in (BROADCAST_ADDR, BROADCAST_NUM):
+        # direct messages ask for an ack and are retried until the node confirms
+        LibAck.send(interface, payload["text"], to, payload["channel"], on_state)
+    else:
+        LibCompress.send_text(interface, payload["text"], destinationId=to, channelIndex=payload["channel"])
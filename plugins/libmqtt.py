@@ -0,0 +1,179 @@
+import asyncio
+import base64
+import collections
+from pubsub import pub
+from meshtastic.mesh_interface import MeshInterface
+from meshtastic.protobuf import mesh_pb2, mqtt_pb2
+from meshtastic import publishingThread
+import plugins.liblogger as logger
+import plugins.libasync as LibAsync
+
+# the well known key the firmware uses for channels with a one byte psk
+DEFAULT_KEY = bytes.fromhex("d4f1bb3a20290759f0bcffabcf4e6901")
+_BATCH = 500
+# (from, id) pairs remembered to drop copies uplinked by other gateways
+_SEEN_PACKETS = 20000
+
+def expand_key(key):
+    """Channel psk from its base64 config form, None for an unencrypted channel"""
+    raw = base64.b64decode(key)
+    if len(raw) == 0 or raw == b"\x00":
+        return None
+    if len(raw) == 1:
+        return DEFAULT_KEY[:-1] + bytes([(DEFAULT_KEY[-1] + raw[0] - 1) & 0xff])
+    return raw
+
+def crypt(key, packet_id, from_num, data):
+    """AES-CTR as the firmware does it, the same call encrypts and decrypts"""
+    from cryptography.hazmat.primitives.ciphers import Cipher, algorithms, modes
+    nonce = packet_id.to_bytes(8, "little") + from_num.to_bytes(4, "little") + bytes(4)
+    cipher = Cipher(algorithms.AES(key), modes.CTR(nonce)).decryptor()
+    return cipher.update(data) + cipher.finalize()
+
+class MQTTInterface(MeshInterface):
+    """Receives packets from a Meshtastic MQTT broker instead of a radio. Envelopes are
+    queued by the paho thread and decoded in batches on the shared asyncio loop, then go
+    through the same packet handling as the serial and tcp interfaces so plugins get the
+    same packet dicts. Sending is not supported."""
+
+    def __init__(self, config):
+        super().__init__(noProto=True)
+        import paho.mqtt.client as mqtt
+
+        self.config = config
+        self.channels = {}
+        for index, channel in enumerate(config["mqtt_channels"]):
+            self.channels[channel["name"]] = (index, expand_key(str(channel.get("key", "AQ=="))))
+
+        node_id = config["mqtt_node_id"] or "!00000000"
+        num = int(node_id.lstrip("!"), 16)
+        self.myInfo = mesh_pb2.MyNodeInfo(my_node_num=num)
+        self.localNode.nodeNum = num
+        self.nodes = {}
+        self.nodesByNum = {}
+        local = self._getOrCreateByNum(num)
+        local["user"] = {"id": node_id, "longName": "MeshLink MQTT", "shortName": "MLQ"}
+        self.nodes[node_id] = local
+
+        self.stats = collections.Counter()
+        self._seen = collections.OrderedDict()
+        self._inbox = collections.deque()
+        self._loop = LibAsync.get_loop()
+        self._wake = asyncio.Event()
+        self._announced = False
+        self._warned_send = False
+        LibAsync.submit(self._consume())
+
+        try:
+            self.client = mqtt.Client(mqtt.CallbackAPIVersion.VERSION2)
+        except AttributeError:
+            # paho 1.x
+            self.client = mqtt.Client()
+        if config["mqtt_username"]:
+            self.client.username_pw_set(config["mqtt_username"], config["mqtt_password"])
+        self.client.on_connect = self._on_connect
+        self.client.on_disconnect = self._on_disconnect
+        self.client.on_message = self._on_message
+        self.client.reconnect_delay_set(1, 60)
+        logger.info(f"Connecting to MQTT broker {config['mqtt_host']}:{config['mqtt_port']}")
+        self.client.connect_async(config["mqtt_host"], config["mqtt_port"], keepalive=60)
+        self.client.loop_start()
+
+    def _on_connect(self, client, userdata, flags, reason, *properties):
+        if reason != 0:
+            logger.warn(f"MQTT connection refused: {reason}")
+            return
+        for topic in self.config["mqtt_topics"]:
+            client.subscribe(topic)
+        logger.infogreen("Subscribed to " + ", ".join(self.config["mqtt_topics"]))
+        if not self._announced:
+            self._announced = True
+            self.isConnected.set()
+            publishingThread.queueWork(
+                lambda: pub.sendMessage("meshtastic.connection.established", interface=self))
+
+    def _on_disconnect(self, client, userdata, *args):
+        # paho reconnects by itself, the rest of MeshLink keeps this interface
+        logger.warn("Lost the MQTT broker, reconnecting")
+
+    def _on_message(self, client, userdata, msg):
+        self._inbox.append((msg.topic, msg.payload))
+        # one wakeup per batch, not per message
+        if len(self._inbox) == 1:
+            self._loop.call_soon_threadsafe(self._wake.set)
+
+    async def _consume(self):
+        while True:
+            await self._wake.wait()
+            self._wake.clear()
+            while self._inbox:
+                for _ in range(min(_BATCH, len(self._inbox))):
+                    topic, payload = self._inbox.popleft()
+                    try:
+                        self._handle_envelope(topic, payload)
+                    except Exception as e:
+                        self.stats["errors"] += 1
+                        logger.warn(f"Bad MQTT packet on {topic}: {e}")
+                # let the rest of the loop run between batches
+                await asyncio.sleep(0)
+
+    def _handle_envelope(self, topic, payload):
+        self.stats["received"] += 1
+        # protobuf envelopes live under /2/e/, skip json and map reports
+        if "/2/e/" not in topic and "/2/c/" not in topic:
+            self.stats["skipped"] += 1
+            return
+        envelope = mqtt_pb2.ServiceEnvelope()
+        envelope.ParseFromString(payload)
+        packet = envelope.packet
+        sender = getattr(packet, "from")
+
+        key = (sender, packet.id)
+        if key in self._seen:
+            self.stats["duplicates"] += 1
+            return
+        self._seen[key] = True
+        if len(self._seen) > _SEEN_PACKETS:
+            self._seen.popitem(last=False)
+
+        channel = self.channels.get(envelope.channel_id)
+        if channel is None:
+            self.stats["skipped"] += 1
+            return
+        index, psk = channel
+
+        if packet.HasField("encrypted"):
+            if psk is None:
+                self.stats["undecryptable"] += 1
+                return
+            data = mesh_pb2.Data()
+            try:
+                data.ParseFromString(crypt(psk, packet.id, sender, packet.encrypted))
+            except Exception:
+                self.stats["undecryptable"] += 1
+                return
+            if data.portnum == 0:
+                # parsed but garbage, wrong key
+                self.stats["undecryptable"] += 1
+                return
+            packet.decoded.CopyFrom(data)
+
+        packet.channel = index
+        packet.via_mqtt = True
+        # gives the packet a fromId even before the node sent its nodeinfo
+        self._getOrCreateByNum(sender)
+        self.stats["decoded"] += 1
+        self._handlePacketFromRadio(packet)
+
+    def getMyNodeInfo(self):
+        return self.nodesByNum.get(self.myInfo.my_node_num)
+
+    def sendData(self, *args, **kwargs):
+        if not self._warned_send:
+            self._warned_send = True
+            logger.warn("MQTT ingest is receive only, replies are not sent")
+        return None
+
+    def close(self):
+        self.client.loop_stop()
+        self.client.disconnect()
@@ -0,0 +1,204 @@
+import collections
+import threading
+import time
+import cfg
+
+_USER_FIELDS = {
+    "id": "id",
+    "longName": "long_name",
+    "shortName": "short_name",
+    "hwModel": "hw_model",
+    "role": "role",
+    "macaddr": "macaddr",
+    "macAddr": "macaddr",
+    "publicKey": "public_key",
+    "isLicensed": "is_licensed",
+    "isUnmessagable": "is_unmessagable",
+}
+_METRIC_FIELDS = {
+    "batteryLevel": "battery_level",
+    "voltage": "voltage",
+    "channelUtilization": "channel_utilization",
+    "airUtilTx": "air_util_tx",
+}
+
+class NodeRecord():
+    __slots__ = ("num", "id", "long_name", "short_name", "hw_model", "role", "macaddr", "public_key",
+                 "is_licensed", "is_unmessagable", "latitude", "longitude", "altitude", "last_heard",
+                 "snr", "hops", "battery_level", "voltage", "channel_utilization", "air_util_tx", "url")
+
+    def __init__(self, num):
+        for name in self.__slots__:
+            setattr(self, name, None)
+        self.num = num
+
+    # the update methods return whether anything changed
+
+    def update_user(self, user):
+        changed = False
+        for key, attr in _USER_FIELDS.items():
+            if key in user and getattr(self, attr) != user[key]:
+                setattr(self, attr, user[key])
+                changed = True
+        if changed:
+            # the nodeinfo url is rebuilt on next use
+            self.url = None
+        return changed
+
+    def update_position(self, position):
+        if "latitude" not in position or "longitude" not in position:
+            return False
+        new = (position["latitude"], position["longitude"], position.get("altitude"))
+        if new == (self.latitude, self.longitude, self.altitude):
+            return False
+        self.latitude, self.longitude, self.altitude = new
+        return True
+
+    def update_metrics(self, metrics):
+        changed = False
+        for key, attr in _METRIC_FIELDS.items():
+            if key in metrics and getattr(self, attr) != metrics[key]:
+                setattr(self, attr, metrics[key])
+                changed = True
+        return changed
+
+class _TrimmedDict(dict):
+    """Stands in for meshtastic's nodes and nodesByNum. Only the interface's reader thread adds
+    to them, and it trims here too, so an entry never vanishes between its own check and read.
+    Past twice the table size, entries for nodes we no longer keep are dropped"""
+
+    def __setitem__(self, key, value):
+        if key not in self and len(self) >= 2 * cfg.config["node_table_max_nodes"]:
+            for k, v in list(self.items()):
+                num = v.get("num") if isinstance(v, dict) else None
+                if num not in _nodes and num != _local_num:
+                    dict.__delitem__(self, k)
+        dict.__setitem__(self, key, value)
+
+# num -> NodeRecord, least recently heard first
+_nodes = collections.OrderedDict()
+_lock = threading.Lock()
+_local_num = None
+# bumped when a user, position or metrics field changes, positions only for positions,
+# last heard, snr and hops change with every packet and do not count
+versions = {"nodes": 0, "positions": 0}
+
+def _changed(user=False, position=False, metrics=False):
+    if user or position or metrics:
+        versions["nodes"] += 1
+    if position:
+        versions["positions"] += 1
+
+def get(num):
+    return _nodes.get(num)
+
+def all_nodes():
+    with _lock:
+        return list(_nodes.values())
+
+def lookup(interface, num):
+    node = _nodes.get(num)
+    if node is None and num is not None:
+        # a node we evicted, or one only meshtastic still knows. It gets a record that is not
+        # added to the table, the next update() would only evict it again
+        data = interface.nodesByNum.get(num) if getattr(interface, "nodesByNum", None) else None
+        if data is None:
+            data = interface.nodes.get(f"!{num:08x}") if interface.nodes else None
+        if data is not None:
+            node = NodeRecord(num)
+            _fill(node, data)
+    return node
+
+def _fill(node, data):
+    user = "user" in data and node.update_user(data["user"])
+    position = "position" in data and node.update_position(data["position"])
+    metrics = "deviceMetrics" in data and node.update_metrics(data["deviceMetrics"])
+    node.last_heard = data.get("lastHeard", node.last_heard)
+    node.snr = data.get("snr", node.snr)
+    node.hops = data.get("hopsAway", node.hops)
+    return user, position, metrics
+
+def load(num, data):
+    """Add or refresh a node from a meshtastic node dict, new nodes go in as least recently heard.
+    A node not in the table that is already too old to keep is not added"""
+    with _lock:
+        node = _nodes.get(num)
+        new = node is None
+        if new:
+            heard = data.get("lastHeard")
+            if heard is not None and time.time() - heard > cfg.config["node_table_max_age_hours"] * 3600:
+                return None
+            node = NodeRecord(num)
+            _nodes[num] = node
+            _nodes.move_to_end(num, last=False)
+        user, position, metrics = _fill(node, data)
+        _changed(new or user, position, metrics)
+    return node
+
+def seed(interface):
+    global _local_num
+    _local_num = int(interface.localNode.nodeNum)
+    for name in ("nodes", "nodesByNum"):
+        table = getattr(interface, name, None)
+        if table is not None and not isinstance(table, _TrimmedDict):
+            setattr(interface, name, _TrimmedDict(table))
+    # newest first, load puts every new node in front of the ones before it. Nodes past the
+    # table size would only be evicted again, seeding again then leaves the versions alone
+    known = sorted(list((interface.nodes or {}).values()), key=lambda n: n.get("lastHeard") or 0, reverse=True)
+    known = known[:cfg.config["node_table_max_nodes"]]
+    for data in known:
+        if data.get("num") is not None:
+            load(int(data["num"]), data)
+    _evict(time.time())
+
+def update(packet, interface):
+    num = packet.get("from")
+    if num is None:
+        return
+    now = time.time()
+    with _lock:
+        node = _nodes.get(num)
+        new = node is None
+        if new:
+            node = NodeRecord(num)
+            _nodes[num] = node
+        else:
+            _nodes.move_to_end(num)
+        node.last_heard = packet.get("rxTime") or int(now)
+        if "rxSnr" in packet:
+            node.snr = packet["rxSnr"]
+        if "hopStart" in packet and "hopLimit" in packet:
+            node.hops = packet["hopStart"] - packet["hopLimit"]
+
+        user = position = metrics = False
+        decoded = packet.get("decoded")
+        if decoded is not None:
+            portnum = decoded.get("portnum")
+            if portnum == "NODEINFO_APP" and "user" in decoded:
+                user = node.update_user(decoded["user"])
+            elif portnum == "POSITION_APP" and "position" in decoded:
+                position = node.update_position(decoded["position"])
+            elif portnum == "TELEMETRY_APP" and "deviceMetrics" in decoded.get("telemetry", {}):
+                metrics = node.update_metrics(decoded["telemetry"]["deviceMetrics"])
+        _changed(new or user, position, metrics)
+        needs_eviction = len(_nodes) > cfg.config["node_table_max_nodes"] or _is_stale(next(iter(_nodes.values())), now)
+
+    if needs_eviction:
+        _evict(now)
+
+def _is_stale(node, now):
+    return node.last_heard is not None and now - node.last_heard > cfg.config["node_table_max_age_hours"] * 3600
+
+def _evict(now):
+    max_nodes = cfg.config["node_table_max_nodes"]
+    with _lock:
+        # oldest entries are at the front, stop at the first fresh one
+        for num, node in list(_nodes.items()):
+            if len(_nodes) <= max_nodes and not _is_stale(node, now):
+                break
+            if num == _local_num:
+                _nodes.move_to_end(num)
+                continue
+            del _nodes[num]
+            # gone from both snapshots
+            _changed(True, node.latitude is not None)
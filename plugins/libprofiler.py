@@ -0,0 +1,101 @@
+import collections
+import os
+import sys
+import threading
+import time
+import plugins.liblogger as logger
+
+# code object -> "module:function", computed once per code object
+_labels = {}
+_running = threading.Lock()
+
+def _label(code):
+    label = _labels.get(code)
+    if label is None:
+        module = os.path.splitext(os.path.basename(code.co_filename))[0]
+        label = _labels[code] = module + ":" + code.co_name
+    return label
+
+def _stack(frame):
+    stack = []
+    while frame is not None:
+        stack.append(_label(frame.f_code))
+        frame = frame.f_back
+    stack.reverse()
+    return tuple(stack)
+
+# functions called with (seconds, interval) when a profile starts, each returns a function
+# that waits for and returns the samples it collected, worker pools add themselves here
+_sources = []
+
+def add_source(source):
+    _sources.append(source)
+
+def running():
+    return _running.locked()
+
+def start(seconds, on_done, interval=0.01, directory="profiles"):
+    """Sample every thread's stack for seconds, then call on_done(summary, paths).
+    When the profile fails on_done gets the error and no paths.
+    Returns False when a profile is already running."""
+    if not _running.acquire(blocking=False):
+        return False
+    threading.Thread(target=_run, args=(seconds, interval, directory, on_done), name="meshlink-profiler", daemon=True).start()
+    return True
+
+def sample(seconds, interval=0.01):
+    """Counter of (thread name, stack) -> samples, with the number of samples taken and the elapsed time"""
+    samples = collections.Counter()
+    me = threading.get_ident()
+    started = time.monotonic()
+    deadline = started + seconds
+    taken = 0
+    while time.monotonic() < deadline:
+        names = {t.ident: t.name for t in threading.enumerate()}
+        for ident, frame in sys._current_frames().items():
+            if ident != me:
+                samples[(names.get(ident, f"thread-{ident}"), _stack(frame))] += 1
+        del frame
+        taken += 1
+        time.sleep(interval)
+    return samples, taken, time.monotonic() - started
+
+def _run(seconds, interval, directory, on_done):
+    try:
+        collectors = [source(seconds, interval) for source in _sources]
+        samples, taken, elapsed = sample(seconds, interval)
+        for collect in collectors:
+            samples.update(collect())
+        summary = summarize(samples, taken, elapsed)
+        paths = _write(samples, summary, directory)
+    except Exception as e:
+        logger.warn(f"Profile failed: {e}")
+        summary, paths = f"Profile failed: {e}", []
+    finally:
+        _running.release()
+    on_done(summary, paths)
+
+def collapsed(samples):
+    """flamegraph.pl / speedscope folded format, one line per distinct stack"""
+    return "\n".join(f"{thread};{';'.join(stack)} {count}" for (thread, stack), count in samples.most_common())
+
+def summarize(samples, taken, elapsed, top=5):
+    threads = collections.defaultdict(collections.Counter)
+    for (thread, stack), count in samples.items():
+        threads[thread][stack[-1] if stack else "?"] += count
+    lines = [f"{taken} samples over {elapsed:.1f}s, {len(threads)} threads"]
+    for thread, leaves in sorted(threads.items(), key=lambda t: -sum(t[1].values())):
+        total = sum(leaves.values())
+        lines.append(f"{thread} ({total} samples)")
+        for leaf, count in leaves.most_common(top):
+            lines.append(f"  {count * 100 / total:5.1f}% {leaf}")
+    return "\n".join(lines)
+
+def _write(samples, summary, directory):
+    os.makedirs(directory, exist_ok=True)
+    base = os.path.join(directory, time.strftime("profile-%Y%m%d-%H%M%S"))
+    with open(base + ".folded", "w", encoding="utf-8") as f:
+        f.write(collapsed(samples) + "\n")
+    with open(base + ".txt", "w", encoding="utf-8") as f:
+        f.write(summary + "\n")
+    return [base + ".folded", base + ".txt"]
@@ -0,0 +1,173 @@
+import json
+import threading
+import time
+import cfg
+import plugins.liblogger as logger
+
+MESSAGES = "messages"
+INFO = "info"
+DISCORD = "discord"
+DROP = "drop"
+ARCHIVE = "archive"
+
+_RULE_ACTIONS = (DISCORD, DROP, ARCHIVE, "default")
+ENCRYPTED = "ENCRYPTED"
+
+class Route():
+    __slots__ = ("action", "channel_ids")
+
+    def __init__(self, action, channel_ids=()):
+        self.action = action
+        self.channel_ids = channel_ids
+
+_MESSAGES_ROUTE = Route(MESSAGES)
+_INFO_ROUTE = Route(INFO)
+_DROP_ROUTE = Route(DROP)
+
+class _Rule():
+    __slots__ = ("channels", "senders", "min_hops", "max_hops", "via_mqtt", "route")
+
+    def matches(self, packet, hops):
+        if self.channels is not None and int(packet.get("channel", 0)) not in self.channels:
+            return False
+        if self.senders is not None and packet.get("from") not in self.senders:
+            return False
+        if self.via_mqtt is not None and bool(packet.get("viaMqtt")) != self.via_mqtt:
+            return False
+        if self.min_hops is not None and (hops is None or hops < self.min_hops):
+            return False
+        if self.max_hops is not None and (hops is None or hops > self.max_hops):
+            return False
+        return True
+
+# portnum -> rules that can match it, in config order
+_index = {}
+_wildcard_rules = []
+_portnum_rules = []
+_local_num = None
+_archive_lock = threading.Lock()
+
+def _node_num(value):
+    if isinstance(value, str):
+        return int(value.lstrip("!"), 16)
+    return int(value)
+
+def _compile_rule(rule):
+    match = rule.get("match") or {}
+    action = rule.get("action", DISCORD)
+    if action not in _RULE_ACTIONS:
+        raise ValueError(f"unknown action '{action}'")
+
+    compiled = _Rule()
+    compiled.channels = frozenset(int(c) for c in match["channel"]) if "channel" in match else None
+    compiled.senders = frozenset(_node_num(n) for n in match["from"]) if "from" in match else None
+    compiled.min_hops = match.get("min_hops")
+    compiled.max_hops = match.get("max_hops")
+    compiled.via_mqtt = match.get("via_mqtt")
+    if action == DISCORD:
+        compiled.route = Route(DISCORD, tuple(rule.get("channel_ids", ())))
+    elif action == "default":
+        compiled.route = None
+    else:
+        compiled.route = Route(action)
+    portnums = frozenset(match["portnum"]) if "portnum" in match else None
+    return compiled, portnums
+
+def compile_rules(rules):
+    global _wildcard_rules, _portnum_rules
+    _index.clear()
+    _wildcard_rules = []
+    _portnum_rules = []
+    for position, rule in enumerate(rules or []):
+        try:
+            compiled, portnums = _compile_rule(rule)
+        except (KeyError, TypeError, ValueError) as e:
+            logger.warn(f"Ignoring invalid routing rule {rule}: {e}")
+            continue
+        if portnums is None:
+            _wildcard_rules.append((position, compiled))
+        else:
+            _portnum_rules.append((position, compiled, portnums))
+    logger.info(f"Compiled {len(_wildcard_rules) + len(_portnum_rules)} routing rules")
+
+def _rules_for(portnum):
+    rules = _index.get(portnum)
+    if rules is None:
+        candidates = list(_wildcard_rules)
+        candidates += [(position, rule) for position, rule, portnums in _portnum_rules if portnum in portnums]
+        rules = tuple(rule for position, rule in sorted(candidates, key=lambda c: c[0]))
+        _index[portnum] = rules
+    return rules
+
+def set_local_node(interface):
+    global _local_num
+    _local_num = None
+    local_node_num(interface)
+
+def clear_local_node():
+    global _local_num
+    _local_num = None
+
+def local_node_num(interface):
+    global _local_num
+    if _local_num is None:
+        try:
+            _local_num = int(interface.getMyNodeInfo()["num"])
+        except (TypeError, KeyError):
+            return None
+    return _local_num
+
+def packet_hops(packet):
+    if "hopStart" in packet and "hopLimit" in packet:
+        return packet["hopStart"] - packet["hopLimit"]
+    return None
+
+def decide(packet, interface):
+    if "decoded" in packet:
+        portnum = packet["decoded"]["portnum"]
+    else:
+        portnum = ENCRYPTED
+
+    rules = _rules_for(portnum)
+    if rules:
+        hops = packet_hops(packet)
+        for rule in rules:
+            if rule.matches(packet, hops):
+                if rule.route is not None:
+                    return rule.route
+                break
+
+    if not cfg.config["use_discord"]:
+        return _DROP_ROUTE
+    if portnum == "TEXT_MESSAGE_APP":
+        return _MESSAGES_ROUTE
+    if portnum == ENCRYPTED:
+        return _INFO_ROUTE
+    if not cfg.config["send_packets"]:
+        return _DROP_ROUTE
+    if cfg.config["ignore_self"]:
+        local_num = local_node_num(interface)
+        if local_num is None:
+            logger.infoimportant("We don't have our own nodenum yet.")
+        elif packet.get("from") == local_num:
+            return _DROP_ROUTE
+    return _INFO_ROUTE
+
+def archive(packet):
+    decoded = packet.get("decoded", {})
+    record = {
+        "time": int(time.time()),
+        "from": packet.get("fromId"),
+        "to": packet.get("toId"),
+        "channel": packet.get("channel", 0),
+        "portnum": decoded.get("portnum", ENCRYPTED),
+        "hops": packet_hops(packet),
+        "snr": packet.get("rxSnr"),
+        "viaMqtt": bool(packet.get("viaMqtt")),
+    }
+    if "text" in decoded:
+        record["text"] = decoded["text"]
+    line = json.dumps(record, default=str)
+    with _archive_lock:
+        with open(cfg.config["routing_archive_file"], "a", encoding="utf-8") as f:
+            f.write(line + "\n")
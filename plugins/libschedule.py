@@ -0,0 +1,104 @@
+import asyncio
+import datetime
+import plugins.libasync as LibAsync
+import plugins.liblogger as logger
+
+# minute hour day month weekday
+_FIELD_RANGES = [(0, 59), (0, 23), (1, 31), (1, 12), (0, 6)]
+_MAX_SEARCH = datetime.timedelta(days=366 * 5)
+
+def _parse_field(field, low, high):
+    values = set()
+    for part in field.split(","):
+        step = 1
+        if "/" in part:
+            part, step_str = part.split("/", 1)
+            step = int(step_str)
+            if step < 1:
+                raise ValueError("cron step must be positive")
+        if part == "*":
+            start, end = low, high
+        elif "-" in part:
+            start_str, end_str = part.split("-", 1)
+            start, end = int(start_str), int(end_str)
+        else:
+            start = int(part)
+            end = high if step > 1 else start
+        if high == 6 and start == 7 and end == 7:
+            # 7 is sunday too
+            start = end = 0
+        elif high == 6 and end == 7:
+            values.add(0)
+            end = 6
+        if start < low or end > high or start > end:
+            raise ValueError(f"cron field '{field}' out of range {low}-{high}")
+        values.update(range(start, end + 1, step))
+    return frozenset(values)
+
+class CronExpr():
+    """Five field cron expression (minute hour day month weekday), weekday 0 is sunday.
+    CronExpr("0 7,17 * * *").next_after(datetime.datetime.now())
+    """
+
+    def __init__(self, expr):
+        fields = expr.split()
+        if len(fields) != 5:
+            raise ValueError(f"cron expression '{expr}' needs 5 fields")
+        self.expr = expr
+        parsed = [_parse_field(f, low, high) for f, (low, high) in zip(fields, _FIELD_RANGES)]
+        self.minutes, self.hours, self.days, self.months, self.weekdays = parsed
+        self.any_day = fields[2] == "*"
+        self.any_weekday = fields[4] == "*"
+
+    def _day_matches(self, dt):
+        day_ok = dt.day in self.days
+        weekday_ok = (dt.weekday() + 1) % 7 in self.weekdays
+        # classic cron: when both day fields are restricted either one may match
+        if not self.any_day and not self.any_weekday:
+            return day_ok or weekday_ok
+        return day_ok and weekday_ok
+
+    def matches(self, dt):
+        return (dt.minute in self.minutes and dt.hour in self.hours
+                and dt.month in self.months and self._day_matches(dt))
+
+    def next_after(self, dt):
+        t = dt.replace(second=0, microsecond=0) + datetime.timedelta(minutes=1)
+        limit = dt + _MAX_SEARCH
+        while t < limit:
+            if t.month not in self.months:
+                t = (t.replace(day=1, hour=0, minute=0) + datetime.timedelta(days=32)).replace(day=1)
+            elif not self._day_matches(t):
+                t = t.replace(hour=0, minute=0) + datetime.timedelta(days=1)
+            elif t.hour not in self.hours:
+                t = t.replace(minute=0) + datetime.timedelta(hours=1)
+            elif t.minute not in self.minutes:
+                t += datetime.timedelta(minutes=1)
+            else:
+                return t
+        raise ValueError(f"cron expression '{self.expr}' never fires")
+
+class Scheduler():
+    """Runs blocking callbacks on cron schedules from the shared asyncio loop.
+    Callbacks run in the loop's executor so a slow fetch never delays other jobs.
+    """
+
+    def __init__(self):
+        self.jobs = []
+
+    def add(self, expr, callback, name=""):
+        job = (CronExpr(expr), callback, name or expr)
+        self.jobs.append(job)
+        LibAsync.submit(self._run_job(job))
+
+    async def _run_job(self, job):
+        cron, callback, name = job
+        loop = asyncio.get_running_loop()
+        while True:
+            now = datetime.datetime.now()
+            delay = (cron.next_after(now) - now).total_seconds()
+            await asyncio.sleep(max(delay, 0))
+            try:
+                await loop.run_in_executor(None, callback)
+            except Exception as e:
+                logger.warn(f"Scheduled job {name} failed: {e}")
@@ -0,0 +1,202 @@
+import collections
+import heapq
+import itertools
+import json
+import os
+import threading
+import time
+import plugins.liblogger as logger
+
+# acked records kept in the journal before it is rewritten with only the pending ones
+_COMPACT_AFTER = 5000
+# ids remembered for deduplication, acked or not
+_KNOWN_IDS = 20000
+_MAX_RETRY_DELAY = 30
+# about half an hour of retries once the delay is capped
+_MAX_ATTEMPTS = 60
+
+_cond = threading.Condition()
+_file = None
+_path = None
+_fsync_interval = 0.0
+_writes = []
+_flushed = threading.Event()
+_flushed.set()
+_acked = 0
+
+# id -> [kind, payload, attempts], in the order they were spooled
+_items = collections.OrderedDict()
+_known = collections.OrderedDict()
+_ready = collections.deque()
+_retries = []
+_senders = {}
+_ids = itertools.count()
+
+def running():
+    return _file is not None
+
+def start(path, fsync_ms=20):
+    """Open the journal, queue whatever was not delivered before the last stop and start the
+    writer and dispatcher threads"""
+    global _file, _path, _fsync_interval
+    _path = path
+    _fsync_interval = fsync_ms / 1000
+    if os.path.exists(path):
+        _load(path)
+    _compact()
+    _file = open(path, "a", encoding="utf-8")
+    _ready.extend(_items)
+    if _items:
+        logger.infoimportant(f"Replaying {len(_items)} spooled messages")
+    threading.Thread(target=_writer, name="spool-writer", daemon=True).start()
+    threading.Thread(target=_dispatcher, name="spool-dispatch", daemon=True).start()
+
+def _load(path):
+    with open(path, "r", encoding="utf-8") as f:
+        for line in f:
+            try:
+                record = json.loads(line)
+            except ValueError:
+                # a torn last line from a crash mid write
+                continue
+            if record["op"] == "add":
+                if record["id"] not in _known:
+                    _items[record["id"]] = [record["kind"], record["payload"], 0]
+                _remember(record["id"])
+            elif record["op"] == "ack":
+                _items.pop(record["id"], None)
+                _remember(record["id"])
+
+def _remember(msg_id):
+    _known[msg_id] = True
+    _known.move_to_end(msg_id)
+    if len(_known) > _KNOWN_IDS:
+        _known.popitem(last=False)
+
+def _compact():
+    global _file, _acked
+    tmp = _path + ".tmp"
+    with open(tmp, "w", encoding="utf-8") as f:
+        for msg_id, (kind, payload, _) in _items.items():
+            f.write(json.dumps({"op": "add", "id": msg_id, "kind": kind, "payload": payload}) + "\n")
+        f.flush()
+        os.fsync(f.fileno())
+    if _file is not None:
+        _file.close()
+    os.replace(tmp, _path)
+    if _file is not None:
+        _file = open(_path, "a", encoding="utf-8")
+    _acked = 0
+
+def register(kind, sender):
+    """sender(payload, done) delivers one message and calls done(True) once it went out
+    or done(False) to have it retried later"""
+    with _cond:
+        _senders[kind] = sender
+        _cond.notify_all()
+
+def put(kind, payload, msg_id=None):
+    """Spool a message, returns False when msg_id was already spooled"""
+    if msg_id is None:
+        msg_id = f"{kind}:{time.time_ns()}:{next(_ids)}"
+    with _cond:
+        if msg_id in _known:
+            return False
+        _remember(msg_id)
+        _items[msg_id] = [kind, payload, 0]
+        _writes.append({"op": "add", "id": msg_id, "kind": kind, "payload": payload})
+        _flushed.clear()
+        _cond.notify_all()
+    return True
+
+def _done(msg_id, ok):
+    with _cond:
+        item = _items.get(msg_id)
+        if item is None:
+            return
+        if ok:
+            del _items[msg_id]
+            _writes.append({"op": "ack", "id": msg_id})
+            _flushed.clear()
+        elif item[2] >= _MAX_ATTEMPTS:
+            logger.warn(f"Giving up on spooled {item[0]} message after {item[2]} attempts")
+            del _items[msg_id]
+            _writes.append({"op": "ack", "id": msg_id})
+            _flushed.clear()
+        else:
+            item[2] += 1
+            heapq.heappush(_retries, (time.monotonic() + min(2 ** item[2], _MAX_RETRY_DELAY), msg_id))
+        _cond.notify_all()
+
+def _writer():
+    global _acked
+    while True:
+        with _cond:
+            while not _writes:
+                _cond.wait()
+            batch = _writes[:]
+            del _writes[:]
+        for record in batch:
+            _file.write(json.dumps(record) + "\n")
+        _file.flush()
+        os.fsync(_file.fileno())
+        # only hand messages out once they are on disk
+        with _cond:
+            for record in batch:
+                if record["op"] == "add":
+                    _ready.append(record["id"])
+                else:
+                    _acked += 1
+            if _acked > _COMPACT_AFTER:
+                _compact()
+            if not _writes:
+                _flushed.set()
+            _cond.notify_all()
+        if _fsync_interval:
+            time.sleep(_fsync_interval)
+
+def _next_ready():
+    # oldest message whose kind has a sender, the others keep their order
+    for _ in range(len(_ready)):
+        msg_id = _ready.popleft()
+        item = _items.get(msg_id)
+        if item is None:
+            continue
+        if item[0] in _senders:
+            return msg_id
+        _ready.append(msg_id)
+    return None
+
+def _dispatcher():
+    while True:
+        with _cond:
+            while True:
+                now = time.monotonic()
+                while _retries and _retries[0][0] <= now:
+                    _ready.append(heapq.heappop(_retries)[1])
+                msg_id = _next_ready()
+                if msg_id is not None:
+                    break
+                _cond.wait(_retries[0][0] - now if _retries else None)
+            kind, payload, _ = _items[msg_id]
+            sender = _senders[kind]
+        try:
+            sender(payload, lambda ok, msg_id=msg_id: _done(msg_id, ok))
+        except Exception as e:
+            logger.warn(f"Spooled {kind} message failed, retrying: {e}")
+            _done(msg_id, False)
+
+def pending():
+    with _cond:
+        return len(_items)
+
+def drain(deadline):
+    """Wait up to deadline seconds for spooled messages to go out and the journal to be synced,
+    returns how many are left for the next start"""
+    end = time.monotonic() + deadline
+    with _cond:
+        while _items and time.monotonic() < end:
+            _cond.wait(max(0, end - time.monotonic()))
+    if running():
+        _flushed.wait(max(0, end - time.monotonic()))
+    return pending()
@@ -0,0 +1,207 @@
+import array
+import base64
+import bisect
+import collections
+import itertools
+import json
+import math
+import operator
+import os
+import threading
+import time
+import cfg
+import plugins.liblogger as logger
+
+# telemetry key -> metric name, the order is the row order inside every ring
+METRICS = {
+    "batteryLevel": "battery",
+    "voltage": "voltage",
+    "channelUtilization": "chutil",
+    "airUtilTx": "airtx",
+    "temperature": "temperature",
+    "relativeHumidity": "humidity",
+    "barometricPressure": "pressure",
+}
+_METRIC_INDEX = {name: i for i, name in enumerate(METRICS.values())}
+_NAN = float("nan")
+
+# name -> (seconds per slot, slots), raw keeps every sample
+RESOLUTIONS = {
+    "raw": (0, 128),
+    "5m": (300, 288),
+    "1h": (3600, 168),
+}
+
+class Ring():
+    """Fixed size ring of timestamps and one float row per metric, memory never grows"""
+    __slots__ = ("step", "size", "cursor", "times", "values", "bucket", "sums", "counts")
+
+    def __init__(self, step, size):
+        self.step = step
+        self.size = size
+        self.cursor = 0
+        self.times = array.array("d", [0.0]) * size
+        self.values = array.array("f", [_NAN]) * (size * len(_METRIC_INDEX))
+        # running sums of the bucket that is still open
+        self.bucket = None
+        self.sums = array.array("d", [0.0]) * len(_METRIC_INDEX)
+        self.counts = array.array("I", [0]) * len(_METRIC_INDEX)
+
+    def _write(self, when, row):
+        slot = self.cursor
+        self.times[slot] = when
+        for i, value in enumerate(row):
+            self.values[i * self.size + slot] = value
+        self.cursor = (slot + 1) % self.size
+
+    def add(self, when, row):
+        if self.step == 0:
+            self._write(when, row)
+            return
+        bucket = int(when // self.step)
+        if self.bucket is not None and bucket != self.bucket:
+            self._close_bucket()
+        self.bucket = bucket
+        for i, value in enumerate(row):
+            if not math.isnan(value):
+                self.sums[i] += value
+                self.counts[i] += 1
+
+    def _close_bucket(self):
+        row = [self.sums[i] / self.counts[i] if self.counts[i] else _NAN for i in range(len(self.sums))]
+        self._write(self.bucket * self.step, row)
+        for i in range(len(self.sums)):
+            self.sums[i] = 0.0
+            self.counts[i] = 0
+
+    def series(self, metric, since=0):
+        """(time, value) oldest first, the bucket that is still open is the last point.
+        The work is array slices, a bisect and itertools over them, no python loop per slot"""
+        index = _METRIC_INDEX[metric]
+        base = index * self.size
+        # rotate so the oldest slot comes first, slots never written have time 0 and sort first
+        times = self.times[self.cursor:] + self.times[:self.cursor]
+        row = self.values[base + self.cursor:base + self.size] + self.values[base:base + self.cursor]
+        start = bisect.bisect_right(times, 0) if since <= 0 else bisect.bisect_left(times, since)
+        times, row = times[start:], row[start:]
+        # nan != nan, so this keeps the slots that have a value
+        points = list(itertools.compress(zip(times, row), map(operator.eq, row, row)))
+        if self.bucket is not None and self.counts[index]:
+            when = self.bucket * self.step
+            if when >= since:
+                points.append((when, self.sums[index] / self.counts[index]))
+        return points
+
+    def to_json(self):
+        return {"cursor": self.cursor, "bucket": self.bucket,
+                "times": _pack(self.times), "values": _pack(self.values),
+                "sums": _pack(self.sums), "counts": _pack(self.counts)}
+
+    @classmethod
+    def from_json(cls, step, size, data):
+        ring = cls(step, size)
+        for name in ("times", "values", "sums", "counts"):
+            loaded = array.array(getattr(ring, name).typecode)
+            loaded.frombytes(base64.b64decode(data[name]))
+            if len(loaded) != len(getattr(ring, name)):
+                raise ValueError(f"{name} has {len(loaded)} slots, expected {len(getattr(ring, name))}")
+            setattr(ring, name, loaded)
+        ring.cursor = data["cursor"] % size
+        ring.bucket = data["bucket"]
+        return ring
+
+def _pack(values):
+    return base64.b64encode(values.tobytes()).decode()
+
+# node num -> {resolution name: Ring}, least recently recorded first, capped like the node table
+_series = collections.OrderedDict()
+_lock = threading.Lock()
+_dirty = False
+
+def record(num, telemetry, when=None):
+    global _dirty
+    row = [_NAN] * len(_METRIC_INDEX)
+    found = False
+    for group in ("deviceMetrics", "environmentMetrics"):
+        for key, value in telemetry.get(group, {}).items():
+            if key in METRICS and isinstance(value, (int, float)):
+                row[_METRIC_INDEX[METRICS[key]]] = float(value)
+                found = True
+    if not found:
+        return
+    when = when or time.time()
+    with _lock:
+        rings = _series.get(num)
+        if rings is None:
+            rings = _series[num] = {name: Ring(step, size) for name, (step, size) in RESOLUTIONS.items()}
+            _trim()
+        else:
+            _series.move_to_end(num)
+        for ring in rings.values():
+            ring.add(when, row)
+        _dirty = True
+
+def _trim():
+    while len(_series) > cfg.config["node_table_max_nodes"]:
+        _series.popitem(last=False)
+
+def series(num, metric, resolution="5m", since=0):
+    with _lock:
+        rings = _series.get(num)
+        if rings is None:
+            return []
+        return rings[resolution].series(metric, since)
+
+def summary(points):
+    values = [v for t, v in points]
+    if not values:
+        return None
+    return min(values), max(values), sum(values) / len(values), values[-1]
+
+_SPARKS = "▁▂▃▄▅▆▇█"
+
+def sparkline(points, width):
+    values = [v for t, v in points]
+    if not values:
+        return ""
+    if len(values) > width:
+        # average neighbouring points down to the requested width
+        chunk = len(values) / width
+        values = [sum(part) / len(part) for part in
+                  (values[int(i * chunk):max(int((i + 1) * chunk), int(i * chunk) + 1)] for i in range(width))]
+    low, high = min(values), max(values)
+    span = (high - low) or 1
+    return "".join(_SPARKS[int((v - low) / span * (len(_SPARKS) - 1))] for v in values)
+
+def load(path):
+    """Snapshots are json with the ring arrays as base64 bytes, rings whose resolution
+    changed since the snapshot was written are dropped"""
+    if not os.path.exists(path):
+        return
+    try:
+        with open(path, "r", encoding="utf-8") as f:
+            stored = json.load(f)
+        loaded = collections.OrderedDict()
+        for num, rings in stored["nodes"]:
+            loaded[int(num)] = {name: Ring.from_json(step, size, rings[name]) for name, (step, size) in RESOLUTIONS.items()}
+    except (OSError, ValueError, KeyError, TypeError) as e:
+        logger.warn(f"Could not read telemetry snapshot {path}: {e}")
+        return
+    with _lock:
+        _series.update(loaded)
+        _trim()
+    logger.info(f"Loaded telemetry for {len(loaded)} nodes")
+
+def snapshot(path):
+    global _dirty
+    with _lock:
+        if not _dirty:
+            return
+        # a list keeps the least recently recorded first order
+        data = json.dumps({"nodes": [[num, {name: ring.to_json() for name, ring in rings.items()}]
+                                     for num, rings in _series.items()]})
+        _dirty = False
+    tmp = path + ".tmp"
+    with open(tmp, "w", encoding="utf-8") as f:
+        f.write(data)
+    os.replace(tmp, path)
@@ -0,0 +1,209 @@
+import heapq
+import threading
+import time
+import cfg
+
+class Edge():
+    __slots__ = ("snr", "rssi", "seen", "cost")
+
+    def __init__(self, snr, rssi, seen):
+        self.snr = snr
+        self.rssi = rssi
+        self.seen = seen
+        self.cost = link_cost(snr)
+
+def link_cost(snr):
+    # hop count first, snr only breaks ties, bucketed so noise does not change routes
+    if snr is None:
+        return 1.5
+    if snr >= 5:
+        return 1.0
+    if snr >= 0:
+        return 1.25
+    if snr >= -7:
+        return 1.5
+    return 2.0
+
+# node num -> {neighbor num: Edge}, links are stored in both directions
+_adjacency = {}
+# node num -> (hops away, time) from the hop counters of the last packet heard
+_hops = {}
+_lock = threading.Lock()
+_local = None
+
+# shortest path tree from our node, repaired in place when links improve and
+# rebuilt on the next query when a link gets worse or expires
+_dist = {}
+_parent = {}
+_needs_rebuild = True
+version = 0
+
+def set_local(num):
+    global _local, _needs_rebuild
+    with _lock:
+        _local = num
+        _needs_rebuild = True
+
+def _ttl():
+    return cfg.config["topology_edge_ttl_minutes"] * 60
+
+def _set_edge(a, b, snr, rssi, now):
+    global _needs_rebuild, version
+    if a is None or b is None or a == b:
+        return
+    edge = _adjacency.get(a, {}).get(b)
+    old_cost = edge.cost if edge else None
+    edge = Edge(snr, rssi, now)
+    _adjacency.setdefault(a, {})[b] = edge
+    _adjacency.setdefault(b, {})[a] = edge
+    if old_cost is None or edge.cost < old_cost:
+        _relax_from(a, b, edge.cost)
+        _relax_from(b, a, edge.cost)
+        version += 1
+    elif edge.cost > old_cost:
+        _needs_rebuild = True
+        version += 1
+
+def _relax_from(u, v, cost):
+    if _needs_rebuild or u not in _dist:
+        return
+    if _dist[u] + cost >= _dist.get(v, float("inf")):
+        return
+    _dist[v] = _dist[u] + cost
+    _parent[v] = u
+    heap = [(_dist[v], v)]
+    while heap:
+        d, node = heapq.heappop(heap)
+        if d > _dist.get(node, float("inf")):
+            continue
+        for neighbor, edge in _adjacency.get(node, {}).items():
+            nd = d + edge.cost
+            if nd < _dist.get(neighbor, float("inf")):
+                _dist[neighbor] = nd
+                _parent[neighbor] = node
+                heapq.heappush(heap, (nd, neighbor))
+
+def _expire(now):
+    global _needs_rebuild, version
+    cutoff = now - _ttl()
+    for a, neighbors in list(_adjacency.items()):
+        for b, edge in list(neighbors.items()):
+            if edge.seen < cutoff:
+                del neighbors[b]
+                _needs_rebuild = True
+                version += 1
+        if not neighbors:
+            del _adjacency[a]
+
+def _rebuild():
+    global _needs_rebuild
+    _dist.clear()
+    _parent.clear()
+    _needs_rebuild = False
+    if _local is None:
+        return
+    _dist[_local] = 0
+    heap = [(0, _local)]
+    while heap:
+        d, node = heapq.heappop(heap)
+        if d > _dist[node]:
+            continue
+        for neighbor, edge in _adjacency.get(node, {}).items():
+            nd = d + edge.cost
+            if nd < _dist.get(neighbor, float("inf")):
+                _dist[neighbor] = nd
+                _parent[neighbor] = node
+                heapq.heappush(heap, (nd, neighbor))
+
+def _fresh_tree():
+    _expire(time.time())
+    if _needs_rebuild:
+        _rebuild()
+
+def update(packet):
+    sender = packet.get("from")
+    if sender is None:
+        return
+    now = time.time()
+    with _lock:
+        hops = None
+        if "hopStart" in packet and "hopLimit" in packet:
+            hops = packet["hopStart"] - packet["hopLimit"]
+            _hops[sender] = (hops, now)
+        if hops == 0 and not packet.get("viaMqtt"):
+            _set_edge(_local, sender, packet.get("rxSnr"), packet.get("rxRssi"), now)
+
+        decoded = packet.get("decoded")
+        if decoded is None:
+            return
+        portnum = decoded.get("portnum")
+        if portnum == "NEIGHBORINFO_APP":
+            info = decoded.get("neighborinfo", {})
+            reporter = info.get("nodeId", sender)
+            for neighbor in info.get("neighbors", []):
+                _set_edge(reporter, neighbor.get("nodeId"), neighbor.get("snr"), None, now)
+        elif portnum == "TRACEROUTE_APP":
+            trace = decoded.get("traceroute", {})
+            # route goes from the requester to the responder, snr values are scaled by 4
+            towards = [packet.get("to")] + list(trace.get("route", [])) + [sender]
+            _set_chain(towards, trace.get("snrTowards", []), now)
+            if "routeBack" in trace:
+                back = [sender] + list(trace["routeBack"]) + [packet.get("to")]
+                _set_chain(back, trace.get("snrBack", []), now)
+
+def _set_chain(chain, snrs, now):
+    for i in range(len(chain) - 1):
+        snr = snrs[i] / 4 if i < len(snrs) and snrs[i] != -128 else None
+        _set_edge(chain[i], chain[i + 1], snr, None, now)
+
+def path_to(num):
+    """Nodes from our own node to num over the best known links, or None"""
+    with _lock:
+        _fresh_tree()
+        if num not in _dist:
+            return None
+        path = [num]
+        while path[-1] != _local:
+            path.append(_parent[path[-1]])
+        return path[::-1]
+
+def hops_away(num):
+    with _lock:
+        entry = _hops.get(num)
+        if entry is None or time.time() - entry[1] > _ttl():
+            return None
+        return entry[0]
+
+def neighbors(num):
+    now = time.time()
+    with _lock:
+        return sorted(((b, e.snr, now - e.seen) for b, e in _adjacency.get(num, {}).items() if now - e.seen <= _ttl()),
+                      key=lambda n: -(n[1] if n[1] is not None else -99))
+
+def reachable():
+    with _lock:
+        _fresh_tree()
+        return len(_dist) - (1 if _local in _dist else 0)
+
+def tree(name_of, max_lines=40):
+    """Text rendering of the shortest path tree from our node"""
+    with _lock:
+        _fresh_tree()
+        if _local is None:
+            return []
+        children = {}
+        for node, parent in _parent.items():
+            children.setdefault(parent, []).append(node)
+        lines = []
+        stack = [(_local, 0)]
+        while stack and len(lines) < max_lines:
+            node, depth = stack.pop()
+            edge = _adjacency.get(_parent.get(node), {}).get(node)
+            snr = f" {edge.snr}dB" if edge and edge.snr is not None else ""
+            lines.append("  " * depth + ("└ " if depth else "") + name_of(node) + snr)
+            for child in sorted(children.get(node, []), key=lambda c: -_dist[c]):
+                stack.append((child, depth + 1))
+        hidden = len(_dist) - len(lines)
+        if hidden > 0:
+            lines.append(f"... {hidden} more")
+        return lines
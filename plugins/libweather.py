@@ -0,0 +1,141 @@
+import bisect
+import concurrent.futures
+import threading
+import time
+import requests
+import plugins.liblogger as logger
+
+# open-meteo takes comma separated coordinate lists, keep urls a sane length
+_MAX_LOCATIONS = 100
+# cached locations per endpoint, expired ones go first and then the oldest
+_MAX_CACHED = 4 * _MAX_LOCATIONS
+
+class Batcher():
+    """Collects lookups for one open-meteo endpoint over a short window and fetches them
+    with a single multi-location request, results are cached per rounded coordinate"""
+
+    def __init__(self, name, url, digits, ttl):
+        self.name = name
+        self.url = url
+        self.digits = digits
+        self.ttl = ttl
+        self.window = 0.2
+        self._cache = {}
+        self._waiting = {}
+        self._cond = threading.Condition()
+        self._thread = None
+
+    def start(self):
+        # started by the plugin, not at import, so worker children and tools that import this stay thread free
+        if self._thread is None:
+            self._thread = threading.Thread(target=self._run, name="weather-" + self.name, daemon=True)
+            self._thread.start()
+
+    def _key(self, lat, lon):
+        return (round(float(lat), self.digits), round(float(lon), self.digits))
+
+    def _submit(self, key):
+        with self._cond:
+            cached = self._cache.get(key)
+            if cached and time.monotonic() - cached[0] < self.ttl:
+                future = concurrent.futures.Future()
+                future.set_result(cached[1])
+                return future
+            future = self._waiting.get(key)
+            if future is None:
+                future = self._waiting[key] = concurrent.futures.Future()
+                self._cond.notify()
+            return future
+
+    def get(self, lat, lon, timeout=30):
+        """Data for one location, raises if the request failed"""
+        return self._submit(self._key(lat, lon)).result(timeout)
+
+    def prefetch(self, coords):
+        for lat, lon in coords:
+            self._submit(self._key(lat, lon))
+
+    def _run(self):
+        while True:
+            with self._cond:
+                while not self._waiting:
+                    self._cond.wait()
+            # let the burst arrive
+            time.sleep(self.window)
+            with self._cond:
+                batch = self._waiting
+                self._waiting = {}
+            keys = list(batch)
+            for start in range(0, len(keys), _MAX_LOCATIONS):
+                self._fetch(keys[start:start + _MAX_LOCATIONS], batch)
+
+    def _fetch(self, keys, futures):
+        lats = ",".join(str(lat) for lat, _ in keys)
+        lons = ",".join(str(lon) for _, lon in keys)
+        try:
+            separator = "&" if "?" in self.url else "?"
+            res = requests.get(f"{self.url}{separator}latitude={lats}&longitude={lons}", timeout=20)
+            res.raise_for_status()
+            results = split_locations(res.json(), len(keys))
+        except Exception as e:
+            logger.warn(f"Fetching {self.name} for {len(keys)} locations failed: {e}")
+            for key in keys:
+                futures[key].set_exception(e)
+            return
+        now = time.monotonic()
+        with self._cond:
+            for key, result in zip(keys, results):
+                self._cache[key] = (now, result)
+            # drop what expired so the cache does not grow with every node ever seen
+            if len(self._cache) > _MAX_CACHED:
+                self._cache = {k: v for k, v in self._cache.items() if now - v[0] < self.ttl}
+            if len(self._cache) > _MAX_CACHED:
+                newest = sorted(self._cache.items(), key=lambda item: item[1][0])[-_MAX_CACHED // 2:]
+                self._cache = dict(newest)
+        for key, result in zip(keys, results):
+            futures[key].set_result(result)
+        logger.info(f"Fetched {self.name} for {len(keys)} locations in one request")
+
+def split_locations(data, count):
+    """One result per requested location, open-meteo answers a single location with an
+    object, several with a list, and elevation with one list of values"""
+    if isinstance(data, list):
+        results = data
+    elif set(data) == {"elevation"}:
+        results = [{"elevation": [e]} for e in data["elevation"]]
+    else:
+        results = [data]
+    if len(results) != count:
+        raise ValueError(f"asked for {count} locations, got {len(results)}")
+    return results
+
+def hourly_slice(data, names, hours, now=None):
+    """(local hour, values of names...) for the next hours, found by bisecting the unixtime
+    axis once and slicing every column instead of indexing row by row"""
+    hourly = data["hourly"]
+    times = hourly["time"]
+    now = time.time() if now is None else now
+    start = max(bisect.bisect_right(times, now) - 1, 0)
+    end = start + hours
+    offset = data.get("utc_offset_seconds", 0)
+    columns = [hourly[name][start:end] for name in names]
+    local_hours = [(t + offset) // 3600 % 24 for t in times[start:end]]
+    return list(zip(local_hours, *columns))
+
+forecast = Batcher("forecast",
+    "https://api.open-meteo.com/v1/forecast?hourly=temperature_2m,precipitation_probability"
+    "&temperature_unit=fahrenheit&wind_speed_unit=mph&precipitation_unit=inch&timeformat=unixtime&timezone=auto&forecast_days=2",
+    2, 900)
+air_quality = Batcher("air quality",
+    "https://air-quality-api.open-meteo.com/v1/air-quality?current=us_aqi,us_aqi_pm2_5,us_aqi_pm10,us_aqi_nitrogen_dioxide,"
+    "us_aqi_carbon_monoxide,us_aqi_ozone,us_aqi_sulphur_dioxide&timezone=auto&forecast_hours=1&past_hours=1&timeformat=unixtime",
+    2, 900)
+# elevation does not change, cache it for a day at about 10m resolution
+elevation = Batcher("elevation", "https://api.open-meteo.com/v1/elevation", 4, 86400)
+
+def configure(config):
+    for batcher in (forecast, air_quality):
+        batcher.ttl = config["weather_cache_minutes"] * 60
+    for batcher in (forecast, air_quality, elevation):
+        batcher.window = config["weather_batch_ms"] / 1000
+        batcher.start()
@@ -0,0 +1,412 @@
+import base64
+import collections
+import itertools
+import json
+import os
+import struct
+import subprocess
+import sys
+import threading
+import time
+import traceback
+import plugins
+import plugins.liblogger as logger
+import plugins.libcommand as LibCommand
+import plugins.libjson as LibJson
+import plugins.libmesh as LibMesh
+import plugins.libnodes as LibNodes
+import plugins.libprofiler as LibProfiler
+import cfg
+
+# Runs a plugin in a supervised child process, enable it with a line like
+#   chatgpt process pool=2 memory_mb=1024 cpu_seconds=3600 timeout=60
+# in plugins/plugins-enabled. Messages are length prefixed json lists on the
+# child's stdin/stdout, the child's own prints go to stderr.
+
+OP_START = 0
+OP_READY = 1
+OP_RECEIVE = 2
+OP_COMMAND = 3
+OP_RESULT = 4
+OP_SEND = 5
+OP_CONNECT = 6
+OP_DISCONNECT = 7
+OP_PROFILE = 8
+
+_HEADER = struct.Struct("!I")
+_MAX_RESTART_DELAY = 60
+
+def _tag_bytes(data):
+    # tagged so the other side gets bytes back, see _restore_bytes
+    return {"__bytes__": LibJson.b64(data)}
+
+def _jsonable(value):
+    return LibJson.jsonable(value, _tag_bytes)
+
+def _restore_bytes(value):
+    if len(value) == 1 and "__bytes__" in value:
+        return base64.b64decode(value["__bytes__"])
+    return value
+
+def write_frame(stream, message):
+    # json and not pickle, unpickling frames from a worker would let it run code in the bridge
+    data = json.dumps(_jsonable(message), default=str).encode()
+    stream.write(_HEADER.pack(len(data)) + data)
+    stream.flush()
+
+def read_frame(stream):
+    header = stream.read(_HEADER.size)
+    if len(header) < _HEADER.size:
+        return None
+    (size,) = _HEADER.unpack(header)
+    data = stream.read(size)
+    if len(data) < size:
+        return None
+    return json.loads(data, object_hook=_restore_bytes)
+
+def _node_state(interface, packet):
+    nodes = {}
+    from_id = packet.get("fromId")
+    node = interface.nodes.get(from_id) if interface.nodes else None
+    if node is not None:
+        nodes[from_id] = _jsonable(node)
+    return {"num": int(interface.localNode.nodeNum), "my_info": _jsonable(interface.getMyNodeInfo()), "nodes": nodes}
+
+def _limit_resources(memory_mb, cpu_seconds):
+    try:
+        import resource
+    except ImportError:
+        return
+    if memory_mb:
+        limit = int(memory_mb) * 1024 * 1024
+        resource.setrlimit(resource.RLIMIT_AS, (limit, limit))
+    if cpu_seconds:
+        resource.setrlimit(resource.RLIMIT_CPU, (int(cpu_seconds), int(cpu_seconds) + 5))
+
+class Worker():
+
+    def __init__(self, pool, index):
+        self.pool = pool
+        self.index = index
+        self.proc = None
+        self.alive = False
+        self.started_at = 0
+        self.write_lock = threading.Lock()
+
+    def spawn(self):
+        env = dict(os.environ, MESHLINK_WORKER="1")
+        self.proc = subprocess.Popen(
+            [sys.executable, "-m", "plugins.libworker", self.pool.path, str(self.pool.memory_mb or 0), str(self.pool.cpu_seconds or 0)],
+            stdin=subprocess.PIPE, stdout=subprocess.PIPE, env=env
+        )
+        self.started_at = time.monotonic()
+        threading.Thread(target=self._read_loop, name=f"worker-{self.pool.name}-{self.index}", daemon=True).start()
+        self.send((OP_START,))
+
+    def send(self, message):
+        try:
+            with self.write_lock:
+                write_frame(self.proc.stdin, message)
+            return True
+        except (OSError, ValueError):
+            return False
+
+    def _read_loop(self):
+        proc = self.proc
+        while True:
+            try:
+                message = read_frame(proc.stdout)
+            except Exception:
+                message = None
+            if message is None:
+                break
+            try:
+                self.pool.handle(self, message)
+            except Exception:
+                # a failed send must not stop the reader, the worker would never be restarted
+                logger.warn(f"Process plugin {self.pool.name} worker {self.index}: handling op {message[0]} failed")
+                traceback.print_exc()
+        proc.wait()
+        self.alive = False
+        self.pool.worker_exited(self, proc.returncode)
+
+class WorkerPool():
+
+    def __init__(self, name, path, options):
+        self.name = name
+        self.path = path
+        self.size = max(1, int(options.get("pool", 1)))
+        self.memory_mb = options.get("memory_mb")
+        self.cpu_seconds = options.get("cpu_seconds")
+        self.timeout = float(options.get("timeout", 30))
+        self.workers = [Worker(self, i) for i in range(self.size)]
+        self.restart_delay = {}
+        self.pending = {}
+        self.pending_lock = threading.Lock()
+        self.seq = itertools.count()
+        self.turn = itertools.count()
+        self.commands = None
+        self.has_receive = False
+        self.ready = threading.Event()
+        self.interface = None
+
+    def start(self):
+        LibProfiler.add_source(self.profile)
+        for worker in self.workers:
+            worker.spawn()
+        if not self.ready.wait(self.timeout):
+            logger.warn(f"Process plugin {self.name} did not start within {self.timeout}s, its commands are added when it does")
+
+    def _register(self):
+        # called once, on the first READY from any worker
+        for name, info, idempotent in self.commands:
+            LibCommand.simpleCommand().registerCommand(
+                name, info, lambda packet, interface, client, args, n=name: self.call(n, packet, interface, args), idempotent
+            )
+        logger.info(f"Process plugin {self.name} running in {self.size} worker(s)")
+
+    def pick(self):
+        for _ in range(self.size):
+            worker = self.workers[next(self.turn) % self.size]
+            if worker.alive:
+                return worker
+        return None
+
+    def handle(self, worker, message):
+        op = message[0]
+        if op == OP_READY:
+            worker.alive = True
+            # every worker sends READY, possibly at the same time from their reader threads
+            with self.pending_lock:
+                first = self.commands is None
+                if first:
+                    self.commands = message[1]
+                    self.has_receive = message[2]
+            if first:
+                self._register()
+                self.ready.set()
+        elif op == OP_RESULT:
+            with self.pending_lock:
+                entry = self.pending.pop(message[1], None)
+            if entry is not None:
+                entry[1].append(message[2])
+                entry[2].set()
+        elif op == OP_SEND:
+            if self.interface is not None:
+                options = message[2]
+                LibMesh.spoolText(self.interface, message[1], options.get("destinationId", "^all"), options.get("channelIndex", 0))
+
+    def worker_exited(self, worker, returncode):
+        with self.pending_lock:
+            for seq, entry in list(self.pending.items()):
+                if entry[0] is worker:
+                    del self.pending[seq]
+                    entry[1].append(f"{self.name} crashed")
+                    entry[2].set()
+
+        # back off while a worker keeps crashing right after start
+        if time.monotonic() - worker.started_at > _MAX_RESTART_DELAY:
+            self.restart_delay[worker.index] = 1
+        delay = self.restart_delay.get(worker.index, 1)
+        self.restart_delay[worker.index] = min(delay * 2, _MAX_RESTART_DELAY)
+        logger.warn(f"Process plugin {self.name} worker {worker.index} exited ({returncode}), restarting in {delay}s")
+        timer = threading.Timer(delay, worker.spawn)
+        timer.daemon = True
+        timer.start()
+
+    def call(self, name, packet, interface, args):
+        self.interface = interface
+        worker = self.pick()
+        if worker is None:
+            return f"{self.name} is restarting"
+
+        seq = next(self.seq)
+        entry = (worker, [], threading.Event())
+        with self.pending_lock:
+            self.pending[seq] = entry
+        if not worker.send((OP_COMMAND, seq, name, _jsonable(packet), _node_state(interface, packet), args)):
+            with self.pending_lock:
+                self.pending.pop(seq, None)
+            return f"{self.name} is restarting"
+        if not entry[2].wait(self.timeout):
+            with self.pending_lock:
+                self.pending.pop(seq, None)
+            return f"{self.name} timed out"
+        return entry[1][0]
+
+    def profile(self, seconds, interval):
+        """Ask every live worker to sample itself, returns a function that waits for the samples,
+        their thread names start with the plugin name and worker index"""
+        entries = []
+        for worker in self.workers:
+            if not worker.alive:
+                continue
+            seq = next(self.seq)
+            entry = (worker, [], threading.Event())
+            with self.pending_lock:
+                self.pending[seq] = entry
+            if worker.send((OP_PROFILE, seq, seconds, interval)):
+                entries.append((seq, entry))
+            else:
+                with self.pending_lock:
+                    self.pending.pop(seq, None)
+
+        def collect():
+            samples = collections.Counter()
+            deadline = time.monotonic() + self.timeout
+            for seq, (worker, result, done) in entries:
+                if not done.wait(max(deadline - time.monotonic(), 0)):
+                    with self.pending_lock:
+                        self.pending.pop(seq, None)
+                    logger.warn(f"Process plugin {self.name} worker {worker.index} sent no profile")
+                    continue
+                # a crashed worker answers with an error text
+                if isinstance(result[0], list):
+                    for thread, stack, count in result[0]:
+                        samples[(f"{self.name}-{worker.index}/{thread}", tuple(stack))] += count
+            return samples
+        return collect
+
+    def receive(self, packet, interface):
+        self.interface = interface
+        if not self.has_receive:
+            return
+        worker = self.pick()
+        if worker is not None:
+            worker.send((OP_RECEIVE, _jsonable(packet), _node_state(interface, packet)))
+
+    def broadcast(self, message):
+        for worker in self.workers:
+            if worker.alive:
+                worker.send(message)
+
+def register(name, path, options):
+    pool = WorkerPool(name, path, options)
+
+    def start(self):
+        pool.start()
+
+    def onReceive(self, packet, interface, client):
+        pool.receive(packet, interface)
+
+    def onConnect(self, interface, client):
+        pool.interface = interface
+        pool.broadcast((OP_CONNECT, {"num": int(interface.localNode.nodeNum), "my_info": _jsonable(interface.getMyNodeInfo()), "nodes": {}}))
+
+    def onDisconnect(self, interface, client):
+        pool.broadcast((OP_DISCONNECT,))
+
+    # subclassing Base adds the proxy to plugins.Base.plugins like any other plugin
+    type(name, (plugins.Base,), {
+        "__module__": name + ".py",
+        "__init__": lambda self: None,
+        "start": start,
+        "onReceive": onReceive,
+        "onConnect": onConnect,
+        "onDisconnect": onDisconnect
+    })
+    return pool
+
+# ============================================================================
+# Worker process side
+# ============================================================================
+
+class _LocalNode():
+    nodeNum = 0
+
+class RemoteInterface():
+    """Stand-in for the meshtastic interface inside a worker, sends go back to the bridge"""
+
+    def __init__(self, stream, lock):
+        self.stream = stream
+        self.lock = lock
+        self.localNode = _LocalNode()
+        self.nodes = {}
+        self.my_info = None
+
+    def update(self, state):
+        self.localNode.nodeNum = state["num"]
+        self.my_info = state["my_info"]
+        self.nodes = state["nodes"]
+        LibNodes.seed(self)
+
+    def getMyNodeInfo(self):
+        return self.my_info
+
+    def sendText(self, text, **kwargs):
+        with self.lock:
+            write_frame(self.stream, (OP_SEND, text, kwargs))
+
+def _call_hook(hook, *args):
+    result = hook(*args)
+    if hasattr(result, "__await__"):
+        import asyncio
+        asyncio.run(result)
+
+def _profile(stream, lock, seq, seconds, interval):
+    try:
+        samples, taken, elapsed = LibProfiler.sample(seconds, interval)
+        result = [[thread, list(stack), count] for (thread, stack), count in samples.items()]
+    except Exception as e:
+        traceback.print_exc()
+        result = f"Error: {e}"
+    with lock:
+        write_frame(stream, (OP_RESULT, seq, result))
+
+def _worker_main(path, memory_mb, cpu_seconds):
+    import yaml
+    _limit_resources(memory_mb, cpu_seconds)
+    proto_in = sys.stdin.buffer
+    proto_out = os.fdopen(os.dup(sys.stdout.fileno()), "wb")
+    os.dup2(sys.stderr.fileno(), sys.stdout.fileno())
+    sys.stdout = sys.stderr
+
+    with open("./config.yml", 'r') as file:
+        cfg.config = yaml.safe_load(file)
+    plugins.load_module(path)
+    instances = [p() for p in plugins.Base.plugins]
+
+    lock = threading.Lock()
+    interface = RemoteInterface(proto_out, lock)
+    while True:
+        message = read_frame(proto_in)
+        if message is None:
+            return
+        op = message[0]
+        try:
+            if op == OP_START:
+                for inst in instances:
+                    inst.start()
+                commands = [(c.name, c.info, c.idempotent) for c in LibCommand.commands]
+                has_receive = any(callable(getattr(inst, "onReceive", None)) for inst in instances)
+                with lock:
+                    write_frame(proto_out, (OP_READY, commands, has_receive))
+            elif op == OP_RECEIVE:
+                interface.update(message[2])
+                for inst in instances:
+                    if callable(getattr(inst, "onReceive", None)):
+                        _call_hook(inst.onReceive, message[1], interface, None)
+            elif op == OP_COMMAND:
+                seq, name, packet, state, args = message[1:]
+                interface.update(state)
+                reply = LibCommand.getCommand(name).executeCommand(packet, interface, None, args)
+                with lock:
+                    write_frame(proto_out, (OP_RESULT, seq, reply))
+            elif op == OP_PROFILE:
+                # sampled from a thread so the worker keeps serving what is being profiled
+                threading.Thread(target=_profile, args=(proto_out, lock) + tuple(message[1:]), name="profiler", daemon=True).start()
+            elif op in (OP_CONNECT, OP_DISCONNECT):
+                if op == OP_CONNECT:
+                    interface.update(message[1])
+                hook_name = "onConnect" if op == OP_CONNECT else "onDisconnect"
+                for inst in instances:
+                    if callable(getattr(inst, hook_name, None)):
+                        _call_hook(getattr(inst, hook_name), interface, None)
+        except Exception as e:
+            traceback.print_exc()
+            if op == OP_COMMAND:
+                with lock:
+                    write_frame(proto_out, (OP_RESULT, message[1], f"Error: {e}"))
+
+if __name__ == "__main__":
+    _worker_main(sys.argv[1], int(sys.argv[2]), int(sys.argv[3]))
@@ -0,0 +1,50 @@
+import plugins
+import plugins.liblogger as logger
+import plugins.libcommand as LibCommand
+import plugins.libmailbox as LibMailbox
+import plugins.libmesh as LibMesh
+import cfg
+
+# discord commands need the radio, it is kept from onConnect
+_state = {"interface": None}
+
+def leave_mail(interface, sender, args):
+    parts = args.split(maxsplit=1)
+    if len(parts) < 2:
+        return f"Usage: {cfg.config['prefix']}mail <node> <text>"
+    if interface is None:
+        return "Node not connected"
+
+    num = LibMesh.findNode(interface, parts[0])
+    if num is None:
+        return f"Unknown node {parts[0]}"
+    waiting = LibMailbox.store(num, sender, parts[1])
+    if waiting is None:
+        return f"Mailbox for {parts[0]} is full"
+    return f"Mail for {parts[0]} saved ({waiting} waiting)"
+
+class mailbox(plugins.Base):
+
+    def __init__(self):
+        pass
+
+    def start(self):
+        logger.info("Loading mailbox")
+        LibMailbox.load()
+
+        def cmd_mail(packet, interface, client, args):
+            return leave_mail(interface, LibMesh.getUserShort(interface, packet) or LibMesh.getUserLong(interface, packet), args)
+        LibCommand.simpleCommand().registerCommand("mail", "mail <node> <text>", cmd_mail)
+
+        async def discord_mail(message, args, client):
+            return leave_mail(_state["interface"], message.author.name, args)
+        LibCommand.discordCommand().registerCommand("mail", "mail <node> <text>", discord_mail, transmits=True)
+
+    def onConnect(self, interface, client):
+        _state["interface"] = interface
+
+    def onReceive(self, packet, interface, client):
+        num = packet.get("from")
+        # mqtt packets do not mean the node can hear us
+        if LibMailbox.has_mail(num) and not packet.get("viaMqtt"):
+            LibMailbox.deliver(num, interface)
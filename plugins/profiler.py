@@ -0,0 +1,37 @@
+import plugins
+import plugins.liblogger as logger
+import plugins.libcommand as LibCommand
+import plugins.libdiscordutil as DiscordUtil
+import plugins.libprofiler as LibProfiler
+import cfg
+
+_MAX_SECONDS = 600
+
+class profiler(plugins.Base):
+
+    def __init__(self):
+        pass
+
+    def start(self):
+        logger.info("Loading profiler")
+
+        async def discord_profile(message, args, client):
+            if message.author.id not in cfg.config["admin_user_ids"]:
+                return "Only admins can profile MeshLink"
+            seconds = cfg.config["profile_seconds"]
+            if args.strip():
+                if not args.strip().isdigit():
+                    return f"Usage: {cfg.config['discord_prefix']}profile [seconds]"
+                seconds = min(max(int(args), 1), _MAX_SECONDS)
+            channel_id = cfg.config["admin_channel_id"] or message.channel.id
+
+            def done(summary, paths):
+                if paths:
+                    logger.infogreen("Profile written to " + paths[0])
+                DiscordUtil.send_files(f"Profile of {seconds}s\n```\n{summary[:1800]}\n```", paths, client, cfg.config, channel_id)
+
+            if not LibProfiler.start(seconds, done, directory=cfg.config["profile_dir"]):
+                return "A profile is already running"
+            logger.info(f"Profiling for {seconds}s, requested by {message.author.name}")
+            return f"Profiling all threads for {seconds}s"
+        LibCommand.discordCommand().registerCommand("profile", "profile [seconds]", discord_profile)
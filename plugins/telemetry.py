@@ -0,0 +1,78 @@
+import threading
+import time
+import plugins
+import plugins.liblogger as logger
+import plugins.libcommand as LibCommand
+import plugins.libmesh as LibMesh
+import plugins.libnodes as LibNodes
+import plugins.libtelemetry as LibTelemetry
+import cfg
+
+_MESH_SPARK_WIDTH = 24
+_DISCORD_SPARK_WIDTH = 60
+
+# used to resolve node names in discord commands
+_state = {"interface": None}
+
+def _snapshot_loop():
+    while True:
+        time.sleep(cfg.config["telemetry_snapshot_minutes"] * 60)
+        try:
+            LibTelemetry.snapshot(cfg.config["telemetry_file"])
+        except OSError as e:
+            logger.warn(f"Telemetry snapshot failed: {e}")
+
+def describe(interface, args, width, resolution):
+    words = args.split()
+    if not words:
+        return None
+    num = LibMesh.findNode(interface, words[0]) if interface else None
+    if num is None:
+        return f"Unknown node {words[0]}"
+    metric = words[1] if len(words) > 1 else "battery"
+    if metric not in LibTelemetry.METRICS.values():
+        return "Metrics: " + " ".join(LibTelemetry.METRICS.values())
+
+    points = LibTelemetry.series(num, metric, resolution)
+    if not points:
+        return f"No {metric} telemetry for {words[0]}"
+    low, high, mean, last = LibTelemetry.summary(points)
+    node = LibNodes.get(num)
+    name = (node and node.short_name) or words[0]
+    hours = round((points[-1][0] - points[0][0]) / 3600, 1)
+    return (f"{name} {metric} {hours}h\n{LibTelemetry.sparkline(points, width)}\n"
+            f"min {round(low, 2)} max {round(high, 2)} avg {round(mean, 2)} now {round(last, 2)}")
+
+class telemetry(plugins.Base):
+
+    def __init__(self):
+        pass
+
+    def start(self):
+        logger.info("Loading telemetry")
+        LibTelemetry.load(cfg.config["telemetry_file"])
+        threading.Thread(target=_snapshot_loop, name="telemetry-snapshot", daemon=True).start()
+
+        def cmd_telemetry(packet, interface, client, args):
+            text = describe(interface, args, _MESH_SPARK_WIDTH, "5m") or f"Usage: {cfg.config['prefix']}telemetry <node> [metric]"
+            return text[:cfg.config["max_message_length"]]
+        LibCommand.simpleCommand().registerCommand("telemetry", "telemetry <node> [metric]", cmd_telemetry)
+
+        async def discord_telemetry(message, args, client):
+            words = args.split()
+            resolution = "5m"
+            if words and words[-1] in LibTelemetry.RESOLUTIONS:
+                resolution = words.pop()
+            text = describe(_state["interface"], " ".join(words), _DISCORD_SPARK_WIDTH, resolution)
+            if text is None:
+                return f"Usage: {cfg.config['discord_prefix']}telemetry <node> [metric] [raw|5m|1h]"
+            return f"```\n{text}\n```"
+        LibCommand.discordCommand().registerCommand("telemetry", "telemetry <node> [metric] [raw|5m|1h]", discord_telemetry)
+
+    def onConnect(self, interface, client):
+        _state["interface"] = interface
+
+    def onReceive(self, packet, interface, client):
+        decoded = packet.get("decoded")
+        if decoded and decoded.get("portnum") == "TELEMETRY_APP" and "telemetry" in decoded:
+            LibTelemetry.record(packet.get("from"), decoded["telemetry"], packet.get("rxTime"))
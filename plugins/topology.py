@@ -0,0 +1,65 @@
+import plugins
+import plugins.liblogger as logger
+import plugins.libcommand as LibCommand
+import plugins.libmesh as LibMesh
+import plugins.libnodes as LibNodes
+import plugins.libtopology as LibTopology
+import cfg
+
+# used to resolve node names in discord commands
+_state = {"interface": None}
+
+def name_of(num):
+    node = LibNodes.get(num)
+    if node and node.short_name:
+        return str(node.short_name)
+    return LibMesh.decimal_to_hex(num)
+
+def describe_route(interface, query):
+    num = LibMesh.findNode(interface, query) if interface else None
+    if num is None:
+        return f"Unknown node {query}"
+    path = LibTopology.path_to(num)
+    hops = LibTopology.hops_away(num)
+    heard = f", heard {hops} hops away" if hops is not None else ""
+    if path is None:
+        return f"No known route to {name_of(num)}{heard}"
+    if len(path) == 2:
+        return f"{name_of(num)} is a direct neighbor{heard}"
+    relays = " > ".join(name_of(n) for n in path[1:-1])
+    return f"{name_of(num)} via {relays} ({len(path) - 1} links{heard})"
+
+class topology(plugins.Base):
+
+    def __init__(self):
+        pass
+
+    def start(self):
+        logger.info("Loading topology")
+
+        def cmd_route(packet, interface, client, args):
+            if not args.strip():
+                return f"Usage: {cfg.config['prefix']}route <node>"
+            return describe_route(interface, args.strip())
+        LibCommand.simpleCommand().registerCommand("route", "route <node>", cmd_route)
+
+        async def discord_topology(message, args, client):
+            query = args.strip()
+            if not query:
+                lines = LibTopology.tree(name_of)
+                return f"{LibTopology.reachable()} reachable nodes\n```\n" + "\n".join(lines) + "\n```"
+            interface = _state["interface"]
+            route = describe_route(interface, query)
+            num = LibMesh.findNode(interface, query) if interface else None
+            if num is None:
+                return route
+            lines = [f"{name_of(n)} {'?' if snr is None else snr}dB {int(age // 60)}m ago" for n, snr, age in LibTopology.neighbors(num)]
+            return route + "\n```\n" + ("\n".join(lines) or "no neighbors known") + "\n```"
+        LibCommand.discordCommand().registerCommand("topology", "topology [node]", discord_topology)
+
+    def onConnect(self, interface, client):
+        _state["interface"] = interface
+        LibTopology.set_local(int(interface.localNode.nodeNum))
+
+    def onReceive(self, packet, interface, client):
+        LibTopology.update(packet)